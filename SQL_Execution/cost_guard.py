@@ -0,0 +1,223 @@
+"""Pre-execution cost guard based on engine EXPLAIN estimates"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# reject: refuse queries over the limits, limit: wrap them in a LIMIT, off: only report estimates (best effort)
+COST_GUARD_MODE = os.getenv("COST_GUARD_MODE", "reject")
+MAX_ESTIMATED_ROWS = float(os.getenv("MAX_ESTIMATED_ROWS", "50000000"))
+MAX_ESTIMATED_BYTES = float(os.getenv("MAX_ESTIMATED_BYTES", str(4 * 1024 ** 3)))
+AUTO_LIMIT_ROWS = int(os.getenv("AUTO_LIMIT_ROWS", "10000"))
+
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1024"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "300"))
+
+READ_QUERY_PATTERN = re.compile(r"^\s*\(*\s*(select|with|values|table)\b", re.IGNORECASE)
+# Trailing row limit of a query; the count is group 1 (LIMIT n, LIMIT m, n, LIMIT n OFFSET m) or 2 (FETCH FIRST)
+LIMIT_PATTERN = re.compile(
+    r"\blimit\s+(?:\d+\s*,\s*)?(\d+)\s*(?:offset\s+\d+\s*)?$|\bfetch\s+first\s+(\d+)\s+rows?\s+only\s*$", re.IGNORECASE
+)
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+class CostGuardError(Exception):
+    """Raised when a query's estimated cost exceeds the configured limits."""
+
+    def __init__(self, message, estimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+def normalize_sql(sql):
+    """Canonical form of a query for plan caching: comments dropped, whitespace
+    collapsed and keywords lowercased outside string literals and quoted identifiers."""
+    sql = re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    parts = re.split(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)", sql)
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            normalized.append(part)
+        else:
+            normalized.append(re.sub(r"\s+", " ", part).lower())
+    return "".join(normalized).strip().rstrip(";").strip()
+
+
+def is_read_query(sql):
+    return bool(READ_QUERY_PATTERN.match(normalize_sql(sql)))
+
+
+class PlanCache:
+    """Thread-safe LRU of EXPLAIN estimates keyed by (engine, normalized SQL)."""
+
+    def __init__(self, max_size=PLAN_CACHE_SIZE, ttl=PLAN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, estimate = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return estimate
+
+    def put(self, key, estimate):
+        with self._lock:
+            self._entries[key] = (time.time(), estimate)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+plan_cache = PlanCache()
+
+
+def _number(value):
+    """Float from EXPLAIN output; None for missing or NaN estimates."""
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def _size_in_bytes(value):
+    """Parse MySQL sizes such as '152', '1K' or '2.5G'."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.match(r"^\s*([\d.]+)\s*([KMGT]?)\s*$", str(value or ""), re.IGNORECASE)
+    if not match:
+        return None
+    return float(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+def _walk(node, key):
+    """Yield every value stored under key anywhere in a nested JSON plan."""
+    if isinstance(node, dict):
+        for name, value in node.items():
+            if name == key:
+                yield value
+            yield from _walk(value, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item, key)
+
+
+def parse_mysql_plan(plan_json):
+    """Estimate from MySQL EXPLAIN FORMAT=JSON."""
+    plan = json.loads(plan_json)
+    tables = list(_walk(plan, "table"))
+    rows = [_number(table.get("rows_produced_per_join")) for table in tables if isinstance(table, dict)]
+    examined = [_number(table.get("rows_examined_per_scan")) for table in tables if isinstance(table, dict)]
+    data_read = [
+        _size_in_bytes(table.get("cost_info", {}).get("data_read_per_join"))
+        for table in tables if isinstance(table, dict)
+    ]
+    query_cost = _number(plan.get("query_block", {}).get("cost_info", {}).get("query_cost"))
+    return {
+        "engine": "mysql",
+        "rows": max([r for r in rows if r is not None], default=None),
+        "rows_examined": sum(r for r in examined if r is not None),
+        "bytes": sum(b for b in data_read if b is not None),
+        "cost": query_cost,
+    }
+
+
+def parse_trino_plan(plan_json):
+    """Estimate from Trino EXPLAIN (TYPE IO, FORMAT JSON)."""
+    plan = json.loads(plan_json)
+    inputs = plan.get("inputTableColumnInfos", [])
+    scanned_rows = [_number(i.get("estimate", {}).get("outputRowCount")) for i in inputs]
+    scanned_bytes = [_number(i.get("estimate", {}).get("outputSizeInBytes")) for i in inputs]
+    output = plan.get("estimate", {})
+    output_rows = _number(output.get("outputRowCount"))
+    known_rows = [r for r in scanned_rows + [output_rows] if r is not None]
+    return {
+        "engine": "trino",
+        "rows": max(known_rows, default=None),
+        "rows_examined": sum(r for r in scanned_rows if r is not None),
+        "bytes": sum(b for b in scanned_bytes if b is not None),
+        "output_rows": output_rows,
+        "cpu_cost": _number(output.get("cpuCost")),
+        "max_memory": _number(output.get("maxMemory")),
+    }
+
+
+EXPLAIN_STATEMENTS = {
+    "mysql": ("EXPLAIN FORMAT=JSON {}", parse_mysql_plan),
+    "trino": ("EXPLAIN (TYPE IO, FORMAT JSON) {}", parse_trino_plan),
+}
+
+
+def estimate_cost(engine, sql, run_explain):
+    """EXPLAIN a query (cached by normalized SQL). run_explain(sql) returns the rows."""
+    key = (engine, normalize_sql(sql))
+    estimate = plan_cache.get(key)
+    if estimate is not None:
+        return dict(estimate, cached=True)
+    template, parse = EXPLAIN_STATEMENTS[engine]
+    started = time.perf_counter()
+    rows = run_explain(template.format(sql.strip().rstrip(";")))
+    estimate = parse(rows[0][0])
+    estimate["explain_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    plan_cache.put(key, estimate)
+    return dict(estimate, cached=False)
+
+
+def _over_limits(estimate):
+    reasons = []
+    if estimate.get("rows") is not None and estimate["rows"] > MAX_ESTIMATED_ROWS:
+        reasons.append(f"estimated rows {estimate['rows']:.0f} > {MAX_ESTIMATED_ROWS:.0f}")
+    if estimate.get("bytes") is not None and estimate["bytes"] > MAX_ESTIMATED_BYTES:
+        reasons.append(f"estimated bytes {estimate['bytes']:.0f} > {MAX_ESTIMATED_BYTES:.0f}")
+    return reasons
+
+
+def add_limit(sql, limit=AUTO_LIMIT_ROWS):
+    """Cap a read query's result size unless it already ends in a LIMIT of at most limit rows."""
+    stripped = sql.strip().rstrip(";")
+    match = LIMIT_PATTERN.search(normalize_sql(stripped))
+    if match and int(match.group(1) or match.group(2)) <= limit:
+        return stripped
+    return f"SELECT * FROM ({stripped}) AS guarded_query LIMIT {limit}"
+
+
+def guard_query(engine, sql, run_explain, mode=None):
+    """Check a query before execution.
+
+    Returns (sql_to_run, estimate). Non-read statements pass through with no
+    estimate; read queries over the limits raise CostGuardError in reject
+    mode or are wrapped in a LIMIT in limit mode. In off mode the estimate is
+    only reported, and a failing EXPLAIN does not stop the query.
+    """
+    mode = mode or COST_GUARD_MODE
+    if engine not in EXPLAIN_STATEMENTS or not is_read_query(sql):
+        return sql, None
+    try:
+        estimate = estimate_cost(engine, sql, run_explain)
+    except Exception as e:
+        if mode != "off":
+            raise
+        print(f"Cost estimate unavailable: {str(e)}")
+        return sql, None
+    reasons = _over_limits(estimate)
+    estimate["over_limits"] = reasons
+    if not reasons or mode == "off":
+        return sql, estimate
+    if mode == "limit":
+        estimate["auto_limited"] = AUTO_LIMIT_ROWS
+        return add_limit(sql), estimate
+    raise CostGuardError("Query rejected by cost guard: " + "; ".join(reasons), estimate)
@@ -0,0 +1,308 @@
+"""Bulk loading of uploaded CSV files into the sales database"""
+
+import csv
+import datetime
+import os
+import re
+import secrets
+import time
+
+# Rows read to infer column types
+CSV_SAMPLE_ROWS = int(os.getenv("CSV_SAMPLE_ROWS", "1000"))
+# Rows per executemany batch on the fallback path
+CSV_BATCH_SIZE = int(os.getenv("CSV_BATCH_SIZE", "5000"))
+
+INT_PATTERN = re.compile(r"^[+-]?\d+$")
+FLOAT_PATTERN = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+BOOL_VALUES = {"true", "false"}
+
+
+class CSVLoadError(Exception):
+    """Raised when an upload cannot be loaded."""
+
+
+def sanitize_identifier(name, fallback):
+    """Turn a file or header name into a safe MySQL identifier."""
+    cleaned = re.sub(r"[^0-9a-zA-Z_]", "_", name.strip()).strip("_").lower()
+    if not cleaned:
+        cleaned = fallback
+    if cleaned[0].isdigit():
+        cleaned = f"_{cleaned}"
+    return cleaned[:64]
+
+
+def _column_names(header):
+    names = []
+    for i, raw in enumerate(header):
+        name = sanitize_identifier(raw, f"column_{i + 1}")
+        base, suffix = name, 2
+        while name in names:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        names.append(name)
+    return names
+
+
+def _is_date(value, fmt):
+    try:
+        datetime.datetime.strptime(value, fmt)
+        return True
+    except ValueError:
+        return False
+
+
+def infer_type(values):
+    """MySQL column type for the non-empty sample values of one column."""
+    values = [value for value in values if value != ""]
+    if not values:
+        return "VARCHAR(255)"
+    if all(INT_PATTERN.match(value) for value in values):
+        largest = max(abs(int(value)) for value in values)
+        return "INT" if largest < 2 ** 31 else "BIGINT"
+    if all(FLOAT_PATTERN.match(value) for value in values):
+        return "DOUBLE"
+    if all(value.lower() in BOOL_VALUES for value in values):
+        return "BOOLEAN"
+    if all(_is_date(value, "%Y-%m-%d") for value in values):
+        return "DATE"
+    if all(_is_date(value.replace("T", " ")[:19], "%Y-%m-%d %H:%M:%S") for value in values):
+        return "DATETIME"
+    # Leave headroom: the sample may not contain the longest value
+    longest = max(len(value) for value in values)
+    if longest * 4 > 4096:
+        return "TEXT"
+    size = 64
+    while size < longest * 4:
+        size *= 2
+    return f"VARCHAR({size})"
+
+
+def read_sample(path, sample_rows=CSV_SAMPLE_ROWS):
+    """Header, the first sample_rows rows and the line terminator of a CSV file."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        first_chunk = f.read(64 * 1024)
+        f.seek(0)
+        reader = csv.reader(f)
+        try:
+            header = next(reader)
+        except StopIteration:
+            raise CSVLoadError("CSV file is empty")
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= sample_rows:
+                break
+    line_terminator = "\r\n" if "\r\n" in first_chunk else "\n"
+    return header, rows, line_terminator
+
+
+def _convert(value, column_type):
+    if value == "":
+        return None
+    if column_type == "BOOLEAN":
+        return value.lower() == "true"
+    if column_type == "DATETIME":
+        return value.replace("T", " ")[:19]
+    return value
+
+
+class CSVLoader:
+    """Create a table from a CSV upload and bulk-load it, yielding progress events."""
+
+    def __init__(self, mysql_config, path, table, if_exists="fail", method="auto"):
+        self.mysql_config = mysql_config
+        self.path = path
+        self.table = sanitize_identifier(table, "uploaded_data")
+        self.if_exists = if_exists
+        self.method = method
+        # Table the rows are loaded into; a staging table unless appending to an existing one
+        self.load_table = self.table
+
+    def _connect(self, local_infile):
+        config = dict(self.mysql_config, autocommit=False)
+        if local_infile:
+            config['allow_local_infile'] = True
+        # Imported on first use so the execution server starts without loading the driver
+        import mysql.connector
+        return mysql.connector.connect(**config)
+
+    def _table_exists(self, cursor, table):
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s AND table_name = %s",
+            (self.mysql_config['database'], table)
+        )
+        return cursor.fetchone()[0] > 0
+
+    def _create_table(self, conn, columns, types):
+        """Create the table rows are loaded into; returns whether it is a new staging table.
+
+        New and replaced tables are built under a staging name and only renamed into
+        place once loaded (see _publish), so a failed load never touches existing data.
+        """
+        cursor = conn.cursor()
+        exists = self._table_exists(cursor, self.table)
+        if exists and self.if_exists == "fail":
+            raise CSVLoadError(f"Table {self.table} already exists")
+        if exists and self.if_exists == "append":
+            cursor.close()
+            return False
+        self.load_table = f"{self.table[:48]}__staging_{secrets.token_hex(4)}"
+        definitions = ", ".join(f"`{name}` {column_type}" for name, column_type in zip(columns, types))
+        cursor.execute(f"CREATE TABLE `{self.load_table}` ({definitions})")
+        cursor.close()
+        return True
+
+    def _publish(self, conn):
+        """Move a loaded staging table into place, swapping out the old table when replacing."""
+        cursor = conn.cursor()
+        try:
+            if self._table_exists(cursor, self.table):
+                if self.if_exists != "replace":
+                    raise CSVLoadError(f"Table {self.table} already exists")
+                retired = f"{self.table[:48]}__replaced_{secrets.token_hex(4)}"
+                # One RENAME TABLE swaps both names atomically
+                cursor.execute(f"RENAME TABLE `{self.table}` TO `{retired}`, `{self.load_table}` TO `{self.table}`")
+                try:
+                    cursor.execute(f"DROP TABLE `{retired}`")
+                except Exception as e:
+                    # The new data is already in place; the old copy is only left behind
+                    print(f"Could not drop replaced table {retired}: {str(e)}")
+            else:
+                cursor.execute(f"RENAME TABLE `{self.load_table}` TO `{self.table}`")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _check_warnings(cursor, statement):
+        """Fail on truncated or coerced values, which MySQL reports as warnings for LOCAL loads and non-strict modes."""
+        count = cursor.warning_count
+        if not count:
+            return
+        cursor.execute("SHOW WARNINGS LIMIT 3")
+        examples = "; ".join(str(row[2]) for row in cursor.fetchall())
+        raise CSVLoadError(
+            f"{statement} reported {count} warning(s), so values would have been truncated or converted: {examples}. "
+            f"Raise CSV_SAMPLE_ROWS so type inference sees more of the file"
+        )
+
+    def _load_infile(self, conn, columns, types, line_terminator):
+        """Server-side bulk load; empty fields become NULL via user variables."""
+        variables = ", ".join(f"@v{i}" for i in range(len(columns)))
+        assignments = []
+        for i, (name, column_type) in enumerate(zip(columns, types)):
+            value = f"NULLIF(@v{i}, '')"
+            if column_type == "BOOLEAN":
+                value = f"(LOWER(NULLIF(@v{i}, '')) = 'true')"
+            elif column_type == "DATETIME":
+                value = f"REPLACE(LEFT(NULLIF(@v{i}, ''), 19), 'T', ' ')"
+            assignments.append(f"`{name}` = {value}")
+        terminator = line_terminator.encode("unicode_escape").decode()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE `{self.load_table}` CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            f"LINES TERMINATED BY '{terminator}' IGNORE 1 LINES ({variables}) SET {', '.join(assignments)}",
+            (self.path,)
+        )
+        loaded = cursor.rowcount
+        try:
+            self._check_warnings(cursor, "LOAD DATA")
+        finally:
+            cursor.close()
+        return loaded
+
+    def _load_batches(self, conn, columns, types, started):
+        """Multi-row batched inserts in a single transaction, yielding progress."""
+        placeholders = ", ".join(["%s"] * len(columns))
+        names = ", ".join(f"`{name}`" for name in columns)
+        statement = f"INSERT INTO `{self.load_table}` ({names}) VALUES ({placeholders})"
+        cursor = conn.cursor()
+        loaded = 0
+        with open(self.path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            next(reader)
+            batch = []
+            for row in reader:
+                if not row:
+                    continue
+                row = (row + [""] * len(columns))[:len(columns)]
+                batch.append([_convert(value, column_type) for value, column_type in zip(row, types)])
+                if len(batch) >= CSV_BATCH_SIZE:
+                    cursor.executemany(statement, batch)
+                    self._check_warnings(cursor, "INSERT")
+                    loaded += len(batch)
+                    batch = []
+                    yield self._progress(loaded, started)
+            if batch:
+                cursor.executemany(statement, batch)
+                self._check_warnings(cursor, "INSERT")
+                loaded += len(batch)
+        cursor.close()
+        yield self._progress(loaded, started)
+
+    @staticmethod
+    def _progress(rows, started):
+        elapsed = time.perf_counter() - started
+        return {
+            'event': 'progress',
+            'rows': rows,
+            'elapsed_s': round(elapsed, 2),
+            'rows_per_sec': round(rows / elapsed, 1) if elapsed > 0 else None
+        }
+
+    def run(self):
+        """Load the file, yielding progress events and finally a result event."""
+        import mysql.connector
+        header, sample, line_terminator = read_sample(self.path)
+        columns = _column_names(header)
+        types = [infer_type([row[i] if i < len(row) else "" for row in sample]) for i in range(len(columns))]
+        yield {'event': 'schema', 'table': self.table, 'columns': dict(zip(columns, types))}
+
+        use_infile = self.method in ("auto", "infile")
+        conn = self._connect(local_infile=use_infile)
+        created = False
+        try:
+            created = self._create_table(conn, columns, types)
+            started = time.perf_counter()
+            method = None
+            rows = 0
+            if use_infile:
+                try:
+                    rows = self._load_infile(conn, columns, types, line_terminator)
+                    method = "load_data_local_infile"
+                except mysql.connector.Error as e:
+                    # local_infile disabled on the server or client: use batched inserts
+                    if self.method == "infile":
+                        raise
+                    conn.rollback()
+                    yield {'event': 'fallback', 'reason': str(e)}
+            if method is None:
+                for event in self._load_batches(conn, columns, types, started):
+                    rows = event['rows']
+                    yield event
+                method = "batched_insert"
+            conn.commit()
+            if created:
+                self._publish(conn)
+            elapsed = time.perf_counter() - started
+            yield {
+                'event': 'result',
+                'success': True,
+                'table': self.table,
+                'trino_table': f"mysql.{self.mysql_config['database']}.{self.table}",
+                'columns': dict(zip(columns, types)),
+                'rows': rows,
+                'method': method,
+                'elapsed_s': round(elapsed, 2),
+                'rows_per_sec': round(rows / elapsed, 1) if elapsed > 0 else None
+            }
+        except Exception:
+            conn.rollback()
+            if created:
+                # Only ever the staging table; an existing table is left as it was
+                cursor = conn.cursor()
+                cursor.execute(f"DROP TABLE IF EXISTS `{self.load_table}`")
+                cursor.close()
+            raise
+        finally:
+            conn.close()
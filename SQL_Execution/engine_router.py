@@ -0,0 +1,198 @@
+"""Cost-based choice between MySQL, Trino and Spark for a single query"""
+
+import os
+import threading
+from collections import deque
+
+import sqlglot
+from sqlglot import exp
+
+# Total rows under which a query is cheap enough to run on MySQL directly
+SMALL_QUERY_ROWS = float(os.getenv("ROUTER_SMALL_QUERY_ROWS", "200000"))
+# Total rows over which window functions / deep pipelines go to Spark
+HEAVY_TRANSFORM_ROWS = float(os.getenv("ROUTER_HEAVY_TRANSFORM_ROWS", "5000000"))
+# Switch engines when the preferred one has been this many times slower recently
+LATENCY_SWITCH_FACTOR = float(os.getenv("ROUTER_LATENCY_SWITCH_FACTOR", "3"))
+LATENCY_MIN_SAMPLES = int(os.getenv("ROUTER_LATENCY_MIN_SAMPLES", "5"))
+LATENCY_HISTORY_SIZE = int(os.getenv("ROUTER_LATENCY_HISTORY_SIZE", "100"))
+
+# Engines that can serve each query class, most preferred first
+CANDIDATES = {
+    'point_lookup': ['mysql', 'trino'],
+    'small_query': ['mysql', 'trino'],
+    'large_scan': ['trino', 'spark'],
+    'heavy_transform': ['spark', 'trino'],
+}
+
+
+
+class LatencyHistory:
+    """Recent successful execution latencies per (engine, query class)."""
+
+    def __init__(self, size=LATENCY_HISTORY_SIZE):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, engine, query_class, latency_ms):
+        with self._lock:
+            self._samples.setdefault((engine, query_class), deque(maxlen=self.size)).append(latency_ms)
+
+    def median(self, engine, query_class):
+        with self._lock:
+            samples = sorted(self._samples.get((engine, query_class), ()))
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[len(samples) // 2]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                f"{engine}:{query_class}": {'samples': len(samples), 'median_ms': sorted(samples)[len(samples) // 2]}
+                for (engine, query_class), samples in self._samples.items() if samples
+            }
+
+
+latency_history = LatencyHistory()
+
+
+class RoutingError(Exception):
+    """Raised when a query cannot be parsed for routing."""
+
+
+def _is_key_column(column, select, key_columns):
+    """Whether column is a primary or unique key of its table; named like one (id, *_id) when the keys are unknown."""
+    name = column.name.lower()
+    aliases = {table.alias_or_name.lower(): table.name.lower() for table in select.find_all(exp.Table)}
+    if column.table:
+        tables = [aliases.get(column.table.lower(), column.table.lower())]
+    else:
+        tables = list(aliases.values())
+    known = [key_columns[table] for table in tables if table in key_columns]
+    if known:
+        return any(name in keys for keys in known)
+    return name == 'id' or name.endswith('_id')
+
+
+def _conjuncts(condition):
+    """Top-level AND terms of a condition; an OR or NOT stays a single term."""
+    condition = condition.unnest()
+    if isinstance(condition, exp.And):
+        return _conjuncts(condition.left) + _conjuncts(condition.right)
+    return [condition]
+
+
+def _is_point_lookup(select, key_columns):
+    """WHERE clause pins a key column to a literal (id = 42 / id IN (1, 2)) in every row it keeps.
+
+    Only top-level AND terms count: id = 1 OR amount > 0 still scans the table.
+    """
+    where = select.args.get('where')
+    if where is None:
+        return False
+    for predicate in _conjuncts(where.this):
+        if not isinstance(predicate, (exp.EQ, exp.In)):
+            continue
+        column = predicate.this if isinstance(predicate.this, exp.Column) else None
+        if column is None:
+            continue
+        if not _is_key_column(column, select, key_columns):
+            continue
+        if isinstance(predicate, exp.EQ) and isinstance(predicate.expression, exp.Literal):
+            return True
+        if isinstance(predicate, exp.In) and predicate.expressions and all(
+            isinstance(e, exp.Literal) for e in predicate.expressions
+        ):
+            return True
+    return False
+
+
+def analyze_query(sql, dialect='trino', key_columns=None):
+    """Structural features of a query used for routing.
+
+    key_columns maps table -> lowercase names of its single-column primary and
+    unique keys; tables missing from it fall back to the id / *_id naming convention.
+    """
+    try:
+        expression = sqlglot.parse_one(sql, read=dialect)
+    except sqlglot.errors.SqlglotError as e:
+        raise RoutingError(f"Unable to parse query for routing: {e}")
+    key_columns = {table.lower(): set(columns) for table, columns in (key_columns or {}).items()}
+    cte_names = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+    tables = sorted({
+        table.name for table in expression.find_all(exp.Table)
+        if table.name and table.name not in cte_names
+    })
+    limit = expression.args.get('limit')
+    limit_value = None
+    if limit is not None and isinstance(limit.expression, exp.Literal):
+        limit_value = int(limit.expression.this)
+    return {
+        'read_only': isinstance(expression, exp.Query),
+        'tables': tables,
+        'joins': len(list(expression.find_all(exp.Join))),
+        'aggregations': len(list(expression.find_all(exp.AggFunc))),
+        'group_by': expression.find(exp.Group) is not None,
+        'windows': len(list(expression.find_all(exp.Window))),
+        'ctes': len(cte_names),
+        'subqueries': len(list(expression.find_all(exp.Subquery))),
+        'point_lookup': isinstance(expression, exp.Select) and _is_point_lookup(expression, key_columns),
+        'limit': limit_value,
+    }
+
+
+def classify(features, table_rows):
+    """Query class plus the human-readable reasons behind it."""
+    scanned = sum(table_rows.get(table, 0) for table in features['tables'])
+    unknown = [table for table in features['tables'] if table not in table_rows]
+    reasons = [f"~{scanned:.0f} rows across {len(features['tables'])} table(s)"]
+    if unknown:
+        reasons.append(f"no statistics for {', '.join(unknown)}")
+
+    if features['point_lookup'] and features['joins'] <= 1:
+        reasons.append("selective key lookup")
+        return 'point_lookup', scanned, reasons
+    transform_depth = features['windows'] + features['ctes'] + features['subqueries']
+    if transform_depth >= 3 and scanned >= HEAVY_TRANSFORM_ROWS:
+        reasons.append(
+            f"{features['windows']} window(s), {features['ctes']} CTE(s), "
+            f"{features['subqueries']} subquer(ies) over a large input"
+        )
+        return 'heavy_transform', scanned, reasons
+    if scanned < SMALL_QUERY_ROWS and not unknown and features['joins'] <= 2:
+        reasons.append(f"under {SMALL_QUERY_ROWS:.0f} rows with {features['joins']} join(s)")
+        return 'small_query', scanned, reasons
+    reasons.append(f"{features['joins']} join(s), {features['aggregations']} aggregate(s) over a large scan")
+    return 'large_scan', scanned, reasons
+
+
+def choose_engine(sql, table_rows, dialect='trino', available=('mysql', 'trino', 'spark'), history=latency_history,
+                  key_columns=None):
+    """Pick an engine for the query and explain the choice."""
+    features = analyze_query(sql, dialect, key_columns)
+    if not features['read_only']:
+        return 'mysql', {
+            'query_class': 'write',
+            'reasons': ["statement modifies data; sent to the source database"],
+            'features': features,
+            'estimated_rows': None,
+        }
+
+    query_class, scanned, reasons = classify(features, table_rows)
+    candidates = [engine for engine in CANDIDATES[query_class] if engine in available]
+    engine = candidates[0]
+    current = history.median(engine, query_class)
+    for alternative in candidates[1:]:
+        other = history.median(alternative, query_class)
+        if current is not None and other is not None and current > LATENCY_SWITCH_FACTOR * other:
+            reasons.append(
+                f"{engine} median {current:.0f} ms vs {alternative} {other:.0f} ms recently; using {alternative}"
+            )
+            engine, current = alternative, other
+            break
+    return engine, {
+        'query_class': query_class,
+        'reasons': reasons,
+        'features': features,
+        'estimated_rows': scanned,
+    }
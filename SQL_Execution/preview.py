@@ -0,0 +1,303 @@
+"""Sampled, approximate preview execution (mode=preview)
+
+A preview runs a cheaper version of the query while a user is still
+iterating on it:
+  - the largest table whose row count exceeds PREVIEW_TARGET_ROWS is sampled
+    with the engine's native sampling (Trino TABLESAMPLE BERNOULLI/SYSTEM,
+    Spark TABLESAMPLE, MySQL a random primary-key range);
+  - exact distinct counts and percentiles become approx_distinct and
+    approx_percentile where the engine has them;
+  - COUNT and SUM in the outermost aggregate are scaled up by the sampling
+    rate, and a hidden per-row sample count gives each row a 95% error bound.
+Row-level queries without a LIMIT get the rewriter's preview LIMIT.
+"""
+
+import math
+import os
+import random
+
+import sqlglot
+from sqlglot import exp
+
+from sql_rewriter import PREVIEW_LIMIT
+
+# Engine name -> sqlglot dialect
+DIALECTS = {'mysql': 'mysql', 'trino': 'trino', 'spark': 'spark'}
+
+# Rows a preview should read from its largest table; larger tables are sampled down to about this many
+PREVIEW_TARGET_ROWS = float(os.getenv("PREVIEW_TARGET_ROWS", "100000"))
+# Lower bound for the automatically chosen sampling percentage
+PREVIEW_MIN_SAMPLE_PERCENT = float(os.getenv("PREVIEW_MIN_SAMPLE_PERCENT", "0.01"))
+# bernoulli, system or pk_range; pk_range pushes a primary-key range filter down through the JDBC catalog
+PREVIEW_TRINO_SAMPLING = os.getenv("PREVIEW_TRINO_SAMPLING", "bernoulli")
+
+# z for the reported 95% bounds
+Z_95 = 1.96
+
+# Relative standard error of each engine's approx_distinct, and rank error of its approx_percentile
+APPROX_DISTINCT_STANDARD_ERROR = {'trino': 0.023, 'spark': 0.05}
+APPROX_PERCENTILE_RANK_ERROR = {'trino': 0.01, 'spark': 0.0001}
+
+SAMPLE_COUNT_COLUMN = "__preview_sample_rows"
+
+# Accepted sample_method values (MySQL always samples a primary-key range)
+SAMPLE_METHODS = ('bernoulli', 'system', 'pk_range')
+
+
+class PreviewError(Exception):
+    """Raised when a query cannot be turned into a preview."""
+
+
+def _approximate(node, engine):
+    """Exact distinct counts and quantiles -> the engine's approximate aggregates."""
+    if engine == 'mysql':
+        return node
+    if isinstance(node, exp.Count) and isinstance(node.this, exp.Distinct) and len(node.this.expressions) == 1:
+        return exp.ApproxDistinct(this=node.this.expressions[0].copy())
+    if isinstance(node, exp.Median):
+        return exp.ApproxQuantile(this=node.this.copy(), quantile=exp.Literal.number(0.5))
+    if isinstance(node, exp.Quantile):
+        return exp.ApproxQuantile(this=node.this.copy(), quantile=node.args['quantile'].copy())
+    if isinstance(node, exp.WithinGroup) and isinstance(node.this, (exp.PercentileCont, exp.PercentileDisc)):
+        ordered = node.expression.expressions[0] if isinstance(node.expression, exp.Order) else None
+        if ordered is not None:
+            return exp.ApproxQuantile(this=ordered.this.copy(), quantile=node.this.this.copy())
+    return node
+
+
+def _base_tables(expression):
+    """Table nodes that refer to stored tables rather than CTEs."""
+    cte_names = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+    return [table for table in expression.find_all(exp.Table) if table.name and table.name not in cte_names]
+
+
+def _in_scope(node, select):
+    return node.find_ancestor(exp.Select) is select
+
+
+def _is_aggregate(select):
+    if select.args.get('group'):
+        return True
+    return any(_in_scope(node, select) for node in select.find_all(exp.AggFunc))
+
+
+def _sample_percent(rows, requested):
+    if requested is not None:
+        try:
+            percent = float(requested)
+        except (TypeError, ValueError):
+            raise PreviewError(f"sample_percent must be a number, got {requested!r}")
+        if not 0 < percent <= 100:
+            raise PreviewError("sample_percent must be in (0, 100]")
+        return percent
+    return min(100.0, max(PREVIEW_MIN_SAMPLE_PERCENT, 100.0 * PREVIEW_TARGET_ROWS / rows))
+
+
+def _range_sample(table, key_range, percent):
+    """Replace table by a subquery over a random primary-key range covering percent of the key space."""
+    column, low, high = key_range
+    span = high - low + 1
+    width = max(1, int(span * percent / 100))
+    start = low + random.randint(0, max(0, span - width))
+    source = table.copy()
+    source.set('alias', None)
+    subquery = (
+        exp.select("*")
+        .from_(source)
+        .where(exp.column(column).between(exp.Literal.number(start), exp.Literal.number(start + width - 1)))
+        .subquery(table.alias_or_name)
+    )
+    table.replace(subquery)
+    return 100.0 * width / span
+
+
+def preview_query(sql, engine, table_rows, key_range=None, sample_percent=None, method=None):
+    """Rewrite sql into its preview form.
+
+    table_rows maps table -> approximate row count; key_range(table) returns
+    (column, min, max) of an integer primary key or None (used for MySQL and
+    Trino pk_range sampling). Returns (preview_sql, plan); plan is passed to
+    annotate_preview once the query has run.
+    """
+    dialect = DIALECTS[engine]
+    try:
+        expression = sqlglot.parse_one(sql, read=dialect)
+    except sqlglot.errors.SqlglotError as e:
+        raise PreviewError(f"Unable to parse query for preview: {e}")
+    if not isinstance(expression, exp.Query):
+        raise PreviewError("Preview mode only applies to SELECT queries")
+    method = method or (PREVIEW_TRINO_SAMPLING if engine == 'trino' else None)
+    if method is not None and method not in SAMPLE_METHODS:
+        raise PreviewError(f"sample_method must be one of {', '.join(SAMPLE_METHODS)}, got {method!r}")
+
+    plan = {
+        'engine': engine,
+        'original_query': sql,
+        'sampled_table': None,
+        'method': None,
+        'sampling_rate': 1.0,
+        'approximations': [],
+        'columns': [],
+        'notes': [],
+    }
+
+    def approximate(node):
+        replacement = _approximate(node, engine)
+        if replacement is not node:
+            plan['approximations'].append(f"{node.sql(dialect=dialect)} -> {replacement.sql(dialect=dialect)}")
+        return replacement
+
+    expression = expression.transform(approximate)
+
+    # Sample only the largest table: sampling both sides of a join shrinks it by the product of the rates
+    candidates = [table for table in _base_tables(expression) if table_rows.get(table.name, 0) > PREVIEW_TARGET_ROWS]
+    if sample_percent is not None:
+        candidates = candidates or [table for table in _base_tables(expression) if table.name in table_rows]
+    candidates.sort(key=lambda table: table_rows.get(table.name, 0), reverse=True)
+    sampled = candidates[0] if candidates else None
+    outer = expression if isinstance(expression, exp.Select) else None
+    sampled_in_outer = sampled is not None and outer is not None and _in_scope(sampled, outer)
+
+    percent = _sample_percent(table_rows.get(sampled.name) or PREVIEW_TARGET_ROWS, sample_percent) if sampled is not None else 100.0
+    if percent >= 100:
+        sampled = None
+        sampled_in_outer = False
+
+    if sampled is not None:
+        # MySQL has no TABLESAMPLE
+        method = 'pk_range' if engine == 'mysql' else method or 'tablesample'
+        plan['sampled_table'] = sampled.name
+        if method == 'pk_range':
+            bounds = key_range(sampled.name) if key_range else None
+            if bounds is None:
+                plan['notes'].append(f"{sampled.name} has no integer primary key to sample a range of; it is read in full")
+                plan['sampled_table'] = None
+                sampled = None
+                sampled_in_outer = False
+            else:
+                plan['method'] = 'pk_range'
+                plan['sampling_rate'] = _range_sample(sampled, bounds, percent) / 100
+                plan['notes'].append("A primary-key range is a contiguous block, not a random sample; bounds assume rows are not ordered by the measured values")
+        else:
+            sample_method = method.upper() if method in ('bernoulli', 'system') and engine == 'trino' else None
+            sampled.set('sample', exp.TableSample(
+                method=exp.var(sample_method) if sample_method else None,
+                percent=exp.Literal.number(round(percent, 6)),
+            ))
+            plan['method'] = f"tablesample_{method}" if sample_method else 'tablesample'
+            plan['sampling_rate'] = percent / 100
+
+    rate = plan['sampling_rate']
+    scale = rate < 1 and sampled_in_outer
+    if outer is not None and _is_aggregate(outer):
+        for position, projection in enumerate(list(outer.expressions)):
+            name = projection.sql(dialect=dialect)
+            aliased = isinstance(projection, exp.Alias)
+            kinds = _mark_aggregates(projection, outer, rate if scale else 1.0)
+            if engine != 'trino' and not aliased and any(kind.startswith('scaled_') for kind in kinds):
+                # Keep the column name the unscaled expression would have had (Trino names it _colN either way);
+                # a bare aggregate was itself replaced, so alias whatever now sits at its position
+                current = outer.expressions[position]
+                current.replace(exp.alias_(current.copy(), name, quoted=True))
+            plan['columns'].append({'position': position, 'kinds': kinds})
+        if outer.args.get('having'):
+            _mark_aggregates(outer.args['having'], outer, rate if scale else 1.0)
+        if scale:
+            # Rows behind each output row, for its error bound; stripped from the response
+            outer.select(exp.alias_(exp.Count(this=exp.Star()), SAMPLE_COUNT_COLUMN), copy=False)
+            plan['sample_count_column'] = True
+        elif rate < 1:
+            plan['notes'].append("The sampled table is inside a subquery or CTE, so totals are not scaled up")
+    elif isinstance(expression, exp.Query) and not expression.args.get('limit') and not expression.args.get('fetch'):
+        expression = expression.limit(PREVIEW_LIMIT, copy=False)
+        plan['limit'] = PREVIEW_LIMIT
+
+    return expression.sql(dialect=dialect), plan
+
+
+def _mark_aggregates(node, select, rate):
+    """Scale COUNT/SUM of select's own scope under node by 1 / rate; returns the kinds of aggregates found."""
+    kinds = set()
+    for aggregate in list(node.find_all(exp.Count, exp.Sum, exp.ApproxDistinct, exp.ApproxQuantile)):
+        if not _in_scope(aggregate, select) or isinstance(aggregate.parent, exp.Window):
+            continue
+        if isinstance(aggregate, exp.ApproxDistinct):
+            kinds.add('approx_distinct')
+        elif isinstance(aggregate, exp.ApproxQuantile):
+            kinds.add('approx_percentile')
+        elif isinstance(aggregate, exp.Count) and isinstance(aggregate.this, exp.Distinct):
+            kinds.add('distinct_on_sample')
+        elif rate < 1:
+            kind = 'count' if isinstance(aggregate, exp.Count) else 'sum'
+            scaled = exp.Mul(this=aggregate.copy(), expression=exp.Literal.number(round(1 / rate, 6)))
+            if kind == 'count':
+                scaled = exp.Cast(this=exp.Round(this=scaled), to=exp.DataType.build("BIGINT"))
+            aggregate.replace(exp.Paren(this=scaled))
+            kinds.add(f"scaled_{kind}")
+    return sorted(kinds)
+
+
+def _relative_error(sample_rows, rate):
+    """95% relative error of a scaled count from a Bernoulli sample with sample_rows rows."""
+    if not sample_rows:
+        return None
+    return round(Z_95 * math.sqrt((1 - rate) / sample_rows), 6)
+
+
+def annotate_preview(response, plan, preview_sql):
+    """Strip the hidden sample-count column and attach the preview report with error bounds."""
+    rate = plan['sampling_rate']
+    row_errors = None
+    if plan.get('sample_count_column'):
+        results = response.get('results') or []
+        if results and isinstance(results[0], dict):
+            counts = [row.pop(SAMPLE_COUNT_COLUMN, None) for row in results]
+        else:
+            counts = [row[-1] for row in results]
+            response['results'] = [list(row)[:-1] for row in results]
+        if response.get('columns') and response['columns'][-1] == SAMPLE_COUNT_COLUMN:
+            response['columns'] = response['columns'][:-1]
+        if response.get('schema'):
+            response['schema'] = [field for field in response['schema'] if field.get('name') != SAMPLE_COUNT_COLUMN]
+        row_errors = [_relative_error(count, rate) for count in counts]
+
+    columns = response.get('columns') or []
+    engine = plan['engine']
+    column_bounds = {}
+    for column in plan['columns']:
+        if column['position'] >= len(columns) or not column['kinds']:
+            continue
+        bounds = {'kinds': column['kinds']}
+        if any(kind.startswith('scaled_') for kind in column['kinds']):
+            bounds['relative_error'] = 'per row, see row_relative_error'
+            if 'scaled_sum' in column['kinds']:
+                bounds['note'] = "Sum bounds use the row count only; they widen when values are skewed"
+        if 'approx_distinct' in column['kinds']:
+            bounds['approx_distinct_relative_error'] = round(Z_95 * APPROX_DISTINCT_STANDARD_ERROR[engine], 4)
+            if rate < 1:
+                bounds['note'] = "Distinct counts on a sample are a lower bound and are not scaled"
+        if 'distinct_on_sample' in column['kinds'] and rate < 1:
+            bounds['note'] = "Distinct counts on a sample are a lower bound and are not scaled"
+        if 'approx_percentile' in column['kinds']:
+            bounds['approx_percentile_rank_error'] = APPROX_PERCENTILE_RANK_ERROR[engine]
+        column_bounds[columns[column['position']]] = bounds
+
+    response['preview'] = {
+        'mode': 'preview',
+        'sampling_rate': rate,
+        'sample_percent': round(rate * 100, 6),
+        'sampled_table': plan['sampled_table'],
+        'method': plan['method'],
+        'approximations': plan['approximations'],
+        'error_bounds': {
+            'confidence': 0.95,
+            'columns': column_bounds,
+            'row_relative_error': row_errors,
+            'max_relative_error': max((error for error in row_errors or [] if error is not None), default=None),
+        },
+        'limit': plan.get('limit'),
+        'notes': plan['notes'],
+        'query': preview_sql,
+        'original_query': plan['original_query'],
+    }
+    return response
@@ -0,0 +1,276 @@
+"""SQLite stand-in for the sales database, for load-testing server.py without MySQL, Trino or Spark
+
+Create a seeded database with:
+    python sales_standin.py sales_standin.db [--customers 20000] [--orders 200000]
+then start server.py with SALES_DB_STANDIN=sales_standin.db. Queries sent to
+any engine are transpiled from that engine's dialect to SQLite with sqlglot.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+import sqlglot
+from sqlglot import exp
+
+# Extra latency per engine in milliseconds, e.g. {"trino": 150, "spark": 4000},
+# to mimic coordinator scheduling or spark-submit start-up on top of SQLite
+SALES_STANDIN_LATENCY_MS = json.loads(os.getenv("SALES_STANDIN_LATENCY_MS", "{}"))
+
+SCHEMA = """
+CREATE TABLE customers (
+    customer_id INTEGER PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    city VARCHAR(100),
+    country VARCHAR(100),
+    signup_date DATE
+);
+CREATE TABLE products (
+    product_id INTEGER PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    category VARCHAR(50),
+    price DECIMAL(10, 2)
+);
+CREATE TABLE orders (
+    order_id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL REFERENCES customers(customer_id),
+    order_date DATE,
+    status VARCHAR(20),
+    total_amount DECIMAL(12, 2)
+);
+CREATE TABLE order_items (
+    order_id INTEGER NOT NULL REFERENCES orders(order_id),
+    product_id INTEGER NOT NULL REFERENCES products(product_id),
+    quantity INTEGER,
+    unit_price DECIMAL(10, 2)
+);
+CREATE INDEX idx_orders_customer ON orders(customer_id);
+CREATE INDEX idx_orders_date ON orders(order_date);
+CREATE INDEX idx_order_items_order ON order_items(order_id);
+"""
+
+CITIES = [
+    ("Pune", "India"), ("Mumbai", "India"), ("Bengaluru", "India"), ("London", "United Kingdom"),
+    ("Berlin", "Germany"), ("New York", "United States"), ("San Francisco", "United States"),
+    ("Toronto", "Canada"), ("Sydney", "Australia"), ("Singapore", "Singapore"),
+]
+CATEGORIES = ["Electronics", "Books", "Clothing", "Home", "Sports", "Toys", "Grocery", "Beauty"]
+STATUSES = ["completed"] * 7 + ["shipped", "pending", "cancelled"]
+DIALECTS = {'mysql': 'mysql', 'trino': 'trino', 'spark': 'spark'}
+
+
+def _date(value):
+    return date.fromisoformat(str(value)[:10]) if value is not None else None
+
+
+def _date_trunc(unit, value):
+    day = _date(value)
+    if day is None:
+        return None
+    unit = unit.lower()
+    if unit == 'year':
+        day = day.replace(month=1, day=1)
+    elif unit == 'quarter':
+        day = day.replace(month=3 * ((day.month - 1) // 3) + 1, day=1)
+    elif unit == 'month':
+        day = day.replace(day=1)
+    elif unit == 'week':
+        day = day - timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+class _ApproxDistinct:
+    """Exact distinct count standing in for approx_distinct / APPROX_COUNT_DISTINCT."""
+
+    def __init__(self):
+        self.values = set()
+
+    def step(self, value):
+        if value is not None:
+            self.values.add(value)
+
+    def finalize(self):
+        return len(self.values)
+
+
+class _ApproxQuantile:
+    """Exact nearest-rank quantile standing in for approx_percentile."""
+
+    def __init__(self):
+        self.values = []
+        self.quantile = 0.5
+
+    def step(self, value, quantile):
+        if value is not None:
+            self.values.append(value)
+        self.quantile = quantile
+
+    def finalize(self):
+        if not self.values:
+            return None
+        self.values.sort()
+        return self.values[min(len(self.values) - 1, max(0, int(round(self.quantile * len(self.values))) - 1))]
+
+
+def _portable(node):
+    """Rewrite nodes sqlglot renders as SQLite-incompatible syntax into calls to the functions registered below."""
+    if isinstance(node, exp.Table) and node.args.get('sample'):
+        # No TABLESAMPLE in SQLite: keep each row with the sampling probability
+        percent = float(node.args['sample'].args['percent'].name)
+        source = node.copy()
+        source.set('sample', None)
+        source.set('alias', None)
+        keep = exp.condition(f"ABS(RANDOM()) % 1000000 < {int(percent * 10000)}")
+        return exp.select("*").from_(source).where(keep).subquery(node.alias_or_name)
+    if isinstance(node, (exp.DateTrunc, exp.TimestampTrunc)):
+        unit = node.args.get('unit')
+        return exp.Anonymous(this="DATE_TRUNC", expressions=[exp.Literal.string(unit.name if unit else 'day'), node.this])
+    return node
+
+
+def _register_functions(conn):
+    """Engine functions that sqlglot passes through unchanged but SQLite lacks."""
+    conn.create_function("DATE_TRUNC", 2, _date_trunc, deterministic=True)
+    conn.create_function("YEAR", 1, lambda value: _date(value) and _date(value).year, deterministic=True)
+    conn.create_function("MONTH", 1, lambda value: _date(value) and _date(value).month, deterministic=True)
+    conn.create_function("DAY", 1, lambda value: _date(value) and _date(value).day, deterministic=True)
+    conn.create_function("QUARTER", 1, lambda value: _date(value) and (_date(value).month - 1) // 3 + 1, deterministic=True)
+    conn.create_aggregate("APPROX_DISTINCT", 1, _ApproxDistinct)
+    conn.create_aggregate("APPROX_QUANTILE", 2, _ApproxQuantile)
+
+
+class SalesStandIn:
+    """Runs engine-dialect SQL against a SQLite copy of the sales schema."""
+
+    def __init__(self, path, latency_ms=None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No sales stand-in database at {path} (create it with: python sales_standin.py {path})")
+        self.path = path
+        self.latency_ms = SALES_STANDIN_LATENCY_MS if latency_ms is None else latency_ms
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per server thread; SQLite handles concurrent readers
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            _register_functions(conn)
+            self._local.conn = conn
+        return conn
+
+    def to_sqlite(self, query, engine):
+        trees = sqlglot.parse(query, read=DIALECTS.get(engine, engine))
+        return [tree.transform(_portable).sql(dialect='sqlite') for tree in trees if tree is not None]
+
+    def run(self, query, engine):
+        """Execute a query written for engine and return (columns, rows) of its last statement."""
+        delay = self.latency_ms.get(engine, 0)
+        if delay:
+            time.sleep(delay / 1000)
+        conn = self._connection()
+        cursor = conn.cursor()
+        try:
+            columns, results = [], []
+            for statement in self.to_sqlite(query, engine):
+                cursor.execute(statement)
+                columns = [col[0] for col in cursor.description] if cursor.description else []
+                results = [list(row) for row in cursor.fetchall()] if cursor.description else []
+            conn.commit()
+            return columns, results
+        finally:
+            cursor.close()
+
+    def schema(self):
+        """Table -> {column: type}, like the information_schema map built for MySQL."""
+        rows = self._connection().execute(
+            "SELECT m.name, p.name, p.type FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+            "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' ORDER BY m.name, p.cid"
+        ).fetchall()
+        schema = {}
+        for table_name, column_name, data_type in rows:
+            schema.setdefault(table_name, {})[column_name] = data_type.split("(")[0].lower()
+        return schema
+
+    def key_range(self, table):
+        """(column, min, max) of an integer single-column primary key, or None."""
+        conn = self._connection()
+        keys = conn.execute("SELECT name, type FROM pragma_table_info(?) WHERE pk > 0", (table,)).fetchall()
+        if len(keys) != 1 or keys[0][1].upper() != "INTEGER":
+            return None
+        column = keys[0][0]
+        low, high = conn.execute(f'SELECT MIN("{column}"), MAX("{column}") FROM "{table}"').fetchone()
+        return None if low is None else (column, low, high)
+
+    def key_columns(self):
+        """Table -> names of its single-column primary and unique keys."""
+        conn = self._connection()
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        keys = {}
+        for table in tables:
+            columns = [row[0] for row in conn.execute("SELECT name FROM pragma_table_info(?) WHERE pk > 0", (table,))]
+            keys[table] = set(columns) if len(columns) == 1 else set()
+            for index in conn.execute("SELECT name FROM pragma_index_list(?) WHERE \"unique\" = 1", (table,)).fetchall():
+                indexed = [row[0] for row in conn.execute("SELECT name FROM pragma_index_info(?)", (index[0],))]
+                if len(indexed) == 1:
+                    keys[table].add(indexed[0])
+        return keys
+
+    def table_rows(self):
+        """Exact row count per table (cheap at stand-in sizes)."""
+        conn = self._connection()
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        return {table: float(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]) for table in tables}
+
+
+def create_sales_db(path, customers=20000, products=500, orders=200000, seed=0):
+    """Write a deterministic, seeded sales database to path."""
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        start = date(2022, 1, 1)
+        conn.executemany("INSERT INTO customers VALUES (?, ?, ?, ?, ?, ?)", (
+            (i, f"Customer {i}", f"customer{i}@{rng.choice(['gmail.com', 'yahoo.com', 'outlook.com', 'example.org'])}",
+             *rng.choice(CITIES), (start + timedelta(days=rng.randrange(1000))).isoformat())
+            for i in range(1, customers + 1)
+        ))
+        prices = {i: round(rng.uniform(2, 500), 2) for i in range(1, products + 1)}
+        conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?)", (
+            (i, f"Product {i}", rng.choice(CATEGORIES), prices[i]) for i in range(1, products + 1)
+        ))
+        order_rows, item_rows = [], []
+        for order_id in range(1, orders + 1):
+            items = [(rng.randint(1, products), rng.randint(1, 5)) for _ in range(rng.randint(1, 4))]
+            item_rows.extend((order_id, product_id, quantity, prices[product_id]) for product_id, quantity in items)
+            total = round(sum(prices[product_id] * quantity for product_id, quantity in items), 2)
+            order_rows.append((
+                order_id, rng.randint(1, customers), (start + timedelta(days=rng.randrange(1000))).isoformat(),
+                rng.choice(STATUSES), total,
+            ))
+        conn.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?)", order_rows)
+        conn.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?)", item_rows)
+        conn.commit()
+        conn.execute("ANALYZE")
+        return {'customers': customers, 'products': products, 'orders': orders, 'order_items': len(item_rows)}
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a seeded SQLite stand-in for the sales database.")
+    parser.add_argument("path")
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    counts = create_sales_db(args.path, args.customers, args.products, args.orders, args.seed)
+    print(f"Created {args.path}: {counts}")
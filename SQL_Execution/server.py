@@ -1,21 +1,40 @@
 import json
 import os
+import shlex
+import shutil
 import subprocess
 import tempfile
-from flask import Flask, request, jsonify
-import mysql.connector
+import threading
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 from flask_cors import CORS 
-import trino
 import sys
 import json
 import re
 import traceback
+import time
 from datetime import datetime
-from pyspark.sql import SparkSession
+from cost_guard import guard_query, CostGuardError
+from sql_rewriter import rewrite_sql, RewriteError
+from transpiler import transpile, TranspileError
+from engine_router import RoutingError, choose_engine, latency_history
+import trino_client
+from csv_loader import CSVLoader, CSVLoadError
+from snapshots import SnapshotStore, SnapshotError, SNAPSHOT_DEFAULT_REFRESH_SECONDS, SNAPSHOT_SCHEDULER
+from sales_standin import SalesStandIn
+from preview import preview_query, annotate_preview, PreviewError
+from spark_jobs import SparkJobStore, SparkJobError, SPARK_INLINE_MAX_ROWS, SPARK_RESULT_ROWS_PER_FILE
+
+# Shared backend modules live in backend/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend", "common"))
+from telemetry import span, instrument_app
+from warmup import add_warmup_endpoint
+from query_history import get_history
+from shared_cache import get_cache, add_cache_endpoints
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
+instrument_app(app, "sql_execution")
 
 
 # MySQL connection configuration.
@@ -36,95 +55,819 @@ TRINO_CONFIG = {
     'schema': 'sales'
 }
 
-@app.route('/execute/mysql', methods=['POST'])
-def execute_mysql():
-    data = request.get_json()
-    query = data.get('query')
+# Seconds the information_schema snapshot used by the rewriter stays valid.
+SCHEMA_CACHE_TTL = float(os.getenv('SCHEMA_CACHE_TTL', '300'))
+
+# Seconds results of read-only queries stay cached for requests that ask for it ("cache": true).
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', '60'))
+
+# Chunk size used when spooling CSV uploads to disk.
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', str(1024 * 1024)))
+
+# SQLite file that stands in for MySQL, Trino and Spark during load tests (see sales_standin.py).
+SALES_DB_STANDIN = os.getenv('SALES_DB_STANDIN', '')
+sales_standin = SalesStandIn(SALES_DB_STANDIN) if SALES_DB_STANDIN else None
+
+# Schema, row counts and key ranges (and opted-in results), shared by the workers on the host.
+cache = get_cache()
+metadata_cache = cache.namespace('metadata', SCHEMA_CACHE_TTL)
+results_cache = cache.namespace('results', RESULT_CACHE_TTL)
+
+# Statements whose results can be cached.
+READ_ONLY_QUERY = re.compile(r'^\s*(SELECT|WITH|SHOW|DESCRIBE|EXPLAIN)\b', re.IGNORECASE)
+
+def mysql_connect():
+    """Open a MySQL connection; the driver is imported on first use, not at start-up."""
+    import mysql.connector
+    return mysql.connector.connect(**MYSQL_CONFIG)
+
+
+def _explain_with(cursor):
+    """Run EXPLAIN statements for the cost guard on an open cursor."""
+    def run_explain(sql):
+        cursor.execute(sql)
+        return cursor.fetchall()
+    return run_explain
+
+
+def serialize(response):
+    """jsonify a query response, timed as its own stage."""
+    with span("serialize", rows=len(response.get('results') or [])):
+        return jsonify(response)
+
+
+def cost_guard_error(e):
+    return jsonify({'error': str(e), 'estimated_cost': e.estimate}), 422
+
+
+def run_standin(query, engine):
+    """Execute a query on the SQLite stand-in; the cost guard is skipped since SQLite plans are not comparable."""
+    with span("engine.execute", engine=engine, standin=True) as execute_span:
+        columns, results = sales_standin.run(query, engine)
+        execute_span.set_attribute('rows', len(results))
+    return {'columns': columns, 'results': results, 'estimated_cost': None}
+
+
+def run_mysql(query, guard=True):
+    """Execute a query on MySQL (after the cost guard) and return columns/results."""
+    if sales_standin is not None:
+        return run_standin(query, 'mysql')
+    conn = mysql_connect()
     try:
-        conn = mysql.connector.connect(**MYSQL_CONFIG)
         cursor = conn.cursor()
-        cursor.execute(query)
+        estimate = None
+        if guard:
+            with span("cost_guard", engine='mysql'):
+                query, estimate = guard_query('mysql', query, _explain_with(cursor))
+        with span("engine.execute", engine='mysql'):
+            cursor.execute(query)
         # If the query returns rows, fetch them.
-        results = cursor.fetchall() if cursor.description else []
+        with span("engine.fetch", engine='mysql') as fetch_span:
+            results = cursor.fetchall() if cursor.description else []
+            fetch_span.set_attribute('rows', len(results))
         columns = [col[0] for col in cursor.description] if cursor.description else []
         cursor.close()
         conn.commit()
+        return {'columns': columns, 'results': results, 'estimated_cost': estimate}
+    finally:
+        conn.close()
+
+
+def run_trino(query, guard=True, session_properties=None, include_query_info=False):
+    """Execute a query on Trino (after the cost guard) and return columns/results plus Trino stats."""
+    if sales_standin is not None:
+        return dict(run_standin(query, 'trino'), trino_stats={})
+    started = time.perf_counter()
+    conn = trino_client.connect(TRINO_CONFIG, session_properties)
+    try:
+        cursor = conn.cursor()
+        estimate = None
+        if guard:
+            with span("cost_guard", engine='trino'):
+                query, estimate = guard_query('trino', query, _explain_with(cursor))
+        with span("engine.execute", engine='trino'):
+            cursor.execute(query)
+        with span("engine.fetch", engine='trino') as fetch_span:
+            results, server_timings = trino_client.fetch_all_prefetched(cursor)
+            fetch_span.set_attribute('rows', len(results))
+        columns = [desc[0] for desc in cursor.description] if cursor.description else []
+        stats = trino_client.query_stats(cursor, TRINO_CONFIG, include_query_info)
+        cursor.close()
+        server_timings['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        stats['server'] = server_timings
+        return {'columns': columns, 'results': results, 'estimated_cost': estimate, 'trino_stats': stats}
+    finally:
         conn.close()
-        return jsonify({'columns': columns, 'results': results})
+
+
+def get_sales_schema():
+    """Table -> {column: type} map of the sales database, cached for SCHEMA_CACHE_TTL seconds."""
+    return metadata_cache.get_or_compute('schema', load_sales_schema)
+
+
+def load_sales_schema():
+    if sales_standin is not None:
+        return sales_standin.schema()
+    schema = {}
+    conn = mysql_connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = %s ORDER BY table_name, ordinal_position",
+            (MYSQL_CONFIG['database'],)
+        )
+        for table_name, column_name, data_type in cursor.fetchall():
+            schema.setdefault(table_name, {})[column_name] = data_type
+        cursor.close()
+    finally:
+        conn.close()
+    return schema
+
+
+def run_cached(engine, query, data, run):
+    """run() through the results cache when the request asks for it ("cache": true) and the query only reads."""
+    if not data.get('cache') or not READ_ONLY_QUERY.match(query or ''):
+        return run()
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return run()
+
+    key = (engine, query, data.get('session_properties'))
+    response = dict(results_cache.get_or_compute(key, compute))
+    response['cache'] = {'hit': not computed, 'ttl': RESULT_CACHE_TTL}
+    return response
+
+
+def apply_transpile(query, engine, data):
+    """Translate the query when the request names a different source dialect."""
+    source = data.get('source_dialect')
+    if not source or source == engine:
+        return query, None
+    with span("sql.transpile", source=source, target=engine):
+        translated, info = transpile(query, source, engine)
+    return translated, dict(info, source_dialect=source, original_query=query)
+
+
+# Executions go into the query history shared with the SQL generators
+history = get_history()
+
+def record_execution(data, engine, latency_ms, response=None, error=None):
+    """Attach the outcome to the generated entry named by history_id, or store the run as its own entry."""
+    if history is None or data.get('mode', request.args.get('mode')) == 'preview':
+        return None
+    rows = None
+    if response is not None:
+        rows = response.get('count', len(response.get('results') or []))
+    try:
+        if data.get('history_id'):
+            history.update_outcome(int(data['history_id']), error is None, latency_ms, rows, error, engine)
+            return int(data['history_id'])
+        return history.record(
+            data.get('query'),
+            question=data.get('question'),
+            engine=engine,
+            source="executed",
+            latency_ms=latency_ms,
+            success=error is None,
+            row_count=rows,
+            error=error,
+            dialect=data.get('source_dialect') or engine
+        )
     except Exception as e:
+        # The history is best effort and never fails a query
+        print(f"Query history write failed: {e}")
+        return None
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def apply_preview(query, engine, data):
+    """Turn the query into a sampled, approximate preview when the request asks for mode=preview."""
+    if data.get('mode', request.args.get('mode')) != 'preview':
+        return query, None
+    with span("sql.preview", engine=engine) as preview_span:
+        preview_sql, plan = preview_query(
+            query,
+            engine,
+            get_table_stats(),
+            key_range=get_key_range,
+            sample_percent=data.get('sample_percent'),
+            method=data.get('sample_method')
+        )
+        preview_span.set_attribute('sampling_rate', plan['sampling_rate'])
+    return preview_sql, plan
+
+
+def apply_rewrite(query, engine, data):
+    """Rewrite the query when the request asks for it ("rewrite": true or a rule map)."""
+    option = data.get('rewrite')
+    if not option:
+        return query, None
+    rules = option if isinstance(option, dict) else None
+    with span("sql.rewrite", engine=engine) as rewrite_span:
+        rewritten, applied, skipped = rewrite_sql(query, engine, rules=rules, schema=get_sales_schema())
+        rewrite_span.set_attribute('applied', applied)
+    return rewritten, {'applied': applied, 'skipped': skipped, 'original_query': query}
+
+
+@app.route('/execute/mysql', methods=['POST'])
+def execute_mysql():
+    data = request.get_json()
+    query = data.get('query')
+    started = time.perf_counter()
+    try:
+        query, transpiled = apply_transpile(query, 'mysql', data)
+        query, rewrite = apply_rewrite(query, 'mysql', data)
+        query, preview = apply_preview(query, 'mysql', data)
+        response = run_cached('mysql', query, data, lambda: run_mysql(query))
+        if transpiled:
+            response['transpile'] = transpiled
+        if rewrite:
+            response['rewrite'] = rewrite
+        if preview:
+            annotate_preview(response, preview, query)
+        response['history_id'] = record_execution(data, 'mysql', elapsed_ms(started), response)
+        return serialize(response)
+    except (TranspileError, RewriteError, PreviewError) as e:
+        return jsonify({'error': str(e)}), 400
+    except CostGuardError as e:
+        return cost_guard_error(e)
+    except Exception as e:
+        record_execution(data, 'mysql', elapsed_ms(started), error=str(e))
         return jsonify({'error': str(e)}), 500
 
 @app.route('/execute/trino', methods=['POST'])
 def execute_trino():
     data = request.get_json()
     query = data.get('query')
+    started = time.perf_counter()
     try:
-        conn = trino.dbapi.connect(
-            host=TRINO_CONFIG['host'],
-            port=TRINO_CONFIG['port'],
-            user=TRINO_CONFIG['user'],
-            catalog=TRINO_CONFIG['catalog'],
-            schema=TRINO_CONFIG['schema']
+        query, transpiled = apply_transpile(query, 'trino', data)
+        query, rewrite = apply_rewrite(query, 'trino', data)
+        query, preview = apply_preview(query, 'trino', data)
+        response = run_cached('trino', query, data, lambda: run_trino(
+            query,
+            session_properties=data.get('session_properties'),
+            include_query_info=data.get('stats') == 'full'
+        ))
+        if transpiled:
+            response['transpile'] = transpiled
+        if rewrite:
+            response['rewrite'] = rewrite
+        if preview:
+            annotate_preview(response, preview, query)
+        response['history_id'] = record_execution(data, 'trino', elapsed_ms(started), response)
+        return serialize(response)
+    except (TranspileError, RewriteError, PreviewError) as e:
+        return jsonify({'error': str(e)}), 400
+    except CostGuardError as e:
+        return cost_guard_error(e)
+    except Exception as e:
+        record_execution(data, 'trino', elapsed_ms(started), error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/transpile', methods=['POST'])
+def transpile_query():
+    """Translate a query between the mysql, trino and spark dialects."""
+    data = request.get_json()
+    query = data.get('query')
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    try:
+        translated, info = transpile(query, data.get('source', 'trino'), data.get('target', 'mysql'))
+        return jsonify(dict(info, query=query, transpiled_query=translated))
+    except TranspileError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/rewrite', methods=['POST'])
+def rewrite():
+    """Return the rewritten query without executing it."""
+    data = request.get_json()
+    query = data.get('query')
+    engine = data.get('engine', 'trino')
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    try:
+        rewritten, applied, skipped = rewrite_sql(
+            query, engine, rules=data.get('rules'), schema=get_sales_schema()
         )
-        cursor = conn.cursor()
-        cursor.execute(query)
-        results = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description] if cursor.description else []
-        cursor.close()
-        conn.close()
-        return jsonify({'columns': columns, 'results': results})
+        return jsonify({'query': query, 'rewritten_query': rewritten, 'applied': applied, 'skipped': skipped})
+    except RewriteError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/rewrite/compare', methods=['POST'])
+def rewrite_compare():
+    """Run the original and rewritten query on one engine and report both latencies."""
+    data = request.get_json()
+    query = data.get('query')
+    engine = data.get('engine', 'trino')
+    runners = {'mysql': run_mysql, 'trino': run_trino}
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    if engine not in runners:
+        return jsonify({'error': f'Unsupported engine for comparison: {engine}'}), 400
+    try:
+        rewritten, applied, skipped = rewrite_sql(
+            query, engine, rules=data.get('rules'), schema=get_sales_schema()
+        )
+        report = {'engine': engine, 'applied': applied, 'skipped': skipped}
+        for label, sql in (('original', query), ('rewritten', rewritten)):
+            started = time.perf_counter()
+            result = runners[engine](sql)
+            report[label] = {
+                'query': sql,
+                'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+                'row_count': len(result['results']),
+                'estimated_cost': result['estimated_cost']
+            }
+        report['speedup'] = round(
+            report['original']['latency_ms'] / max(report['rewritten']['latency_ms'], 0.1), 2
+        )
+        report['same_row_count'] = report['original']['row_count'] == report['rewritten']['row_count']
+        return jsonify(report)
+    except RewriteError as e:
+        return jsonify({'error': str(e)}), 400
+    except CostGuardError as e:
+        return cost_guard_error(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+class SparkExecutionError(Exception):
+    """Raised when the spark-submit job fails or leaves no usable result."""
+
+    def __init__(self, message, log=None, job_id=None):
+        super().__init__(message)
+        self.log = log
+        self.job_id = job_id
+
+
+spark_jobs = SparkJobStore()
+SPARK_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sparkscript.py')
+
+
+def run_spark(query, inline_rows=SPARK_INLINE_MAX_ROWS):
+    """Run a query through spark-submit in the Spark container and return its manifest plus up to inline_rows rows.
+
+    The job writes Parquet files and a manifest to its directory on the shared
+    volume; larger results are streamed from /spark/jobs/<job_id>/results.
+    inline_rows=None returns every row.
+    """
+    if sales_standin is not None:
+        response = run_standin(query, 'spark')
+        results = [dict(zip(response['columns'], row)) for row in response['results']]
+        return {
+            'status': 'success',
+            'query': query,
+            'columns': response['columns'],
+            'schema': [{'name': column} for column in response['columns']],
+            'count': len(results),
+            'results': results
+        }
+    job_id, job_dir, container_dir = spark_jobs.create()
+    # The script sits in the job directory on the shared volume, so it needs no docker cp
+    shutil.copy(SPARK_SCRIPT, os.path.join(job_dir, 'sparkscript.py'))
+    command = (
+        f"spark-submit {container_dir}/sparkscript.py {shlex.quote(query)} {container_dir} {SPARK_RESULT_ROWS_PER_FILE} "
+        f"> {container_dir}/spark.log 2>&1"
+    )
+
+    # Spark's stdout and stderr go to the job's log file; only the manifest is read back
+    with span("engine.execute", engine='spark', job_id=job_id):
+        result = subprocess.run(["docker", "exec", "spark_master", "bash", "-c", command], capture_output=True, text=True)
+
+    manifest = spark_jobs.manifest(job_id)
+    if manifest is None:
+        detail = result.stderr.strip() or f"exit code {result.returncode}"
+        raise SparkExecutionError(f"Spark job wrote no manifest: {detail}", log=spark_jobs.log_tail(job_id), job_id=job_id)
+    if manifest['status'] != 'success':
+        raise SparkExecutionError(f"Spark execution failed: {manifest.get('error')}", log=spark_jobs.log_tail(job_id), job_id=job_id)
+
+    with span("engine.fetch", engine='spark') as fetch_span:
+        results = spark_jobs.read_rows(job_id, inline_rows)
+        fetch_span.set_attribute('rows', len(results))
+    return dict(
+        manifest,
+        job_id=job_id,
+        columns=[field['name'] for field in manifest['schema']],
+        results=results,
+        truncated=len(results) < manifest['count'],
+        results_url=f"/spark/jobs/{job_id}/results",
+        log_url=f"/spark/jobs/{job_id}/log"
+    )
+
+
+def spark_error(e):
+    body = {'error': str(e)}
+    if e.job_id is not None:
+        body['job_id'] = e.job_id
+        body['log_url'] = f"/spark/jobs/{e.job_id}/log"
+    if e.log:
+        body['log'] = e.log
+    return jsonify(body), 500
+
+
 @app.route('/execute/spark', methods=['POST'])
 def execute_spark():
     data = request.get_json()
     query = data.get('query')
     if not query:
         return jsonify({'error': 'No query provided'}), 400
-        
-    try:
-        # Create the temporary script file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.py', mode='w') as tmp_file:
-            tmp_file.write(open('sparkscript.py').read())
-            local_tmp_path = tmp_file.name
-
-        container_tmp_path = "/tmp/spark_script.py"
-        subprocess.check_call(["docker", "cp", local_tmp_path, f"spark_master:{container_tmp_path}"])
-        
-        # Execute and capture output - redirect stderr to /dev/null to avoid warnings in output
-        result = subprocess.run(
-            ["docker", "exec", "spark_master", "bash", "-c", f"spark-submit {container_tmp_path} '{query}' 2>/dev/null"],
-            capture_output=True,
-            text=True
+    try:
+        query, _ = apply_transpile(query, 'spark', data)
+        query, preview = apply_preview(query, 'spark', data)
+    except (TranspileError, PreviewError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    started = time.perf_counter()
+    try:
+        response = run_spark(query)
+        if preview:
+            annotate_preview(response, preview, query)
+        response['history_id'] = record_execution(data, 'spark', elapsed_ms(started), response)
+        return serialize(response)
+    except SparkExecutionError as e:
+        record_execution(data, 'spark', elapsed_ms(started), error=str(e))
+        return spark_error(e)
+    except Exception as e:
+        record_execution(data, 'spark', elapsed_ms(started), error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/spark/jobs/<job_id>', methods=['GET'])
+def spark_job(job_id):
+    """The manifest of a Spark job (schema, row count, files, timings)."""
+    try:
+        manifest = spark_jobs.manifest(job_id)
+        if manifest is None:
+            return jsonify({'error': f'Spark job {job_id} wrote no manifest', 'log': spark_jobs.log_tail(job_id)}), 404
+        return jsonify(dict(manifest, job_id=job_id))
+    except SparkJobError as e:
+        return jsonify({'error': str(e)}), 404
+
+
+@app.route('/spark/jobs/<job_id>/results', methods=['GET'])
+def spark_job_results(job_id):
+    """Stream every result row as NDJSON, reading the Parquet files batch by batch."""
+    try:
+        _, batches = spark_jobs.iter_batches(job_id)
+    except SparkJobError as e:
+        return jsonify({'error': str(e)}), 404
+
+    def generate():
+        for batch in batches:
+            for row in batch.to_pylist():
+                yield json.dumps(row, default=str) + "\n"
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/spark/jobs/<job_id>/files/<name>', methods=['GET'])
+def spark_job_file(job_id, name):
+    """Download one Parquet part file listed in the manifest."""
+    try:
+        files = {os.path.basename(path): path for path in spark_jobs.data_files(job_id)}
+    except SparkJobError as e:
+        return jsonify({'error': str(e)}), 404
+    if name not in files:
+        return jsonify({'error': f'Unknown file: {name}'}), 404
+    return send_file(files[name], mimetype='application/vnd.apache.parquet', as_attachment=True, download_name=name)
+
+
+@app.route('/spark/jobs/<job_id>/log', methods=['GET'])
+def spark_job_log(job_id):
+    """The spark-submit output captured for the job."""
+    try:
+        path = spark_jobs.path(job_id, 'spark.log')
+    except SparkJobError as e:
+        return jsonify({'error': str(e)}), 404
+    if not os.path.exists(path):
+        return jsonify({'error': f'Spark job {job_id} has no log'}), 404
+    return send_file(path, mimetype='text/plain')
+
+
+def get_table_stats():
+    """Approximate row counts per table from information_schema, cached like the schema."""
+    return metadata_cache.get_or_compute('table_rows', load_table_stats)
+
+
+def load_table_stats():
+    if sales_standin is not None:
+        return sales_standin.table_rows()
+    conn = mysql_connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT table_name, table_rows FROM information_schema.tables WHERE table_schema = %s",
+            (MYSQL_CONFIG['database'],)
         )
+        rows = {table_name: float(table_rows or 0) for table_name, table_rows in cursor.fetchall()}
+        cursor.close()
+    finally:
+        conn.close()
+    return rows
+
+
+def get_key_columns():
+    """Table -> lowercase names of its single-column primary and unique keys, cached like the schema."""
+    return metadata_cache.get_or_compute('key_columns', load_key_columns)
+
+
+def load_key_columns():
+    if sales_standin is not None:
+        keys = sales_standin.key_columns()
+    else:
+        conn = mysql_connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT table_name, index_name, column_name FROM information_schema.statistics "
+                "WHERE table_schema = %s AND non_unique = 0",
+                (MYSQL_CONFIG['database'],)
+            )
+            indexes = {}
+            for table_name, index_name, column_name in cursor.fetchall():
+                indexes.setdefault((table_name, index_name), []).append(column_name)
+            cursor.close()
+        finally:
+            conn.close()
+        keys = {}
+        for (table_name, _), columns in indexes.items():
+            if len(columns) == 1:
+                keys.setdefault(table_name, set()).add(columns[0])
+    # Lists, so the entry can be stored as JSON in the shared cache
+    return {table: sorted(column.lower() for column in columns) for table, columns in keys.items()}
+
+
+# MySQL integer types usable for primary-key range sampling in preview mode
+INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
 
-        os.remove(local_tmp_path)
-        
-        # Attempt to remove the temporary file from the container
-        subprocess.run(["docker", "exec", "spark_master", "rm", container_tmp_path], check=False)
+def get_key_range(table):
+    """(column, min, max) of a table's single-column integer primary key, cached like the schema; None without one."""
+    return metadata_cache.get_or_compute(('key_range', table), lambda: load_key_range(table))
 
-        if result.returncode != 0:
-            return jsonify({
-                'error': f"Spark execution failed: {result.stderr.strip()}"
-            }), 500
 
-        # Parse the JSON output from the script
+def load_key_range(table):
+    if sales_standin is not None:
+        key_range = sales_standin.key_range(table)
+    else:
+        key_range = None
+        conn = mysql_connect()
         try:
-            output = result.stdout.strip()
-            if not output:
-                return jsonify({'error': 'No output from Spark job'}), 500
-            
-            return jsonify(json.loads(output))
-        except json.JSONDecodeError as json_err:
-            return jsonify({
-                'error': f"Failed to parse results: {json_err}",
-                'raw_output': output
-            }), 500
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT k.column_name, c.data_type FROM information_schema.key_column_usage k "
+                "JOIN information_schema.columns c ON c.table_schema = k.table_schema "
+                "AND c.table_name = k.table_name AND c.column_name = k.column_name "
+                "WHERE k.table_schema = %s AND k.table_name = %s AND k.constraint_name = 'PRIMARY'",
+                (MYSQL_CONFIG['database'], table)
+            )
+            keys = cursor.fetchall()
+            if len(keys) == 1 and keys[0][1] in INTEGER_TYPES:
+                # MIN/MAX of the primary key are read from the ends of its index
+                cursor.execute(f"SELECT MIN(`{keys[0][0]}`), MAX(`{keys[0][0]}`) FROM `{table}`")
+                low, high = cursor.fetchone()
+                if low is not None:
+                    key_range = (keys[0][0], low, high)
+            cursor.close()
+        finally:
+            conn.close()
+    return key_range
+
+
+@app.route('/execute/auto', methods=['POST'])
+def execute_auto():
+    """Route the query to MySQL, Trino or Spark based on its shape, table sizes and recent latency."""
+    data = request.get_json()
+    query = data.get('query')
+    source = data.get('source_dialect', 'trino')
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    engine = None
+    started = time.perf_counter()
+    try:
+        with span("router.choose_engine") as route_span:
+            engine, routing = choose_engine(query, get_table_stats(), dialect=source, key_columns=get_key_columns())
+            route_span.set_attribute('engine', engine)
+        routing['engine'] = engine
+        query, transpiled = apply_transpile(query, engine, dict(data, source_dialect=source))
+        query, preview = apply_preview(query, engine, data)
+        started = time.perf_counter()
+        if engine == 'mysql':
+            response = run_mysql(query)
+        elif engine == 'trino':
+            response = run_trino(query)
+        else:
+            response = run_spark(query)
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        if not preview:
+            # Sampled runs would skew the router's view of full-query latency
+            latency_history.record(engine, routing['query_class'], latency_ms)
+        routing['latency_ms'] = latency_ms
+        response['routing'] = routing
+        if transpiled:
+            response['transpile'] = transpiled
+        if preview:
+            annotate_preview(response, preview, query)
+        response['history_id'] = record_execution(data, engine, elapsed_ms(started), response)
+        return serialize(response)
+    except (RoutingError, TranspileError, PreviewError) as e:
+        return jsonify({'error': str(e)}), 400
+    except CostGuardError as e:
+        return cost_guard_error(e)
+    except SparkExecutionError as e:
+        record_execution(data, engine, elapsed_ms(started), error=str(e))
+        return spark_error(e)
+    except Exception as e:
+        if engine is not None:
+            # Failures before routing (e.g. statistics unavailable) are not outcomes of the query
+            record_execution(data, engine, elapsed_ms(started), error=str(e))
+        return jsonify({'error': str(e)}), 500
 
+
+@app.route('/execute/auto/stats', methods=['GET'])
+def execute_auto_stats():
+    """Recent per-engine latency history used by the router."""
+    return jsonify({'latency_history': latency_history.snapshot()})
+
+
+@app.route('/upload/csv', methods=['POST'])
+@app.route('/api/upload-csv', methods=['POST'])
+def upload_csv():
+    """Create a table from an uploaded CSV and bulk-load it into MySQL (queryable from Trino via the mysql catalog).
+
+    Form fields: file, optional table (defaults to the file name),
+    if_exists (fail|replace|append) and method (auto|infile|batch).
+    With ?stream=1 progress is returned as NDJSON events.
+    """
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'error': 'No file provided'}), 400
+    table = request.form.get('table') or os.path.splitext(upload.filename)[0]
+    if_exists = request.form.get('if_exists', 'fail')
+    method = request.form.get('method', 'auto')
+    if if_exists not in ('fail', 'replace', 'append') or method not in ('auto', 'infile', 'batch'):
+        return jsonify({'success': False, 'error': 'Invalid if_exists or method'}), 400
+
+    # Spool the upload to disk in fixed-size chunks so large files never sit in memory
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        upload.save(path, buffer_size=UPLOAD_CHUNK_BYTES)
+    except Exception as e:
+        os.remove(path)
+        return jsonify({'success': False, 'error': str(e)}), 500
+    loader = CSVLoader(MYSQL_CONFIG, path, table, if_exists=if_exists, method=method)
+
+    def finish():
+        os.remove(path)
+        # New table: refresh the rewriter schema, router statistics and cached results in every worker
+        metadata_cache.clear()
+        results_cache.clear()
+
+    if request.args.get('stream') in ('1', 'true'):
+        def generate():
+            try:
+                for event in loader.run():
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                yield json.dumps({'event': 'error', 'success': False, 'error': str(e)}) + "\n"
+            finally:
+                finish()
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        result = None
+        for event in loader.run():
+            result = event
+        return jsonify(result)
+    except CSVLoadError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        finish()
+
+
+_snapshot_store = None
+_snapshot_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    """Snapshot store opened on first use (a /snapshots request or the snapshots warm-up target), with its scheduler."""
+    global _snapshot_store
+    if _snapshot_store is None:
+        with _snapshot_store_lock:
+            if _snapshot_store is None:
+                # Snapshots materialize the whole result, not the inline preview
+                store = SnapshotStore({'mysql': run_mysql, 'trino': run_trino, 'spark': lambda query: run_spark(query, inline_rows=None)})
+                if SNAPSHOT_SCHEDULER:
+                    store.start_scheduler()
+                _snapshot_store = store
+    return _snapshot_store
+
+
+@app.route('/snapshots', methods=['GET'])
+def list_snapshots():
+    """All snapshot definitions with their freshness."""
+    return jsonify({'snapshots': get_snapshot_store().list()})
+
+
+@app.route('/snapshots', methods=['POST'])
+def define_snapshot():
+    """Create or replace a named snapshot: {name, query, engine, refresh_seconds, max_staleness_seconds}."""
+    data = request.get_json()
+    name = data.get('name')
+    query = data.get('query')
+    if not name or not query:
+        return jsonify({'error': 'name and query are required'}), 400
+    try:
+        definition = get_snapshot_store().define(
+            name,
+            query,
+            engine=data.get('engine', 'trino'),
+            refresh_seconds=data.get('refresh_seconds', SNAPSHOT_DEFAULT_REFRESH_SECONDS),
+            max_staleness_seconds=data.get('max_staleness_seconds')
+        )
+        return jsonify(definition), 201
+    except SnapshotError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    
+
+
+@app.route('/snapshots/<name>', methods=['GET'])
+def read_snapshot(name):
+    """Serve the stored result with a staleness indicator instead of re-running the query."""
+    try:
+        return jsonify(get_snapshot_store().read(name))
+    except SnapshotError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/snapshots/<name>/refresh', methods=['POST'])
+def refresh_snapshot(name):
+    """Queue an on-demand refresh; ?wait=1 blocks until it finishes."""
+    try:
+        future = get_snapshot_store().refresh(name)
+        if request.args.get('wait') in ('1', 'true'):
+            future.result()
+        return jsonify(get_snapshot_store().status(name)), 202
+    except SnapshotError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/snapshots/<name>', methods=['DELETE'])
+def delete_snapshot(name):
+    try:
+        get_snapshot_store().delete(name)
+        return jsonify({'deleted': name})
+    except SnapshotError as e:
+        return jsonify({'error': str(e)}), 404
+
+
+def _warm_mysql():
+    run_mysql("SELECT 1", guard=False)
+
+
+def _warm_trino():
+    run_trino("SELECT 1", guard=False)
+
+
+def _warm_metadata():
+    # Schema and row counts used by the rewriter and /execute/auto routing
+    get_sales_schema()
+    get_table_stats()
+
+
+def _warm_snapshots():
+    # Opens the registry and starts scheduled refreshes (WARMUP_ON_START=1 does this at boot)
+    get_snapshot_store()
+    import pyarrow.parquet  # noqa: F401
+    # Spark results are read back through pyarrow.dataset
+    import pyarrow.dataset  # noqa: F401
+
+
+add_cache_endpoints(app, cache)
+
+add_warmup_endpoint(app, {
+    'mysql': _warm_mysql,
+    'trino': _warm_trino,
+    'metadata': _warm_metadata,
+    'snapshots': _warm_snapshots,
+})
+
 if __name__ == '__main__':
     # Run the Flask server on all interfaces on port 5000.
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,386 @@
+"""Materialized query result snapshots stored as Parquet with scheduled refresh
+
+Definitions live in a SQLite registry next to the Parquet files, so every
+worker process on the host sees the same snapshots. A refresh takes one of
+SNAPSHOT_MAX_CONCURRENT_REFRESHES host-wide slots in the registry before it
+runs, and only the process holding the scheduler lock file queues scheduled
+refreshes; when it exits, another worker takes the lock over.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Registry and Parquet files; the default sits next to this module whatever the working directory
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+# Run scheduled refreshes from this process once the store is opened (0: on-demand refreshes only)
+SNAPSHOT_SCHEDULER = os.getenv("SNAPSHOT_SCHEDULER", "1") == "1"
+# Refreshes running at once across all snapshots and every worker process on the host
+SNAPSHOT_MAX_CONCURRENT_REFRESHES = int(os.getenv("SNAPSHOT_MAX_CONCURRENT_REFRESHES", "2"))
+# How often the scheduler looks for snapshots that are due
+SNAPSHOT_SCHEDULER_INTERVAL = float(os.getenv("SNAPSHOT_SCHEDULER_INTERVAL", "15"))
+# Default refresh period for new snapshots (0 = on demand only)
+SNAPSHOT_DEFAULT_REFRESH_SECONDS = float(os.getenv("SNAPSHOT_DEFAULT_REFRESH_SECONDS", "3600"))
+# A refresh slot held longer than this is taken to belong to a hung refresh and is reused
+SNAPSHOT_REFRESH_TIMEOUT = float(os.getenv("SNAPSHOT_REFRESH_TIMEOUT", "3600"))
+
+# Sleep between attempts to take a refresh slot while all are in use
+SLOT_POLL_SECONDS = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    name TEXT PRIMARY KEY,
+    definition TEXT NOT NULL,
+    refreshing_pid INTEGER,
+    refreshing_since REAL
+);
+"""
+
+ENGINES = ('mysql', 'trino', 'spark')
+
+
+class SnapshotError(Exception):
+    """Raised for unknown snapshots or invalid definitions."""
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _to_table(columns, rows):
+    """Build an Arrow table column by column, storing mixed-type columns as text."""
+    # pyarrow is only needed once a snapshot is written or read, not at server start-up
+    import pyarrow as pa
+    arrays = []
+    for i in range(len(columns)):
+        values = [row[i] for row in rows]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.array([None if value is None else str(value) for value in values], type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def _normalize_result(result):
+    """columns/results from any runner; Spark returns results as a list of dicts."""
+    rows = result.get('results') or []
+    columns = result.get('columns')
+    if columns is None:
+        columns = list(rows[0].keys()) if rows and isinstance(rows[0], dict) else []
+    if rows and isinstance(rows[0], dict):
+        rows = [[row.get(column) for column in columns] for row in rows]
+    return columns, rows
+
+
+class SnapshotStore:
+    """Registry of named queries whose results are materialized to Parquet files.
+
+    runners maps engine name -> callable(query) returning a dict with
+    columns/results, as produced by the server's run_* helpers.
+    """
+
+    def __init__(self, runners, directory=SNAPSHOT_DIR, max_workers=SNAPSHOT_MAX_CONCURRENT_REFRESHES):
+        self.runners = runners
+        self.directory = directory
+        self.registry_path = os.path.join(directory, "registry.db")
+        self.max_concurrent = max_workers
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="snapshot-refresh")
+        self._in_flight = {}
+        self._scheduler = None
+        self._scheduler_lock = None
+        self._stop = threading.Event()
+        self._connection().executescript(SCHEMA)
+        self._import_json_registry()
+
+    def _connection(self):
+        # One connection per thread; autocommit, with explicit BEGIN IMMEDIATE around read-modify-write
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.registry_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_json_registry(self):
+        """Move definitions from the registry.json of earlier versions into the database, once."""
+        path = os.path.join(self.directory, "registry.json")
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            definitions = json.load(f)
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR IGNORE INTO snapshots (name, definition) VALUES (?, ?)",
+            [(name, json.dumps(definition)) for name, definition in definitions.items()]
+        )
+        os.replace(path, path + ".imported")
+
+    @property
+    def definitions(self):
+        rows = self._connection().execute("SELECT name, definition FROM snapshots").fetchall()
+        return {name: json.loads(definition) for name, definition in rows}
+
+    def _data_path(self, name):
+        return os.path.join(self.directory, f"{name}.parquet")
+
+    def _get(self, name):
+        row = self._connection().execute("SELECT definition FROM snapshots WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise SnapshotError(f"Unknown snapshot: {name}")
+        return json.loads(row[0])
+
+    def define(self, name, query, engine='trino', refresh_seconds=SNAPSHOT_DEFAULT_REFRESH_SECONDS, max_staleness_seconds=None):
+        """Create or replace a snapshot definition; the first refresh is scheduled immediately."""
+        if not name or not name.replace("_", "").replace("-", "").isalnum():
+            raise SnapshotError("Snapshot names may only contain letters, digits, '-' and '_'")
+        if engine not in ENGINES:
+            raise SnapshotError(f"Unsupported engine: {engine}")
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT definition FROM snapshots WHERE name = ?", (name,)).fetchone()
+            previous = json.loads(row[0]) if row else {}
+            definition = {
+                'name': name,
+                'query': query,
+                'engine': engine,
+                'refresh_seconds': float(refresh_seconds or 0),
+                # Reads older than this are flagged stale (defaults to the refresh period)
+                'max_staleness_seconds': float(max_staleness_seconds or refresh_seconds or 0),
+                'created_at': previous.get('created_at', _now().isoformat()),
+                'refreshed_at': previous.get('refreshed_at') if previous.get('query') == query else None,
+                'row_count': previous.get('row_count') if previous.get('query') == query else None,
+                'last_error': None,
+            }
+            conn.execute(
+                "INSERT INTO snapshots (name, definition) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET definition = excluded.definition",
+                (name, json.dumps(definition))
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.refresh(name)
+        return definition
+
+    def delete(self, name):
+        """Remove a snapshot; a refresh still running for it discards its result when it finishes."""
+        if self._connection().execute("DELETE FROM snapshots WHERE name = ?", (name,)).rowcount == 0:
+            raise SnapshotError(f"Unknown snapshot: {name}")
+        if os.path.exists(self._data_path(name)):
+            os.remove(self._data_path(name))
+
+    def _refreshing(self):
+        """Names with a refresh running in any process on the host."""
+        rows = self._connection().execute(
+            "SELECT name, refreshing_pid, refreshing_since FROM snapshots WHERE refreshing_pid IS NOT NULL"
+        ).fetchall()
+        now = time.time()
+        return {name for name, pid, since in rows if _alive(pid) and now - since < SNAPSHOT_REFRESH_TIMEOUT}
+
+    def status(self, name, refreshing=None):
+        """Definition plus freshness fields for a snapshot."""
+        definition = self._get(name)
+        refreshed_at = definition.get('refreshed_at')
+        age = None
+        if refreshed_at:
+            age = (_now() - datetime.fromisoformat(refreshed_at)).total_seconds()
+        limit = definition['max_staleness_seconds']
+        definition['age_seconds'] = round(age, 1) if age is not None else None
+        definition['stale'] = age is None or (limit > 0 and age > limit)
+        refreshing = self._refreshing() if refreshing is None else refreshing
+        definition['refreshing'] = name in self._in_flight or name in refreshing
+        return definition
+
+    def list(self):
+        refreshing = self._refreshing()
+        return [self.status(name, refreshing) for name in sorted(self.definitions)]
+
+    def read(self, name):
+        """Serve the materialized result; never touches the query engines."""
+        status = self.status(name)
+        path = self._data_path(name)
+        if not os.path.exists(path):
+            return {'columns': [], 'results': [], 'snapshot': status}
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        columns = table.column_names
+        data = table.to_pydict()
+        results = [list(row) for row in zip(*(data[column] for column in columns))]
+        return {'columns': columns, 'results': results, 'snapshot': status}
+
+    def refresh(self, name):
+        """Queue a refresh; a snapshot already being refreshed is not queued twice."""
+        self._get(name)
+        with self._lock:
+            future = self._in_flight.get(name)
+            if future is None:
+                future = self._executor.submit(self._refresh, name)
+                self._in_flight[name] = future
+        return future
+
+    def _claim(self, name):
+        """Take a host-wide refresh slot for name: 'claimed', 'running' elsewhere, 'busy' (no free slot) or 'deleted'."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM snapshots WHERE name = ?", (name,)).fetchone() is None:
+                return 'deleted'
+            refreshing = self._refreshing()
+            if name in refreshing:
+                return 'running'
+            if len(refreshing) >= self.max_concurrent:
+                return 'busy'
+            conn.execute(
+                "UPDATE snapshots SET refreshing_pid = ?, refreshing_since = ? WHERE name = ?",
+                (os.getpid(), time.time(), name)
+            )
+            return 'claimed'
+        finally:
+            conn.execute("COMMIT")
+
+    def _release(self, name):
+        self._connection().execute(
+            "UPDATE snapshots SET refreshing_pid = NULL, refreshing_since = NULL WHERE name = ? AND refreshing_pid = ?",
+            (name, os.getpid())
+        )
+
+    def _finish(self, name, query, update, tmp_path=None):
+        """Store a refresh's outcome unless the snapshot was deleted or redefined meanwhile: 'stored', 'deleted' or 'redefined'."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT definition FROM snapshots WHERE name = ?", (name,)).fetchone()
+            definition = json.loads(row[0]) if row else None
+            if definition is None or definition['query'] != query:
+                if tmp_path is not None:
+                    os.remove(tmp_path)
+                if definition is None and os.path.exists(self._data_path(name)):
+                    # Deleted while this refresh ran: nothing may be left behind
+                    os.remove(self._data_path(name))
+                return 'deleted' if definition is None else 'redefined'
+            if tmp_path is not None:
+                # Readers keep seeing the previous snapshot until the new one is complete
+                os.replace(tmp_path, self._data_path(name))
+            definition.update(update)
+            conn.execute("UPDATE snapshots SET definition = ? WHERE name = ?", (json.dumps(definition), name))
+            return 'stored'
+        finally:
+            conn.execute("COMMIT")
+
+    def _run(self, name):
+        """Run a snapshot's query and store the result; returns the outcome of _finish."""
+        definition = self._get(name)
+        started = time.perf_counter()
+        tmp_path = None
+        try:
+            columns, rows = _normalize_result(self.runners[definition['engine']](definition['query']))
+            table = _to_table(columns, rows)
+            import pyarrow.parquet as pq
+            tmp_path = f"{self._data_path(name)}.{os.getpid()}.tmp"
+            pq.write_table(table, tmp_path)
+            update = {
+                'refreshed_at': _now().isoformat(),
+                'row_count': len(rows),
+                'refresh_ms': round((time.perf_counter() - started) * 1000, 1),
+                'last_error': None,
+            }
+        except Exception as e:
+            print(f"Snapshot {name} refresh failed: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            tmp_path = None
+            update = {'last_error': str(e), 'last_error_at': _now().isoformat()}
+        return self._finish(name, definition['query'], update, tmp_path)
+
+    def _refresh(self, name):
+        try:
+            while True:
+                claim = self._claim(name)
+                if claim == 'busy':
+                    time.sleep(SLOT_POLL_SECONDS)
+                    continue
+                if claim != 'claimed':
+                    return
+                try:
+                    outcome = self._run(name)
+                finally:
+                    self._release(name)
+                # A redefinition during the run was not refreshed by this run; do it now
+                if outcome != 'redefined':
+                    return
+        except SnapshotError:
+            pass
+        finally:
+            with self._lock:
+                self._in_flight.pop(name, None)
+
+    def due(self):
+        """Snapshots whose refresh period has elapsed."""
+        names = []
+        refreshing = self._refreshing()
+        for name, definition in self.definitions.items():
+            period = definition['refresh_seconds']
+            if period <= 0 or name in self._in_flight or name in refreshing:
+                continue
+            refreshed_at = definition.get('refreshed_at')
+            if refreshed_at is None or (_now() - datetime.fromisoformat(refreshed_at)).total_seconds() >= period:
+                names.append(name)
+        return names
+
+    def _lead(self):
+        """Whether this process holds the scheduler lock file (taken over when its holder exits)."""
+        if self._scheduler_lock is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:
+            # No flock (Windows): a single-process development server
+            return True
+        lock_file = open(os.path.join(self.directory, "scheduler.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._scheduler_lock = lock_file
+        return True
+
+    def start_scheduler(self, interval=SNAPSHOT_SCHEDULER_INTERVAL):
+        """Background thread that queues due refreshes while this process is the scheduler; slots bound concurrency."""
+        if self._scheduler is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    if not self._lead():
+                        continue
+                    for name in self.due():
+                        try:
+                            self.refresh(name)
+                        except SnapshotError:
+                            pass
+                except Exception as e:
+                    print(f"Snapshot scheduler error: {e}")
+
+        self._scheduler = threading.Thread(target=loop, name="snapshot-scheduler", daemon=True)
+        self._scheduler.start()
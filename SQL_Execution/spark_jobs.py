@@ -0,0 +1,107 @@
+"""Spark job directories on the volume shared with the Spark container
+
+Each spark-submit run gets its own directory holding the job script, the
+Spark log (stdout and stderr), the result as Parquet part files under data/
+and a small manifest.json (status, schema, row count, file list, timings)
+written by sparkscript.py. The server reads the manifest instead of parsing
+stdout, returns small results inline and streams large ones from the files.
+"""
+
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+# Host path of the shared volume (mounted into the Spark container, see docker-compose.yml)
+SPARK_RESULTS_DIR = os.getenv("SPARK_RESULTS_DIR", "spark_results")
+# The same volume as seen from inside the Spark container
+SPARK_RESULTS_CONTAINER_DIR = os.getenv("SPARK_RESULTS_CONTAINER_DIR", "/opt/spark-results")
+# Job directories older than this are removed when a new job starts
+SPARK_RESULT_RETENTION_SECONDS = float(os.getenv("SPARK_RESULT_RETENTION_SECONDS", "3600"))
+# Rows per Parquet part file written by the Spark job
+SPARK_RESULT_ROWS_PER_FILE = int(os.getenv("SPARK_RESULT_ROWS_PER_FILE", "100000"))
+# Rows returned in the JSON response; larger results are truncated there and streamed from /spark/jobs/<id>/results
+SPARK_INLINE_MAX_ROWS = int(os.getenv("SPARK_INLINE_MAX_ROWS", "10000"))
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SparkJobError(Exception):
+    """Raised for unknown jobs or jobs without a readable result."""
+
+
+class SparkJobStore:
+    """Creates, reads and prunes per-job directories on the shared volume."""
+
+    def __init__(self, directory=SPARK_RESULTS_DIR, container_directory=SPARK_RESULTS_CONTAINER_DIR,
+                 retention_seconds=SPARK_RESULT_RETENTION_SECONDS):
+        self.directory = directory
+        self.container_directory = container_directory
+        self.retention_seconds = retention_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self):
+        """New job directory; returns the job id, its host path and its path inside the container."""
+        self.prune()
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, job_id)
+        os.makedirs(path)
+        # The Spark image runs as a non-root user that must be able to write here
+        os.chmod(path, 0o777)
+        return job_id, path, f"{self.container_directory}/{job_id}"
+
+    def path(self, job_id, *parts):
+        if not JOB_ID_PATTERN.match(job_id or ""):
+            raise SparkJobError(f"Unknown Spark job: {job_id}")
+        path = os.path.join(self.directory, job_id, *parts)
+        if not os.path.exists(os.path.join(self.directory, job_id)):
+            raise SparkJobError(f"Unknown Spark job: {job_id}")
+        return path
+
+    def manifest(self, job_id):
+        """The manifest written by sparkscript.py, or None if the job never wrote one."""
+        path = self.path(job_id, "manifest.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def log_tail(self, job_id, lines=40):
+        path = self.path(job_id, "spark.log")
+        if not os.path.exists(path):
+            return ""
+        with open(path, errors="replace") as f:
+            return "".join(f.readlines()[-lines:])
+
+    def data_files(self, job_id):
+        """Host paths of the result part files listed in the manifest."""
+        manifest = self.manifest(job_id)
+        if manifest is None or manifest.get('status') != 'success':
+            raise SparkJobError(f"Spark job {job_id} has no result")
+        return [self.path(job_id, "data", item['name']) for item in manifest['files']]
+
+    def read_rows(self, job_id, limit=None):
+        """Result rows as dicts, at most limit of them (None for all)."""
+        import pyarrow.dataset as ds
+        files = self.data_files(job_id)
+        if not files:
+            return []
+        dataset = ds.dataset(files, format="parquet")
+        table = dataset.to_table() if limit is None else dataset.head(limit)
+        return table.to_pylist()
+
+    def iter_batches(self, job_id):
+        """Arrow schema and record batches of the result, read one part file at a time."""
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(self.data_files(job_id), format="parquet")
+        return dataset.schema, dataset.to_batches()
+
+    def prune(self):
+        """Remove job directories older than the retention period."""
+        cutoff = time.time() - self.retention_seconds
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if JOB_ID_PATTERN.match(name) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
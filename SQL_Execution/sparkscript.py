@@ -1,16 +1,27 @@
 from pyspark.sql import SparkSession
+import os
 import sys
 import json
 import re
+import time
 import traceback
 from datetime import datetime, timezone
 
-def execute_query(query):
+def write_manifest(output_dir, manifest):
+    # Write then rename so the server never reads a half-written manifest
+    tmp_path = os.path.join(output_dir, "manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(output_dir, "manifest.json"))
+
+def execute_query(query, output_dir, rows_per_file):
+    started = time.perf_counter()
     # Create a SparkSession with MySQL connector
     spark = SparkSession.builder \
         .appName("ExecuteQuery") \
         .config("spark.jars", "/opt/spark/jars/mysql-connector-java.jar") \
         .getOrCreate()
+    session_ms = round((time.perf_counter() - started) * 1000, 1)
     
     try:
         # Extract the table name if it's a simple query
@@ -63,45 +74,57 @@ def execute_query(query):
         schema = [{"name": field.name, "type": field.dataType.simpleString()} 
                   for field in result_df.schema.fields]
         
-        # Convert to list of dictionaries for JSON serialization
-        results = [row.asDict() for row in result_df.collect()]
+        # Write the result as Parquet part files on the shared volume instead of collecting it
+        written = time.perf_counter()
+        data_dir = os.path.join(output_dir, "data")
+        result_df.write \
+            .option("maxRecordsPerFile", rows_per_file) \
+            .mode("overwrite") \
+            .parquet(f"file://{data_dir}")
+        write_ms = round((time.perf_counter() - written) * 1000, 1)
+        
+        # The row count comes from the Parquet footers, not a second pass over the query
+        count = spark.read.parquet(f"file://{data_dir}").count()
+        files = [
+            {"name": name, "bytes": os.path.getsize(os.path.join(data_dir, name))}
+            for name in sorted(os.listdir(data_dir)) if name.endswith(".parquet")
+        ]
         
-        # Create a structured response
-        response = {
+        # Only this small manifest is handed back; the server reads the rows from the files
+        write_manifest(output_dir, {
             "status": "success",
             "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
             "query": query,
             "schema": schema,
-            "count": len(results),
-            "results": results
-        }
-        
-        # Print ONLY the JSON results - nothing else to stdout
-        print(json.dumps(response))
+            "count": count,
+            "format": "parquet",
+            "files": files,
+            "timing": {
+                "session_ms": session_ms,
+                "execute_write_ms": write_ms,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1)
+            }
+        })
         
         return True
     except Exception as e:
-        error_details = {
+        write_manifest(output_dir, {
             "status": "error",
             "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
             "query": query,
-            "error": str(e)
-        }
-        print(json.dumps(error_details))
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        })
         return False
     finally:
         # Always stop the SparkSession
         spark.stop()
 
 if __name__ == "__main__":
-    # Get the query from command line arguments
-    if len(sys.argv) > 1:
-        query = sys.argv[1]
-        execute_query(query)
+    # Arguments: the query, the job directory on the shared volume and the rows per Parquet file
+    if len(sys.argv) > 2:
+        rows_per_file = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+        sys.exit(0 if execute_query(sys.argv[1], sys.argv[2], rows_per_file) else 1)
     else:
-        error_response = {
-            "status": "error",
-            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-            "error": "No query provided"
-        }
-        print(json.dumps(error_response))
\ No newline at end of file
+        print("Usage: sparkscript.py <query> <output_dir> [rows_per_file]", file=sys.stderr)
+        sys.exit(2)
@@ -0,0 +1,251 @@
+"""Deterministic AST rewrites applied to generated SQL before execution"""
+
+import os
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.pushdown_predicates import pushdown_predicates
+from sqlglot.optimizer.pushdown_projections import pushdown_projections
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.optimizer.simplify import simplify
+from sqlglot.optimizer.unnest_subqueries import unnest_subqueries
+
+# Engine name -> sqlglot dialect
+DIALECTS = {'mysql': 'mysql', 'trino': 'trino', 'spark': 'spark'}
+
+# Rule switches; REWRITE_RULES overrides the defaults, e.g. "pushdown_predicates,semi_join"
+DEFAULT_RULES = {
+    'pushdown_predicates': True,
+    'prune_columns': True,
+    'semi_join': True,
+    'remove_subquery_order': True,
+    'preview_limit': False,
+}
+if os.getenv("REWRITE_RULES"):
+    enabled = {name.strip() for name in os.getenv("REWRITE_RULES").split(",")}
+    DEFAULT_RULES = {name: name in enabled for name in DEFAULT_RULES}
+
+PREVIEW_LIMIT = int(os.getenv("PREVIEW_LIMIT", "100"))
+
+# Rules that need resolved (qualified) column references to be safe
+QUALIFYING_RULES = ('pushdown_predicates', 'prune_columns', 'semi_join')
+
+# Rules that move expressions across scopes and so need every SELECT * expanded
+STAR_FREE_RULES = ('semi_join', 'pushdown_predicates', 'prune_columns')
+
+
+class RewriteError(Exception):
+    """Raised when a query cannot be parsed for rewriting."""
+
+
+def _is_star(projection):
+    return isinstance(projection, exp.Star) or (isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star))
+
+
+def _has_unexpanded_star(expression):
+    return any(_is_star(projection) for select in expression.find_all(exp.Select) for projection in select.expressions)
+
+
+def _mark(expression):
+    """Note how the query was written, so _unqualify can restore it after the qualifying rules."""
+    for identifier in expression.find_all(exp.Identifier):
+        identifier.meta['rewrite_name'] = (identifier.this, identifier.quoted)
+    for select in expression.find_all(exp.Select):
+        for projection in select.expressions:
+            if not isinstance(projection, exp.Alias):
+                projection.meta['rewrite_unaliased'] = True
+        if any(_is_star(projection) for projection in select.expressions):
+            select.meta['rewrite_star'] = [projection.copy() for projection in select.expressions]
+    for table in expression.find_all(exp.Table):
+        if not table.alias:
+            table.meta['rewrite_unaliased'] = True
+    for column in expression.find_all(exp.Column):
+        if not column.table:
+            column.meta['rewrite_unqualified'] = True
+
+
+def _record_expansions(qualified):
+    """Remember what qualify() expanded each SELECT * into, to tell later whether a rule changed it."""
+    for select in qualified.find_all(exp.Select):
+        if 'rewrite_star' in select.meta:
+            select.meta['rewrite_expanded'] = (
+                [projection.alias_or_name for projection in select.expressions], len(select.args.get('joins') or [])
+            )
+
+
+def _single_source(select):
+    """Alias or name of the only table or subquery a SELECT reads, or None when it joins several."""
+    source = select.args.get('from_')
+    if source is None or select.args.get('joins'):
+        return None
+    return source.this.alias_or_name.lower()
+
+
+def _unqualify(expression):
+    """Undo what qualify() did for its own analysis and the rules did not need: lowercased or quoted
+    identifiers, generated output and table aliases, added column qualifiers and expanded stars."""
+    expression = expression.copy()
+    for select in list(expression.find_all(exp.Select)):
+        expanded = select.meta.get('rewrite_expanded')
+        if expanded and expanded == ([p.alias_or_name for p in select.expressions], len(select.args.get('joins') or [])):
+            select.set('expressions', [projection.copy() for projection in select.meta['rewrite_star']])
+    for alias in list(expression.find_all(exp.Alias)):
+        target = alias.this
+        if isinstance(target, exp.Column) and target.name == alias.alias:
+            alias.replace(target)
+            continue
+        if not target.meta.get('rewrite_unaliased'):
+            continue
+        if isinstance(target, exp.Column) and target.name.lower() == alias.alias.lower():
+            alias.replace(target)
+            continue
+        # A generated name (_col_1) can go if nothing but the query's own ORDER BY refers to it
+        references = [column for column in expression.find_all(exp.Column)
+                      if not column.table and column.name.lower() == alias.alias.lower()]
+        order = alias.parent.args.get('order') if isinstance(alias.parent, exp.Select) else None
+        if all(order is not None and column.find_ancestor(exp.Order) is order for column in references):
+            for column in references:
+                column.replace(target.copy())
+            alias.replace(target)
+    for table in expression.find_all(exp.Table):
+        if table.meta.get('rewrite_unaliased') and table.alias.lower() == table.name.lower():
+            table.set('alias', None)
+    for column in expression.find_all(exp.Column):
+        # Qualifiers the query was written with stay; those added by qualify() or star expansion go
+        generated = 'rewrite_name' not in column.this.meta
+        if column.table and (column.meta.get('rewrite_unqualified') or generated):
+            select = column.find_ancestor(exp.Select)
+            if select is not None and _single_source(select) == column.table.lower():
+                column.set('table', None)
+    for identifier in expression.find_all(exp.Identifier):
+        written = identifier.meta.get('rewrite_name')
+        if written and identifier.this.lower() == written[0].lower():
+            identifier.set('this', written[0])
+            identifier.set('quoted', written[1])
+    return expression
+
+
+def _remove_subquery_order(expression):
+    """Drop ORDER BY from subqueries and CTEs where it cannot affect the result."""
+    for select in list(expression.find_all(exp.Select)):
+        if select is expression:
+            continue
+        if not select.args.get('order'):
+            continue
+        if select.args.get('limit') or select.args.get('offset') or select.args.get('fetch'):
+            continue
+        select.set('order', None)
+    return expression
+
+
+def _preview_limit(expression, limit):
+    """Cap the outermost query at limit rows when it has no LIMIT of its own."""
+    if isinstance(expression, exp.Query) and not expression.args.get('limit') and not expression.args.get('fetch'):
+        return expression.limit(limit, copy=False)
+    return expression
+
+
+def resolve_rules(overrides=None):
+    """Merge per-request rule switches into the defaults."""
+    rules = dict(DEFAULT_RULES)
+    for name, value in (overrides or {}).items():
+        if name not in rules:
+            raise RewriteError(f"Unknown rewrite rule: {name}")
+        rules[name] = bool(value)
+    return rules
+
+
+def rewrite_sql(sql, engine='trino', rules=None, schema=None, preview_limit=PREVIEW_LIMIT):
+    """Apply the enabled rewrite rules to a single SELECT.
+
+    schema maps table -> {column: type}; without it SELECT * cannot be
+    expanded, so column pruning only applies to explicit projections.
+    Returns (rewritten_sql, applied_rule_names, skipped_rule_names).
+    Non-SELECT statements are returned unchanged.
+    """
+    dialect = DIALECTS[engine]
+    rules = resolve_rules(rules)
+    try:
+        expression = sqlglot.parse_one(sql, read=dialect)
+    except sqlglot.errors.SqlglotError as e:
+        raise RewriteError(f"Unable to parse query for rewriting: {e}")
+    if not isinstance(expression, exp.Query):
+        return sql, [], []
+
+    applied = []
+    skipped = []
+
+    def skip(names):
+        for name in names:
+            if rules[name]:
+                rules[name] = False
+                skipped.append(name)
+
+    _mark(expression)
+    qualified = None
+    if any(rules[name] for name in QUALIFYING_RULES):
+        # The qualifying rules work on a qualified copy; qualify()'s own changes
+        # (aliases, qualifiers, identifier case) are undone before the SQL is emitted
+        try:
+            qualified = qualify(
+                expression.copy(),
+                dialect=dialect,
+                schema=schema or {},
+                identify=False,
+                validate_qualify_columns=False,
+            )
+        except Exception:
+            # sqlglot raises a mix of OptimizeError/AssertionError on shapes it
+            # cannot resolve; those rules are simply not applied
+            skip(QUALIFYING_RULES)
+    if qualified is not None:
+        if _has_unexpanded_star(qualified):
+            # Tables missing from the schema: a join or predicate could be moved
+            # into a scope where the star picks up or loses columns
+            skip(STAR_FREE_RULES)
+        _record_expansions(qualified)
+
+        def apply_qualified(name, transform, baseline=lambda e: e):
+            # A rule applies when its result differs from the same tree without it,
+            # as written out; baseline repeats any cleanup the rule runs (simplify)
+            nonlocal qualified
+            try:
+                candidate = transform(qualified.copy())
+                unchanged = baseline(qualified.copy())
+            except Exception:
+                skipped.append(name)
+                return
+            if _unqualify(candidate).sql(dialect=dialect) != _unqualify(unchanged).sql(dialect=dialect):
+                qualified = candidate
+                applied.append(name)
+
+        if rules['semi_join']:
+            apply_qualified('semi_join', lambda e: simplify(unnest_subqueries(e)), simplify)
+        if rules['pushdown_predicates']:
+            apply_qualified('pushdown_predicates', lambda e: simplify(pushdown_predicates(e)), simplify)
+        if rules['prune_columns']:
+            apply_qualified('prune_columns', pushdown_projections)
+        if applied:
+            expression = _unqualify(qualified)
+
+    def apply(name, transform):
+        # Transforms mutate in place, so run each on a copy and keep the old tree when a rule does not apply
+        nonlocal expression
+        before = expression.sql(dialect=dialect)
+        try:
+            candidate = transform(expression.copy())
+        except Exception:
+            skipped.append(name)
+            return
+        if candidate.sql(dialect=dialect) != before:
+            expression = candidate
+            applied.append(name)
+
+    if rules['remove_subquery_order']:
+        apply('remove_subquery_order', _remove_subquery_order)
+    if rules['preview_limit']:
+        apply('preview_limit', lambda e: _preview_limit(e, preview_limit))
+
+    if not applied:
+        return sql, [], skipped
+    return expression.sql(dialect=dialect), applied, skipped
@@ -0,0 +1,126 @@
+"""AST-based SQL translation between the MySQL, Trino and Spark dialects"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ErrorLevel, SqlglotError
+
+# Engine name -> sqlglot dialect
+DIALECTS = {'mysql': 'mysql', 'trino': 'trino', 'spark': 'spark'}
+
+TRANSPILE_CACHE_SIZE = int(os.getenv("TRANSPILE_CACHE_SIZE", "4096"))
+
+
+class TranspileError(Exception):
+    """Raised when a query cannot be expressed in the target dialect."""
+
+
+def _mysql_fixups(node):
+    """Replace functions sqlglot passes through but MySQL does not have."""
+    if isinstance(node, exp.ApproxDistinct):
+        return exp.Count(this=exp.Distinct(expressions=[node.this]))
+    return node
+
+
+# Target-specific AST transforms applied after parsing
+TARGET_FIXUPS = {'mysql': _mysql_fixups}
+
+# Constructs sqlglot writes out unchanged although the target cannot run them
+TARGET_UNSUPPORTED = {
+    'mysql': (
+        (exp.Unnest, "UNNEST"),
+        (exp.Explode, "EXPLODE"),
+        (exp.Lambda, "lambda expressions"),
+        (exp.Struct, "ROW/STRUCT values"),
+        (exp.Bracket, "array or map subscripts"),
+        (exp.ArraySize, "array functions"),
+        (exp.ApproxQuantile, "approximate percentiles"),
+        (exp.Filter, "aggregate FILTER clauses"),
+    ),
+}
+
+
+def _unsupported(statement, target):
+    """Names of the constructs in statement that the target dialect lacks."""
+    found = []
+    for node_type, name in TARGET_UNSUPPORTED.get(target, ()):
+        if statement.find(node_type) and name not in found:
+            found.append(name)
+    if target == 'mysql':
+        lateral = statement.find(exp.Lateral)
+        if lateral is not None and lateral.args.get('view'):
+            found.append("LATERAL VIEW")
+    return found
+
+
+class TranspileCache:
+    """Thread-safe LRU of translations keyed by (source, target, SQL hash)."""
+
+    def __init__(self, max_size=TRANSPILE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+transpile_cache = TranspileCache()
+
+
+def transpile(sql, source, target):
+    """Translate sql from the source engine's dialect to the target's.
+
+    Returns (translated_sql, info) where info reports whether the cache was
+    hit and how long the call took in microseconds.
+    """
+    if source not in DIALECTS or target not in DIALECTS:
+        raise TranspileError(f"Unsupported dialect pair: {source} -> {target}")
+    started = time.perf_counter()
+    if source == target:
+        return sql, {'cached': False, 'elapsed_us': 0.0}
+
+    key = (source, target, hashlib.sha256(sql.encode('utf-8')).hexdigest())
+    translated = transpile_cache.get(key)
+    cached = translated is not None
+    if not cached:
+        try:
+            statements = sqlglot.parse(sql, read=DIALECTS[source])
+            fixup = TARGET_FIXUPS.get(target)
+            parts = []
+            for statement in statements:
+                if statement is None:
+                    continue
+                if fixup:
+                    statement = statement.transform(fixup)
+                unsupported = _unsupported(statement, target)
+                if unsupported:
+                    raise TranspileError(f"Cannot translate {source} SQL to {target}: {target} has no {', '.join(unsupported)}")
+                parts.append(statement.sql(dialect=DIALECTS[target], unsupported_level=ErrorLevel.RAISE))
+        except SqlglotError as e:
+            raise TranspileError(f"Cannot translate {source} SQL to {target}: {e}")
+        translated = ";\n".join(parts)
+        transpile_cache.put(key, translated)
+    elapsed_us = round((time.perf_counter() - started) * 1_000_000, 1)
+    return translated, {'cached': cached, 'elapsed_us': elapsed_us}
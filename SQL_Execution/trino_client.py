@@ -0,0 +1,186 @@
+"""Trino execution path with pooled HTTP connections, page prefetching and query stats"""
+
+import datetime
+import decimal
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.http import http_date
+
+# Keep-alive connections shared by all requests to the coordinator
+TRINO_POOL_SIZE = int(os.getenv("TRINO_POOL_SIZE", "32"))
+# Rows requested per fetchmany call and result pages buffered ahead of the decoder
+TRINO_FETCH_SIZE = int(os.getenv("TRINO_FETCH_SIZE", "5000"))
+TRINO_PREFETCH_PAGES = int(os.getenv("TRINO_PREFETCH_PAGES", "4"))
+# Session properties applied to every query, e.g. '{"query_max_run_time": "5m"}'
+TRINO_SESSION_PROPERTIES = json.loads(os.getenv("TRINO_SESSION_PROPERTIES", "{}"))
+# Spooled result encodings (e.g. "json+zstd") for coordinators that support the spooling protocol
+TRINO_ENCODING = os.getenv("TRINO_ENCODING", "")
+
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=TRINO_POOL_SIZE)
+
+
+def new_http_session():
+    """A requests session backed by the shared connection pool.
+
+    The Trino client writes per-query headers (user, catalog, session
+    properties) onto its session, so sessions are per query while the
+    underlying keep-alive connections are shared.
+    """
+    session = requests.Session()
+    session.mount("http://", _adapter)
+    session.mount("https://", _adapter)
+    return session
+
+
+def connect(config, session_properties=None):
+    """Open a DB-API connection on the pooled transport with merged session properties."""
+    properties = dict(TRINO_SESSION_PROPERTIES)
+    properties.update(session_properties or {})
+    options = dict(
+        host=config['host'],
+        port=config['port'],
+        user=config['user'],
+        catalog=config['catalog'],
+        schema=config['schema'],
+        session_properties=properties or None,
+        http_session=new_http_session(),
+    )
+    if TRINO_ENCODING:
+        options['encoding'] = TRINO_ENCODING
+    # Imported on first use so processes that never query Trino do not pay for it at start-up
+    import trino
+    return trino.dbapi.connect(**options)
+
+
+def _json_value(value):
+    """Convert a Trino value to what Flask's JSON provider would emit for it."""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return http_date(value)
+    if isinstance(value, (list, tuple)):
+        return [_json_value(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _json_value(item) for key, item in value.items()}
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def fetch_all_prefetched(cursor, page_size=TRINO_FETCH_SIZE, depth=TRINO_PREFETCH_PAGES):
+    """Fetch all rows with a background thread walking the result pages while
+    the calling thread converts already-received pages to JSON-ready rows.
+
+    Returns (rows, timings) where timings splits our time into waiting on
+    Trino and decoding.
+    """
+    pages = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            while not stop.is_set():
+                page = cursor.fetchmany(page_size)
+                pages.put(page)
+                if not page:
+                    return
+        except BaseException as e:
+            pages.put(e)
+
+    producer = threading.Thread(target=produce, name="trino-prefetch", daemon=True)
+    producer.start()
+    rows = []
+    wait_s = 0.0
+    decode_s = 0.0
+    finished = False
+    try:
+        while True:
+            waited = time.perf_counter()
+            page = pages.get()
+            wait_s += time.perf_counter() - waited
+            if isinstance(page, BaseException):
+                raise page
+            if not page:
+                finished = True
+                break
+            decoding = time.perf_counter()
+            rows.extend([_json_value(value) for value in row] for row in page)
+            decode_s += time.perf_counter() - decoding
+    finally:
+        if finished:
+            # The producer has handed over the last page and is only returning
+            producer.join(timeout=5)
+        elif producer.is_alive():
+            # Abandoned early (decode error): stop the query and unblock the producer
+            stop.set()
+            try:
+                cursor.cancel()
+            except Exception:
+                pass
+            while producer.is_alive():
+                try:
+                    pages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+    return rows, {'fetch_wait_ms': round(wait_s * 1000, 1), 'decode_ms': round(decode_s * 1000, 1)}
+
+
+def query_stats(cursor, config=None, include_query_info=False):
+    """Trino-side timings and volumes for the last query on the cursor."""
+    stats = cursor.stats or {}
+    queued_ms = stats.get('queuedTimeMillis')
+    elapsed_ms = stats.get('elapsedTimeMillis')
+    planning_ms = stats.get('planningTimeMillis')
+    if include_query_info and planning_ms is None and cursor.query_id and config:
+        # Planning time is only exposed by the coordinator's query info resource
+        try:
+            info = new_http_session().get(
+                f"http://{config['host']}:{config['port']}/v1/query/{cursor.query_id}",
+                headers={'X-Trino-User': config['user']},
+                timeout=5,
+            ).json()
+            planning = info.get('queryStats', {}).get('planningTime')
+            planning_ms = _duration_ms(planning)
+        except Exception:
+            planning_ms = None
+    execution_ms = None
+    if elapsed_ms is not None:
+        execution_ms = elapsed_ms - (queued_ms or 0) - (planning_ms or 0)
+    return {
+        'query_id': cursor.query_id,
+        'state': stats.get('state'),
+        'queued_ms': queued_ms,
+        'planning_ms': planning_ms,
+        'execution_ms': execution_ms,
+        'elapsed_ms': elapsed_ms,
+        'cpu_ms': stats.get('cpuTimeMillis'),
+        'processed_rows': stats.get('processedRows'),
+        'processed_bytes': stats.get('processedBytes'),
+        'physical_input_bytes': stats.get('physicalInputBytes'),
+        'peak_memory_bytes': stats.get('peakMemoryBytes'),
+    }
+
+
+DURATION_UNITS = {'ns': 1e-6, 'us': 1e-3, 'ms': 1.0, 's': 1000.0, 'm': 60000.0, 'h': 3600000.0, 'd': 86400000.0}
+
+
+def _duration_ms(value):
+    """Parse Trino durations such as '12.34ms' or '1.20s'."""
+    if not value:
+        return None
+    for unit in sorted(DURATION_UNITS, key=len, reverse=True):
+        if value.endswith(unit):
+            try:
+                return round(float(value[:-len(unit)]) * DURATION_UNITS[unit], 1)
+            except ValueError:
+                return None
+    return None
@@ -2,20 +2,31 @@
 
 """Dependencies"""
 import logging
+import os
+import sys
 from langchain_community.vectorstores import FAISS
 from langchain_community.document_loaders import TextLoader
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+# Shared backend modules live in backend/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from embedding_service import get_embeddings, record_index_backend, resolve_backend
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+KNOWLEDGE_BASE_PATH = os.getenv(
+    "KNOWLEDGE_BASE_PATH",
+    'C:\\Users\\hrite\\OneDrive\\Documents\\COEP-Inspiron-Hackathon\\backend\\sql_query_generator\\trino_data.md'
+)
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "backend/data/faiss_index")
+
 """Loading and chunking the knowledge base"""
 try:
     logger.info("Loading knowledge base...")
     #there's a byte (0x9d) sometime in txt file that can't be decoded using the default 'charmap' codec (CP1252 encoding)
-    loader = TextLoader(file_path='C:\\Users\\hrite\\OneDrive\\Documents\\COEP-Inspiron-Hackathon\\backend\\sql_query_generator\\trino_data.md', encoding='utf-8') 
+    loader = TextLoader(file_path=KNOWLEDGE_BASE_PATH, encoding='utf-8')
     knowledge = loader.load()
     logger.info(f"Loaded {len(knowledge)} documents.")
 except Exception as e:
@@ -37,8 +48,10 @@ for i, doc in enumerate(documents[:5]):
 
 """Creating vector embeddings and storing them in FAISS"""
 try:
-    logger.info("Creating embeddings...")
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    # Same backend as main.py, so index and query vectors come from the same runtime
+    backend = resolve_backend('all-MiniLM-L6-v2')
+    logger.info(f"Creating embeddings with {backend}...")
+    embeddings = get_embeddings("all-MiniLM-L6-v2")
     vector = FAISS.from_documents(documents, embeddings)
     logger.info("Embeddings created successfully.")
 except Exception as e:
@@ -48,7 +61,9 @@ except Exception as e:
 """Save the FAISS index to disk"""
 try:
     logger.info("Saving FAISS index to disk...")
-    vector.save_local("backend/data/faiss_index")
+    vector.save_local(FAISS_INDEX_PATH)
+    # main.py warns when it queries the index with vectors from a different backend
+    record_index_backend(FAISS_INDEX_PATH, 'all-MiniLM-L6-v2', backend)
     logger.info("FAISS index saved successfully.")
 except Exception as e:
     logger.error(f"Error saving FAISS index: {e}")
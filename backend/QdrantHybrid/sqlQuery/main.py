@@ -1,135 +1,187 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from langchain_community.vectorstores import FAISS
-from groq import Groq
-from langchain.retrievers.document_compressors import CohereRerank
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain_huggingface import HuggingFaceEmbeddings
 import os
 import re
+import sys
+import threading
 import time
+from datetime import datetime
 from dotenv import load_dotenv
 
+# Shared backend modules live in backend/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from context_budget import assemble_documents
+from catalog_metadata import get_catalog, schema_context_for
+from telemetry import span, instrument_app
+from llm_gateway import get_gateway
+from prompts import TRINO_SQL, TRINO_BEST_PRACTICES, REPAIR_SQL
+from sql_validator import extract_sql, validate_and_repair
+from tiered_generation import TieredSQLGenerator
+from warmup import add_warmup_endpoint
+from query_history import get_history, format_examples, add_history_endpoints
+from shared_cache import get_cache, add_cache_endpoints, CACHE_TTL_EMBEDDINGS, CACHE_TTL_RETRIEVAL, CACHE_TTL_LLM
+from embedding_service import get_embeddings, index_backend_warning, resolve_backend
+
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for cross-origin requests
+instrument_app(app, "trino_query_generator")
 
 # Get API keys
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 
-# Initialize embedding model
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+# FAISS index written by ingest.py
+FAISS_INDEX_PATH = os.getenv(
+    "FAISS_INDEX_PATH",
+    "C:\\Users\\hrite\\OneDrive\\Documents\\COEP-Inspiron-Hackathon\\backend\\QdrantHybrid\\sqlQuery\\data\\faiss_index"
+)
 
-# Initialize FAISS index
-try:
-    faiss_index = FAISS.load_local(
-        "C:\\Users\\hrite\\OneDrive\\Documents\\COEP-Inspiron-Hackathon\\backend\\QdrantHybrid\\sqlQuery\\data\\faiss_index", 
-        embeddings, 
-        allow_dangerous_deserialization=True
-    )
-    print("FAISS index successfully loaded!")
-    
-    # Set up FAISS retriever
-    retriever = faiss_index.as_retriever(
-        search_kwargs={"k": 3}  # Retrieve top 3 similar documents
-    )
-    
-    # Contextual Compression with Cohere
-    compressor = CohereRerank(cohere_api_key=COHERE_API_KEY)
-    compression_retriever = ContextualCompressionRetriever(
-        base_compressor=compressor,
-        base_retriever=retriever
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Embedding model, FAISS index and Cohere reranker, loaded on first use (or by POST /warmup)
+# so the service is ready to accept requests as soon as Flask is up
+_retrieval = None
+_retrieval_lock = threading.Lock()
+
+def get_retrieval():
+    """Load the embedding model, FAISS index and reranker once; None if the index cannot be loaded."""
+    global _retrieval
+    if _retrieval is None:
+        with _retrieval_lock:
+            if _retrieval is None:
+                with span("startup.load_retrieval"):
+                    from langchain_community.vectorstores import FAISS
+                    from langchain.retrievers.document_compressors import CohereRerank
+
+                    # ONNX runtime with micro-batching once the model is exported (see embedding_service.py)
+                    embeddings = get_embeddings(EMBEDDING_MODEL)
+                    try:
+                        faiss_index = FAISS.load_local(
+                            FAISS_INDEX_PATH,
+                            embeddings, 
+                            allow_dangerous_deserialization=True
+                        )
+                    except Exception as e:
+                        # Not cached, so a later request retries once the index exists
+                        print(f"Error loading FAISS index: {str(e)}")
+                        return None
+                    print("FAISS index successfully loaded!")
+                    embedding_backend = resolve_backend(EMBEDDING_MODEL)
+                    # int8 ONNX vectors differ slightly from PyTorch ones, so an index built by another backend ranks worse
+                    mismatch = index_backend_warning(FAISS_INDEX_PATH, EMBEDDING_MODEL, embedding_backend)
+                    if mismatch:
+                        print(f"Warning: {mismatch}")
+                    _retrieval = {
+                        "embeddings": embeddings,
+                        # Part of the embedding cache key for the same reason
+                        "embedding_backend": embedding_backend,
+                        "faiss_index": faiss_index,
+                        # Part of the retrieval cache key, so a rebuilt index is not served stale results
+                        "index_version": os.path.getmtime(FAISS_INDEX_PATH),
+                        "search_kwargs": {"k": 3},  # Retrieve top 3 similar documents
+                        "compressor": CohereRerank(cohere_api_key=COHERE_API_KEY)
+                    }
+    return _retrieval
+
+# Shared LLM gateway (pooled connections, rate limiting, retries, fallback)
+gateway = get_gateway()
+
+TRINO_MODEL = "llama-3.3-70b-versatile"
+
+# Validate generated SQL locally (parse, catalog, Trino dry run) and repair it before returning it;
+# requests can override this with "validate": true/false
+SQL_VALIDATION = os.getenv("SQL_VALIDATION", "1") == "1"
+
+# Draft SQL with the small model and escalate only failed or low-confidence drafts to TRINO_MODEL;
+# requests can override this with "tiered": true/false
+SQL_TIERED_GENERATION = os.getenv("SQL_TIERED_GENERATION", "1") == "1"
+tiered_generator = TieredSQLGenerator(gateway, escalation_model=TRINO_MODEL)
+
+# Embeddings, retrieved documents and best-practices answers, shared by the workers on the host
+cache = get_cache()
+embedding_cache = cache.namespace("embeddings", CACHE_TTL_EMBEDDINGS)
+retrieval_cache = cache.namespace("retrieval", CACHE_TTL_RETRIEVAL)
+llm_cache = cache.namespace("llm", CACHE_TTL_LLM)
+
+def embed_query(text, retrieval=None):
+    """Embedding of a query string, computed once per text across workers."""
+    retrieval = retrieval or get_retrieval()
+    if retrieval is None:
+        raise RuntimeError("Embedding model not available")
+    return embedding_cache.get_or_compute(
+        (EMBEDDING_MODEL, retrieval["embedding_backend"], text), lambda: retrieval["embeddings"].embed_query(text)
     )
-except Exception as e:
-    print(f"Error loading FAISS index: {str(e)}")
-    compression_retriever = None
-
-# Initialize Groq client
-clientg = Groq(api_key=GROQ_API_KEY)
-
-def get_trino_query_template():
-    return """
-    You are a Trino SQL expert. The queries must adhere to the semantics and syntax and should use Trino specific functions.
-    Given the following:
-    User Question: {user_query}
-    Context from Documentation: {context}
-    
-    Please provide:
-    1. A detailed Trino SQL query that addresses the user's question
-    2. An explanation of the query components
-    3. Any relevant Trino-specific optimizations or best practices
-    
-    Consider:
-    - Trino's distributed query execution
-    - Appropriate use of Trino's supported data types
-    - Partition pruning and predicate pushdown
-    - Proper join strategies
-    - Performance optimization techniques
-    
-    Format your response as:
-    QUERY:
-    <the SQL query>
-    
-    EXPLANATION:
-    <detailed explanation>
-    
-    OPTIMIZATIONS:
-    <list of Trino-specific optimizations>
-    """
-
-def generate_trino_query(user_query, context):
-    """Generate a Trino-specific SQL query based on user input and context."""
-    chat_completion = clientg.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a Trino SQL expert specializing in distributed query optimization."
-            },
-            {
-                "role": "user",
-                "content": get_trino_query_template().format(
-                    user_query=user_query,
-                    context=context
-                )
-            }
-        ],
-        model="llama-3.3-70b-versatile",
+
+def embed_question(text):
+    """Question embedding for the query history, from the same model as retrieval."""
+    return embed_query(text)
+
+# Past queries; the generator reuses successful ones as few-shot examples
+history = get_history(embed=embed_question)
+
+def retrieve_documents(user_query, retrieval, query_vector=None):
+    """FAISS similarity search followed by Cohere reranking, one span per stage."""
+    def search_and_rerank():
+        vector = query_vector
+        if vector is None:
+            with span("retrieval.embedding"):
+                vector = embed_query(user_query, retrieval)
+        with span("retrieval.vector_search") as search_span:
+            docs = retrieval["faiss_index"].similarity_search_by_vector(vector, **retrieval["search_kwargs"])
+            search_span.set_attribute("documents", len(docs))
+        with span("retrieval.rerank") as rerank_span:
+            docs = list(retrieval["compressor"].compress_documents(docs, user_query))
+            rerank_span.set_attribute("documents", len(docs))
+        return docs
+
+    key = (retrieval["index_version"], retrieval["search_kwargs"], user_query)
+    return retrieval_cache.get_or_compute(key, search_and_rerank)
+
+def generate_trino_query(user_query, context, schema=None, examples="None"):
+    """Generate a Trino-specific SQL query based on user input, live schema, context and past examples."""
+    if schema is None:
+        with span("catalog.schema_context"):
+            schema = schema_context_for(user_query)
+    result = gateway.chat(
+        stage="llm.generate_trino_query",
+        messages=TRINO_SQL.messages(schema=schema, context=context, examples=examples, question=user_query),
+        model=TRINO_MODEL,
         max_tokens=2000,
         temperature=0.3  # Lower temperature for more focused SQL generation
     )
     
-    return chat_completion.choices[0].message.content
+    return result.content
 
 def get_trino_best_practices(user_query):
-    """Get Trino-specific best practices based on the query."""
-    chat_completion = clientg.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a Trino expert focusing on query optimization and best practices. Only give valid suggestsions not too much not to less, a perfect balance with suggestion only if needed at all. "
-            },
-            {
-                "role": "user",
-                "content": f"""
-                Based on this query: '{user_query}', provide Trino-specific best practices considering:
-                - Connector optimization
-                - Query optimization
-                - Resource management
-                - Performance tuning
-                - Data distribution
-                Only include Trino-specific recommendations.
-                """
-            }
-        ],
-        model="llama-3.3-70b-versatile",
-        temperature=0.4
-    )
-    
-    return clean_text(chat_completion.choices[0].message.content)
+    """Get Trino-specific best practices based on the query, reused for repeated questions."""
+    def ask():
+        result = gateway.chat(
+            stage="llm.best_practices",
+            messages=TRINO_BEST_PRACTICES.messages(question=user_query),
+            model=TRINO_MODEL,
+            temperature=0.4
+        )
+        return clean_text(result.content)
+
+    return llm_cache.get_or_compute((TRINO_MODEL, TRINO_BEST_PRACTICES.prefix_hash, user_query), ask)
+
+def repair_trino_query(user_query, schema):
+    """Repair callback for validate_and_repair: sends the validation errors back to the LLM."""
+    def repair(sql, errors):
+        result = gateway.chat(
+            stage="llm.repair_sql",
+            messages=REPAIR_SQL.messages(
+                schema=schema, question=user_query, sql=sql, errors="\n".join(f"- {error}" for error in errors)
+            ),
+            model=TRINO_MODEL,
+            max_tokens=1000,
+            temperature=0.0
+        )
+        return result.content
+    return repair
 
 def clean_text(text):
     """Clean and format text response."""
@@ -137,9 +189,10 @@ def clean_text(text):
     text = re.sub(r'\s+', ' ', text).strip()  # Normalize spaces
     return text
 
-def process_query(user_query):
+def process_query(user_query, validate=SQL_VALIDATION, tiered=SQL_TIERED_GENERATION):
     """Process the user query and return relevant Trino information."""
-    if compression_retriever is None:
+    retrieval = get_retrieval()
+    if retrieval is None:
         return {
             "error": "FAISS retriever not available. Check server logs for details."
         }
@@ -147,17 +200,59 @@ def process_query(user_query):
     # Get Trino best practices
     trino_practices = get_trino_best_practices(user_query)
     
+    # One question embedding serves both document retrieval and the history lookup
+    with span("retrieval.embedding"):
+        query_vector = embed_query(user_query, retrieval)
+
     # Retrieve relevant documentation using FAISS + Cohere reranking
-    retrieved_docs = compression_retriever.get_relevant_documents(user_query)
-    doc_context = "\n\n".join(doc.page_content for doc in retrieved_docs)
+    retrieved_docs = retrieve_documents(user_query, retrieval, query_vector)
+    with span("context_assembly"):
+        doc_context = assemble_documents(retrieved_docs)
+
+    # Past successful questions like this one, with their SQL, as few-shot examples
+    with span("history.examples") as examples_span:
+        past = history.examples(user_query, embedding=query_vector) if history is not None else []
+        examples_span.set_attribute("examples", len(past))
+    examples = format_examples(past)
     
     # Generate Trino query
-    trino_query = generate_trino_query(user_query, doc_context)
+    started = time.perf_counter()
+    with span("catalog.schema_context"):
+        schema = schema_context_for(user_query)
+    validation = None
+    generation = None
+    if tiered:
+        # Validation decides whether the draft is served, so it always runs in this mode
+        served = tiered_generator.generate(user_query, schema, doc_context, examples)
+        trino_query, validation, generation = served.response, served.validation, served.to_dict()
+    else:
+        trino_query = generate_trino_query(user_query, doc_context, schema, examples)
+        # Check the query locally and let the LLM fix what fails, instead of failing at execution
+        if validate:
+            checked = validate_and_repair(trino_query, repair_trino_query(user_query, schema))
+            trino_query = checked.response
+            validation = checked.to_dict()
+
+    history_id = None
+    if history is not None:
+        # Validated SQL counts as successful until an execution outcome says otherwise
+        history_id = history.record(
+            extract_sql(trino_query),
+            question=user_query,
+            engine="trino",
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            success=validation["valid"] if validation else None,
+            embedding=query_vector
+        )
     
     return {
         "best_practices": trino_practices,
         "documentation_context": doc_context,
-        "generated_query": trino_query
+        "generated_query": trino_query,
+        "validation": validation,
+        "generation": generation,
+        "examples": [example["id"] for example in past],
+        "history_id": history_id
     }
 
 @app.route('/api/trino/query', methods=['POST'])
@@ -167,6 +262,8 @@ def generate_trino_query_endpoint():
         # Get JSON input
         data = request.get_json()
         user_query = data.get("user_query", "")
+        validate = bool(data.get("validate", SQL_VALIDATION))
+        tiered = bool(data.get("tiered", SQL_TIERED_GENERATION))
 
         if not user_query:
             return jsonify({
@@ -176,7 +273,9 @@ def generate_trino_query_endpoint():
             }), 400
 
         # Process the Trino query
-        results = process_query(user_query)
+        started = time.perf_counter()
+        results = process_query(user_query, validate, tiered)
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
         
         # Check for errors
         if "error" in results:
@@ -190,11 +289,16 @@ def generate_trino_query_endpoint():
             "status": "success",
             "data": {
                 "best_practices": results["best_practices"],
-                "generated_query": results["generated_query"]
+                "generated_query": results["generated_query"],
+                "validation": results["validation"],
+                "generation": results["generation"],
+                "examples": results["examples"],
+                "history_id": results["history_id"]
             },
             "timestamp": time.time(),
             "user": "hriteshMaikap",
-            "query_time": "2025-03-29 14:39:49"
+            "query_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "latency_ms": latency_ms
         })
 
     except Exception as e:
@@ -214,6 +318,15 @@ def health_check():
         "version": "1.0.0"
     })
 
+@app.route('/api/trino/generation/stats', methods=['GET'])
+def generation_stats():
+    """Escalation rate and per-tier latency/cost of tiered SQL generation since start-up."""
+    return jsonify({
+        "status": "success",
+        "data": tiered_generator.stats(),
+        "timestamp": time.time()
+    })
+
 @app.route('/api/trino/examples', methods=['GET'])
 def get_examples():
     """Endpoint to get example Trino queries."""
@@ -247,7 +360,8 @@ def get_context_only():
                 "timestamp": time.time()
             }), 400
 
-        if compression_retriever is None:
+        retrieval = get_retrieval()
+        if retrieval is None:
             return jsonify({
                 "status": "error",
                 "message": "FAISS retriever not available. Check server logs for details.",
@@ -255,7 +369,7 @@ def get_context_only():
             }), 500
             
         # Retrieve relevant documentation using FAISS + Cohere reranking
-        retrieved_docs = compression_retriever.get_relevant_documents(user_query)
+        retrieved_docs = retrieve_documents(user_query, retrieval)
         docs = [{"content": doc.page_content, "metadata": doc.metadata} for doc in retrieved_docs]
         
         return jsonify({
@@ -274,6 +388,21 @@ def get_context_only():
             "timestamp": time.time()
         }), 500
 
+def _warm_retrieval():
+    if get_retrieval() is None:
+        raise RuntimeError("FAISS retriever not available")
+    # First encode initializes the model's kernels
+    get_retrieval()["embeddings"].embed_query("warm up")
+
+if history is not None:
+    add_history_endpoints(app, history)
+add_cache_endpoints(app, cache)
+
+add_warmup_endpoint(app, {
+    "retrieval": _warm_retrieval,
+    "catalog": lambda: get_catalog().tables()
+})
+
 # Run the Flask app
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
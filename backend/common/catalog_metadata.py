@@ -0,0 +1,314 @@
+"""Live catalog metadata for the sales database with a cached table/column index"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Where table and column definitions are read from: "mysql", "trino" or "sqlite"
+CATALOG_SOURCE = os.getenv("CATALOG_SOURCE", "mysql")
+
+# SQLite stand-in for the sales database read by the "sqlite" source (see SQL_Execution/sales_standin.py)
+SALES_DB_STANDIN = os.getenv("SALES_DB_STANDIN", "sales_standin.db")
+
+MYSQL_CONFIG = {
+    'host': os.getenv("MYSQL_HOST", "localhost"),
+    'port': int(os.getenv("MYSQL_PORT", "3306")),
+    'user': os.getenv("MYSQL_USER", "admin"),
+    'password': os.getenv("MYSQL_PASSWORD", "admin"),
+    'database': os.getenv("MYSQL_DATABASE", "sales")
+}
+
+TRINO_CONFIG = {
+    'host': os.getenv("TRINO_HOST", "localhost"),
+    'port': int(os.getenv("TRINO_PORT", "8080")),
+    'user': os.getenv("TRINO_USER", "admin"),
+    'catalog': os.getenv("TRINO_CATALOG", "mysql"),
+    'schema': os.getenv("TRINO_SCHEMA", "sales")
+}
+
+# Seconds between change checks against information_schema
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "60"))
+
+# Optional JSON snapshot so a cold process does not need the database to build its index
+CATALOG_CACHE_PATH = os.getenv("CATALOG_CACHE_PATH", "")
+
+# Tables injected into a prompt per question
+CATALOG_MAX_TABLES = int(os.getenv("CATALOG_MAX_TABLES", "4"))
+
+Columns = List[Tuple[str, str]]
+
+
+def _name_tokens(name: str) -> List[str]:
+    """Split identifiers and questions into comparable lowercase word stems."""
+    words = re.findall(r"[a-z]+|\d+", re.sub(r"([a-z])([A-Z])", r"\1 \2", name).lower())
+    return [_stem(word) for word in words]
+
+
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+class CatalogMetadata:
+    """Cached information_schema view of one schema, with a small table index.
+
+    Definitions are reloaded only when the schema signature changes; the
+    signature itself is checked at most every refresh_interval seconds.
+    """
+
+    def __init__(
+        self,
+        source: str = CATALOG_SOURCE,
+        refresh_interval: float = CATALOG_REFRESH_SECONDS,
+        cache_path: str = CATALOG_CACHE_PATH,
+        embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None,
+    ):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.cache_path = cache_path
+        self.embed_fn = embed_fn
+        self._lock = threading.Lock()
+        self._tables: Dict[str, Columns] = {}
+        self._signature: Optional[str] = None
+        self._checked_at = 0.0
+        self._index: Dict[str, Dict[str, float]] = {}
+        self._idf: Dict[str, float] = {}
+        self._vectors: Dict[str, List[float]] = {}
+        self._join_counts: Dict[str, int] = {}
+        if cache_path and os.path.exists(cache_path):
+            self._load_cache()
+
+    @property
+    def schema_name(self) -> str:
+        if self.source == "trino":
+            return f"{TRINO_CONFIG['catalog']}.{TRINO_CONFIG['schema']}"
+        return MYSQL_CONFIG['database']
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[tuple]:
+        if self.source == "trino":
+            import trino
+            conn = trino.dbapi.connect(**TRINO_CONFIG)
+        elif self.source == "sqlite":
+            import sqlite3
+            conn = sqlite3.connect(SALES_DB_STANDIN)
+        else:
+            import mysql.connector
+            conn = mysql.connector.connect(**MYSQL_CONFIG)
+        try:
+            cursor = conn.cursor()
+            if params:
+                cursor.execute(sql, params)
+            else:
+                cursor.execute(sql)
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+
+    def _read_signature(self) -> str:
+        """Cheap fingerprint of the schema shape, used to detect DDL changes."""
+        if self.source == "trino":
+            rows = self._query(
+                f"SELECT table_name, count(*) FROM {TRINO_CONFIG['catalog']}.information_schema.columns "
+                f"WHERE table_schema = '{TRINO_CONFIG['schema']}' GROUP BY table_name"
+            )
+        elif self.source == "sqlite":
+            rows = self._query("SELECT name, sql FROM sqlite_master WHERE type = 'table'")
+        else:
+            # InnoDB resets CREATE_TIME on most ALTER TABLEs, but in-place and instant
+            # ones keep it, so the column definitions are fingerprinted as well
+            rows = self._query(
+                "SELECT t.table_name, t.create_time, COUNT(c.column_name), "
+                "SUM(CRC32(CONCAT_WS(' ', c.ordinal_position, c.column_name, c.column_type, c.is_nullable))) "
+                "FROM information_schema.tables t LEFT JOIN information_schema.columns c "
+                "ON c.table_schema = t.table_schema AND c.table_name = t.table_name "
+                "WHERE t.table_schema = %s GROUP BY t.table_name, t.create_time",
+                (MYSQL_CONFIG['database'],)
+            )
+        return hashlib.sha256(repr(sorted(rows, key=lambda row: str(row[0]))).encode()).hexdigest()
+
+    def _read_tables(self) -> Dict[str, Columns]:
+        if self.source == "trino":
+            rows = self._query(
+                f"SELECT table_name, column_name, data_type FROM {TRINO_CONFIG['catalog']}.information_schema.columns "
+                f"WHERE table_schema = '{TRINO_CONFIG['schema']}' ORDER BY table_name, ordinal_position"
+            )
+        elif self.source == "sqlite":
+            rows = self._query(
+                "SELECT m.name, p.name, p.type FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+                "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' ORDER BY m.name, p.cid"
+            )
+        else:
+            rows = self._query(
+                "SELECT table_name, column_name, column_type FROM information_schema.columns "
+                "WHERE table_schema = %s ORDER BY table_name, ordinal_position",
+                (MYSQL_CONFIG['database'],)
+            )
+        tables: Dict[str, Columns] = {}
+        for table_name, column_name, data_type in rows:
+            if isinstance(data_type, bytes):
+                data_type = data_type.decode()
+            tables.setdefault(table_name, []).append((column_name, str(data_type).upper()))
+        return tables
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reload definitions if the schema changed; returns True when reloaded."""
+        now = time.time()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return False
+        with self._lock:
+            if not force and now - self._checked_at < self.refresh_interval:
+                return False
+            # Also throttles retries while the database is unreachable; cached
+            # definitions keep being served in the meantime
+            self._checked_at = now
+            signature = self._read_signature()
+            if not force and signature == self._signature:
+                return False
+            self._tables = self._read_tables()
+            self._signature = signature
+            self._build_index()
+            if self.cache_path:
+                self._save_cache()
+            return True
+
+    def tables(self) -> Dict[str, Columns]:
+        """All tables with their (column, type) definitions."""
+        self.refresh()
+        return self._tables
+
+    def _build_index(self) -> None:
+        """Keyword index over table and column names (plus vectors when embed_fn is set)."""
+        index: Dict[str, Dict[str, float]] = {}
+        for table, columns in self._tables.items():
+            weights: Dict[str, float] = {}
+            for token in _name_tokens(table):
+                weights[token] = weights.get(token, 0.0) + 2.0
+            for column, _ in columns:
+                for token in _name_tokens(column):
+                    weights[token] = weights.get(token, 0.0) + 1.0
+            index[table] = weights
+        document_frequency: Dict[str, int] = {}
+        for weights in index.values():
+            for token in weights:
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        total = max(len(index), 1)
+        self._idf = {token: math.log(1 + total / df) for token, df in document_frequency.items()}
+        self._index = index
+        self._join_counts = {table: 0 for table in self._tables}
+        for table, columns in self._tables.items():
+            for referenced in self._referenced_tables(table):
+                self._join_counts[referenced] += 1
+        self._vectors = {}
+        if self.embed_fn and self._tables:
+            names = list(self._tables)
+            vectors = self.embed_fn([self._describe(name) for name in names])
+            self._vectors = dict(zip(names, vectors))
+
+    def _referenced_tables(self, table: str) -> List[str]:
+        """Tables named by the *_id columns of a table."""
+        by_stem = {"_".join(_name_tokens(name)): name for name in self._tables}
+        referenced = []
+        for column, _ in self._tables[table]:
+            if column.lower().endswith("_id"):
+                name = by_stem.get("_".join(_name_tokens(column[:-3])))
+                if name and name != table and name not in referenced:
+                    referenced.append(name)
+        return referenced
+
+    def _describe(self, table: str) -> str:
+        columns = ", ".join(f"{column} {data_type}" for column, data_type in self._tables[table])
+        return f"{table}({columns})"
+
+    def _score(self, question: str) -> Dict[str, float]:
+        tokens = _name_tokens(question)
+        scores = {}
+        for table, weights in self._index.items():
+            score = sum(weights.get(token, 0.0) * self._idf.get(token, 0.0) for token in tokens)
+            if score:
+                scores[table] = score
+        if self._vectors:
+            query_vector = self.embed_fn([question])[0]
+            top = max(scores.values()) if scores else 1.0
+            for table, vector in self._vectors.items():
+                scores[table] = scores.get(table, 0.0) + top * _cosine(query_vector, vector)
+        return scores
+
+    def relevant_tables(self, question: str, k: int = CATALOG_MAX_TABLES) -> List[str]:
+        """Best-matching tables for a question, plus the tables their *_id columns reference.
+
+        When nothing in the question matches, the most-joined tables are used instead.
+        """
+        tables = self.tables()
+        if len(tables) <= k:
+            return list(tables)
+        scores = self._score(question)
+        if scores:
+            selected = sorted(scores, key=lambda table: scores[table], reverse=True)[:k]
+        else:
+            selected = sorted(tables, key=lambda table: (-self._join_counts.get(table, 0), -len(tables[table]), table))[:k]
+        for table in list(selected):
+            for referenced in self._referenced_tables(table):
+                if referenced not in selected:
+                    selected.append(referenced)
+        return selected
+
+    def schema_context(self, question: str, k: int = CATALOG_MAX_TABLES) -> str:
+        """Prompt-ready description of the tables relevant to a question."""
+        selected = self.relevant_tables(question, k)
+        if not selected:
+            return ""
+        lines = [f"Tables in {self.schema_name}:"]
+        lines.extend(f"- {self._describe(table)}" for table in selected)
+        return "\n".join(lines)
+
+    def _save_cache(self) -> None:
+        with open(self.cache_path, "w", encoding="utf-8") as f:
+            json.dump({"source": self.source, "signature": self._signature, "tables": self._tables}, f)
+
+    def _load_cache(self) -> None:
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("source") != self.source:
+                return
+            self._tables = {table: [tuple(column) for column in columns] for table, columns in cached["tables"].items()}
+            self._signature = cached["signature"]
+            self._build_index()
+        except Exception as e:
+            print(f"Ignoring unreadable catalog cache {self.cache_path}: {str(e)}")
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+_catalog: Optional[CatalogMetadata] = None
+
+
+def get_catalog() -> CatalogMetadata:
+    """Return the process-wide catalog metadata instance."""
+    global _catalog
+    if _catalog is None:
+        _catalog = CatalogMetadata()
+    return _catalog
+
+
+def schema_context_for(question: str, k: int = CATALOG_MAX_TABLES) -> str:
+    """Schema context for a prompt, or "" when the catalog cannot be reached."""
+    try:
+        return get_catalog().schema_context(question, k)
+    except Exception as e:
+        print(f"Catalog metadata unavailable: {str(e)}")
+        return ""
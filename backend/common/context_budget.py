@@ -0,0 +1,146 @@
+"""Token-budgeted context assembly for retrieved documentation chunks"""
+
+import os
+import re
+from typing import List, Optional
+
+# Default budget for the documentation context pasted into a prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Shortest suffix/prefix overlap treated as splitter overlap rather than coincidence
+MIN_OVERLAP_CHARS = int(os.getenv("CONTEXT_MIN_OVERLAP_CHARS", "40"))
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once; None if it is not available offline."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(os.getenv("CONTEXT_TOKENIZER", "cl100k_base"))
+        except Exception as e:
+            print(f"tiktoken unavailable, using approximate token counts: {str(e)}")
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with a fast local BPE tokenizer (approximate if unavailable)."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Roughly one token per word piece / punctuation mark
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+    pieces = list(re.finditer(r"\w+|[^\w\s]", text))
+    if len(pieces) <= max_tokens:
+        return text
+    return text[:pieces[max_tokens - 1].end()]
+
+
+def _overlap_length(left: str, right: str, min_overlap: int) -> int:
+    """Length of the longest suffix of left that is also a prefix of right."""
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    anchor = right[:min_overlap]
+    best = 0
+    start = max(0, len(left) - len(right))
+    pos = left.find(anchor, start)
+    while pos != -1:
+        length = len(left) - pos
+        if right.startswith(left[pos:]):
+            best = length
+            break  # earliest match is the longest overlap
+        pos = left.find(anchor, pos + 1)
+    return best
+
+
+def _combine(first: str, second: str, min_overlap: int) -> Optional[str]:
+    """One chunk covering both when one contains or overlaps the other, else None."""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    overlap = _overlap_length(first, second, min_overlap)
+    if overlap:
+        return first + second[overlap:]
+    overlap = _overlap_length(second, first, min_overlap)
+    if overlap:
+        return second + first[overlap:]
+    return None
+
+
+def _merge_chunks(chunks: List[str], min_overlap: int) -> List[str]:
+    """Drop duplicate/contained chunks and stitch chunks that share splitter overlap.
+
+    Chunks are given in relevance order; a merged chunk takes the rank of its
+    best-ranked member. Merging repeats until no pair combines, since stitching
+    two chunks can create an overlap with a third that neither had alone.
+    """
+    merged = [chunk.strip() for chunk in chunks if chunk.strip()]
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                combined = _combine(merged[i], merged[j], min_overlap)
+                if combined is not None:
+                    merged[i] = combined
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return merged
+
+
+def assemble_context(
+    chunks: List[str],
+    max_tokens: Optional[int] = None,
+    separator: str = "\n\n",
+    min_overlap: int = MIN_OVERLAP_CHARS,
+) -> str:
+    """Dedupe, merge and pack relevance-ordered chunks into a token budget.
+
+    Chunks are packed greedily from most to least relevant; a chunk that does
+    not fit is skipped in favour of smaller lower-ranked ones, and the top
+    chunk is truncated rather than dropped so the best evidence always survives.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if max_tokens is None else max_tokens
+    separator_tokens = count_tokens(separator)
+    packed: List[str] = []
+    used = 0
+    for chunk in _merge_chunks(chunks, min_overlap):
+        cost = count_tokens(chunk) + (separator_tokens if packed else 0)
+        if used + cost <= budget:
+            packed.append(chunk)
+            used += cost
+        elif not packed:
+            packed.append(truncate_to_tokens(chunk, budget))
+            used = budget
+        if used >= budget:
+            break
+    return separator.join(packed)
+
+
+def assemble_documents(docs, max_tokens: Optional[int] = None, separator: str = "\n\n") -> str:
+    """Assemble context from LangChain documents, ordered by rerank score when present."""
+    ranked = list(enumerate(docs))
+    if all("relevance_score" in (doc.metadata or {}) for doc in docs):
+        ranked.sort(key=lambda item: (-item[1].metadata["relevance_score"], item[0]))
+    return assemble_context([doc.page_content for _, doc in ranked], max_tokens, separator)
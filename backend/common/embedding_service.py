@@ -0,0 +1,464 @@
+"""Sentence embeddings from an ONNX export of the model, micro-batched on CPU threads
+
+HuggingFaceEmbeddings runs every embed_query call as its own PyTorch forward
+pass. Here the model is exported once to ONNX (optionally int8-quantized) and
+run with onnxruntime; concurrent requests wait in a queue for up to
+EMBEDDING_BATCH_WINDOW_MS and are encoded together in one forward pass.
+
+    python embedding_service.py export [model] [--no-quantize]   # writes EMBEDDING_MODEL_DIR/<model>/
+    python embedding_service.py serve [port]                     # POST /embed, GET /metrics, POST /warmup
+
+get_embeddings(model_name) returns the LangChain Embeddings the services use,
+chosen by EMBEDDING_BACKEND:
+    auto         onnx when an export exists for the model, otherwise huggingface
+    onnx         the exported model in this process, behind the micro-batcher
+    service      POST to a running embedding service (EMBEDDING_SERVICE_URL)
+    huggingface  the original sentence-transformers path
+Vectors are mean-pooled and L2-normalized, like all-MiniLM-L6-v2 under
+sentence-transformers, so FAISS indexes built by either path stay usable
+(int8 vectors differ slightly; see benchmarks/embedding_throughput.py).
+"""
+
+import functools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+from telemetry import Counter, Histogram, register, span
+
+# auto | onnx | service | huggingface
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "auto")
+# Exported models, one directory per model
+EMBEDDING_MODEL_DIR = os.getenv(
+    "EMBEDDING_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "onnx_models")
+)
+# Use the int8 model when the export has one
+EMBEDDING_QUANTIZED = os.getenv("EMBEDDING_QUANTIZED", "1") == "1"
+# onnxruntime intra-op threads per forward pass
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", str(min(4, os.cpu_count() or 1))))
+# How long the first queued request waits for others to join its batch
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "3"))
+# Texts per forward pass; larger inputs (document ingestion) are split into batches of this size
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+# Embedding service used by EMBEDDING_BACKEND=service
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "http://localhost:5010")
+
+# Written next to a vector index by record_index_backend
+INDEX_BACKEND_FILE = "embedding_backend.json"
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+embedding_batch_size = register(Histogram(
+    "embedding_batch_size", "Texts encoded per forward pass.", ("source",), buckets=BATCH_SIZE_BUCKETS
+))
+embedding_queue_wait = register(Histogram(
+    "embedding_queue_wait_seconds", "Time requests spend waiting for their batch to start.", ("source",)
+))
+embedding_texts = register(Counter("embedding_texts_total", "Texts embedded, by backend.", ("backend",)))
+
+
+def model_path(model_name, directory=EMBEDDING_MODEL_DIR):
+    """Directory of a model's ONNX export."""
+    return os.path.join(directory, model_name.replace("/", "__"))
+
+
+def hub_name(model_name):
+    # sentence-transformers resolves bare names like all-MiniLM-L6-v2 to its own organisation
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def export_model(model_name, output_dir=None, quantize=True, max_length=256, opset=14):
+    """Export a sentence-transformers model to ONNX (plus an int8 copy) with its tokenizer and a manifest."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    output_dir = output_dir or model_path(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(hub_name(model_name))
+    model = AutoModel.from_pretrained(hub_name(model_name)).eval()
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["an example sentence", "another"], padding=True, return_tensors="pt")
+    inputs = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in inputs}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in inputs),
+            os.path.join(output_dir, "model.onnx"),
+            input_names=inputs,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    files = {'fp32': "model.onnx"}
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        # Weights to int8, activations quantized on the fly: about 4x smaller and faster matmuls on CPU
+        quantize_dynamic(
+            os.path.join(output_dir, "model.onnx"), os.path.join(output_dir, "model_int8.onnx"), weight_type=QuantType.QInt8
+        )
+        files['int8'] = "model_int8.onnx"
+
+    manifest = {
+        'model_name': model_name,
+        'dimension': model.config.hidden_size,
+        'max_length': min(max_length, tokenizer.model_max_length),
+        'inputs': inputs,
+        'pooling': "mean",
+        'normalize': True,
+        'files': files,
+        'exported_at': time.time(),
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class ONNXEmbedder:
+    """An exported model in an onnxruntime session; encode() embeds one batch of texts."""
+
+    def __init__(self, path, quantized=EMBEDDING_QUANTIZED, threads=EMBEDDING_THREADS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.quantized = quantized and 'int8' in self.manifest['files']
+        self.backend = "onnx-int8" if self.quantized else "onnx"
+        self.dimension = self.manifest['dimension']
+        self.inputs = self.manifest['inputs']
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.manifest['max_length'])
+        # Pads to the longest text of each batch
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_file = self.manifest['files']['int8' if self.quantized else 'fp32']
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(path, model_file), options, providers=["CPUExecutionProvider"]
+        )
+
+    def encode(self, texts):
+        """Mean-pooled, L2-normalized embeddings of texts as a float32 array."""
+        import numpy as np
+
+        encodings = self.tokenizer.encode_batch(list(texts))
+        feeds = {
+            'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: feeds[name] for name in self.inputs})[0]
+        mask = feeds['attention_mask'][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.manifest.get('normalize', True):
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        embedding_texts.inc(len(texts), backend=self.backend)
+        return pooled.astype(np.float32)
+
+    def encode_many(self, texts, batch_size=EMBEDDING_MAX_BATCH):
+        """Embeddings of any number of texts, in batches of similar length to keep padding low."""
+        import numpy as np
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        result = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            embedding_batch_size.observe(len(rows), source="documents")
+            result[rows] = self.encode([texts[i] for i in rows])
+        return result
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Merges concurrent embed() calls into one forward pass.
+
+    The first request of a batch waits at most window_ms for others to join,
+    and a batch closes early once it holds max_batch texts. One worker thread
+    runs the forward passes; onnxruntime parallelizes each one over its own
+    threads.
+    """
+
+    def __init__(self, encode, window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch=EMBEDDING_MAX_BATCH):
+        self.encode = encode
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, texts):
+        """Future for the embeddings (one row per text) of texts."""
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+        request = _Request(list(texts))
+        self._queue.put(request)
+        return request.future
+
+    def embed(self, texts):
+        return self.submit(texts).result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].texts)
+            deadline = time.perf_counter() + self.window
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+
+            started = time.perf_counter()
+            for request in batch:
+                embedding_queue_wait.observe(started - request.queued_at, source="queries")
+            embedding_batch_size.observe(size, source="queries")
+            texts = [text for request in batch for text in request.texts]
+            try:
+                with span("embedding.batch", texts=len(texts), requests=len(batch)):
+                    vectors = self.encode(texts)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            offset = 0
+            for request in batch:
+                request.future.set_result(vectors[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+
+class EmbeddingService:
+    """Library form of the service: an ONNX model behind a micro-batcher."""
+
+    def __init__(self, model_name, path=None, quantized=EMBEDDING_QUANTIZED, threads=EMBEDDING_THREADS,
+                 window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch=EMBEDDING_MAX_BATCH):
+        self.model_name = model_name
+        self.path = path or model_path(model_name)
+        self.quantized = quantized
+        self.threads = threads
+        self.max_batch = max_batch
+        self._embedder = None
+        self._lock = threading.Lock()
+        self.batcher = MicroBatcher(lambda texts: self.embedder.encode(texts), window_ms, max_batch)
+
+    @property
+    def embedder(self):
+        # The session is created on first use (or by POST /warmup)
+        if self._embedder is None:
+            with self._lock:
+                if self._embedder is None:
+                    with span("startup.load_embedding_model", model=self.model_name):
+                        self._embedder = ONNXEmbedder(self.path, self.quantized, self.threads)
+        return self._embedder
+
+    @property
+    def backend(self):
+        if self._embedder is not None:
+            return self._embedder.backend
+        manifest_path = os.path.join(self.path, "manifest.json")
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(
+                f"No ONNX export of {self.model_name} in {self.path}; "
+                f"run: python backend/common/embedding_service.py export {self.model_name}"
+            )
+        with open(manifest_path) as f:
+            return "onnx-int8" if self.quantized and 'int8' in json.load(f)['files'] else "onnx"
+
+    def embed_queries(self, texts):
+        """Embeddings of a few texts, batched with concurrent callers."""
+        return self.batcher.embed(texts)
+
+    def embed_documents(self, texts):
+        """Embeddings of many texts, encoded directly in length-sorted batches."""
+        return self.embedder.encode_many(texts, self.max_batch)
+
+
+class ServiceEmbeddings:
+    """LangChain Embeddings over an in-process EmbeddingService or a remote one (url)."""
+
+    def __init__(self, service=None, url=None, timeout=30):
+        self.service = service
+        self.url = url.rstrip("/") if url else None
+        self.timeout = timeout
+        self._session = None
+
+    def _post(self, texts):
+        if self._session is None:
+            import requests
+            # Pooled keep-alive connections to the embedding service
+            self._session = requests.Session()
+        response = self._session.post(f"{self.url}/embed", json={'texts': texts}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['embeddings']
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        if self.service is None:
+            return self._post(texts)
+        return self.service.embed_documents(texts).tolist()
+
+    def embed_query(self, text):
+        if self.service is None:
+            return self._post([text])[0]
+        return self.service.embed_queries([text])[0].tolist()
+
+    async def aembed_documents(self, texts):
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_documents, texts)
+
+    async def aembed_query(self, text):
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_query, text)
+
+
+@functools.lru_cache(maxsize=None)
+def _langchain_embeddings_class():
+    from langchain_core.embeddings import Embeddings
+
+    class LangChainServiceEmbeddings(ServiceEmbeddings, Embeddings):
+        pass
+
+    return LangChainServiceEmbeddings
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name):
+    """Process-wide EmbeddingService for an exported model."""
+    if model_name not in _services:
+        with _services_lock:
+            if model_name not in _services:
+                _services[model_name] = EmbeddingService(model_name)
+    return _services[model_name]
+
+
+def resolve_backend(model_name, backend=EMBEDDING_BACKEND):
+    """onnx-int8, onnx, service or huggingface: what get_embeddings will use for the model."""
+    if backend == "auto":
+        backend = "onnx" if os.path.exists(os.path.join(model_path(model_name), "manifest.json")) else "huggingface"
+    if backend == "onnx":
+        return get_embedding_service(model_name).backend
+    if backend not in ("service", "huggingface"):
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+    return backend
+
+
+def record_index_backend(index_path, model_name, backend):
+    """Note next to a vector index which model and backend produced its vectors."""
+    with open(os.path.join(index_path, INDEX_BACKEND_FILE), "w") as f:
+        json.dump({'model': model_name, 'backend': backend}, f)
+
+
+def index_backend_warning(index_path, model_name, backend):
+    """Why query vectors from backend may not match the index's vectors, or None when they do."""
+    try:
+        with open(os.path.join(index_path, INDEX_BACKEND_FILE)) as f:
+            built = json.load(f)
+    except FileNotFoundError:
+        # Indexes from before the note was written came from sentence-transformers
+        built = {'model': model_name, 'backend': 'huggingface'}
+    if built.get('model') == model_name and built.get('backend') == backend:
+        return None
+    return (f"Vector index {index_path} was built with {built.get('model')} on {built.get('backend')}, "
+            f"but queries use {model_name} on {backend}; re-run the ingest to rebuild it")
+
+
+def get_embeddings(model_name, backend=EMBEDDING_BACKEND):
+    """LangChain Embeddings for model_name on the configured backend."""
+    backend = resolve_backend(model_name, backend)
+    if backend == "huggingface":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name)
+    embeddings_class = _langchain_embeddings_class()
+    if backend == "service":
+        return embeddings_class(url=EMBEDDING_SERVICE_URL)
+    return embeddings_class(service=get_embedding_service(model_name))
+
+
+def add_embedding_endpoints(app, service):
+    """Register POST /embed ({"texts": [...]} or {"text": ...})."""
+    from flask import jsonify, request
+
+    @app.route('/embed', methods=['POST'])
+    def embed():
+        data = request.get_json(silent=True) or {}
+        texts = data.get('texts')
+        if texts is None and data.get('text') is not None:
+            texts = [data['text']]
+        if not texts or not all(isinstance(text, str) for text in texts):
+            return jsonify({'error': 'Provide "texts" (a list of strings) or "text"'}), 400
+        try:
+            # Single requests join the micro-batch; bulk requests are already a batch
+            if len(texts) >= service.max_batch:
+                vectors = service.embed_documents(texts)
+            else:
+                vectors = service.embed_queries(texts)
+            return jsonify({
+                'model': service.model_name,
+                'backend': service.backend,
+                'dimension': int(vectors.shape[1]),
+                'embeddings': vectors.tolist(),
+            })
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+
+def create_app(model_name):
+    from flask import Flask
+    from telemetry import instrument_app
+    from warmup import add_warmup_endpoint
+
+    app = Flask(__name__)
+    instrument_app(app, "embedding_service")
+    service = get_embedding_service(model_name)
+    add_embedding_endpoints(app, service)
+    add_warmup_endpoint(app, {'model': lambda: service.embed_queries(["warm up"])})
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Export a model to ONNX")
+    export_parser.add_argument("model", nargs="?", default="all-MiniLM-L6-v2")
+    export_parser.add_argument("--output", help="Export directory (default: EMBEDDING_MODEL_DIR/<model>)")
+    export_parser.add_argument("--no-quantize", action="store_true")
+    serve_parser = commands.add_parser("serve", help="Run the HTTP embedding service")
+    serve_parser.add_argument("port", nargs="?", type=int, default=5010)
+    serve_parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(json.dumps(export_model(args.model, args.output, quantize=not args.no_quantize), indent=2))
+        sys.exit(0)
+    create_app(args.model).run(host='0.0.0.0', port=args.port, threaded=True)
@@ -0,0 +1,60 @@
+"""LangChain chat model backed by the shared LLM gateway"""
+
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from llm_gateway import DEFAULT_MODEL, get_gateway
+
+ROLES = {'system': 'system', 'human': 'user', 'ai': 'assistant', 'tool': 'tool'}
+
+
+class GatewayChatModel(BaseChatModel):
+    """Drop-in replacement for ChatGroq in `prompt | llm` chains."""
+
+    model_name: str = DEFAULT_MODEL
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    stage: str = "llm.chat"
+    fallback: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        params = dict(kwargs)
+        if stop:
+            params['stop'] = stop
+        result = get_gateway().chat(
+            [{'role': ROLES.get(message.type, 'user'), 'content': message.content} for message in messages],
+            model=self.model_name,
+            stage=self.stage,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            fallback=self.fallback,
+            **params,
+        )
+        message = AIMessage(
+            content=result.content,
+            response_metadata={'model_name': result.model, 'fallback_used': result.fallback_used},
+            usage_metadata={
+                'input_tokens': result.usage.get('prompt_tokens') or 0,
+                'output_tokens': result.usage.get('completion_tokens') or 0,
+                'total_tokens': (result.usage.get('prompt_tokens') or 0) + (result.usage.get('completion_tokens') or 0),
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={'model_name': result.model})
+
+    def with_stage(self, stage: str) -> "GatewayChatModel":
+        """Copy of this model whose calls are traced under a different stage name."""
+        return self.model_copy(update={'stage': stage})
@@ -0,0 +1,400 @@
+"""Shared LLM client: pooled HTTP/2 connections, rate-limit scheduling, retries, fallback and usage accounting"""
+
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+
+from context_budget import count_tokens
+from telemetry import Counter, Histogram, register, span, record_tokens, record_llm_call
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "llama-3.3-70b-versatile")
+# Cheaper model used when the requested one is rate limited or overloaded
+FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "llama-3.1-8b-instant")
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Longest a call waits for rate-limit capacity before failing
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+# Wait on the primary model after which the fallback model is used instead
+LLM_FALLBACK_WAIT = float(os.getenv("LLM_FALLBACK_WAIT", "5"))
+
+# Requests and tokens per minute per model, e.g. '{"llama-3.3-70b-versatile": {"rpm": 30, "tpm": 6000}}'
+DEFAULT_RPM = float(os.getenv("LLM_DEFAULT_RPM", "30"))
+DEFAULT_TPM = float(os.getenv("LLM_DEFAULT_TPM", "6000"))
+RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+
+# Statuses worth retrying; 498 is Groq's "flex tier capacity exceeded"
+RETRYABLE_STATUSES = {408, 409, 429, 498, 500, 502, 503, 504}
+OVERLOAD_STATUSES = {429, 498, 503}
+
+llm_retries = register(Counter("llm_retries_total", "LLM request retries.", ("model", "reason")))
+llm_fallbacks = register(Counter("llm_fallbacks_total", "Calls served by the fallback model.", ("model", "fallback")))
+llm_prompt_tokens = register(Histogram(
+    "llm_prompt_tokens", "Input tokens per LLM call as reported by the provider.", ("stage", "model"),
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+))
+
+
+class LLMError(Exception):
+    """Raised when a call fails after retries (and fallback, when allowed)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class LLMRateLimitError(LLMError):
+    """Raised when rate-limit capacity does not free up within the queue timeout."""
+
+
+class TokenBucket:
+    """Continuously refilling budget of capacity units per minute (not thread-safe by itself)."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta):
+        # Correct an estimate once the real usage is known; debt is bounded to one window
+        self.tokens = max(-self.capacity, min(self.capacity, self.tokens - delta))
+
+
+class ModelLimiter:
+    """Request and token buckets for one model, acquired together."""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_time(self, tokens, now):
+        return max(
+            self.blocked_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(tokens, now),
+        )
+
+    def estimated_wait(self, tokens):
+        with self._lock:
+            return max(0.0, self._wait_time(tokens, time.monotonic()))
+
+    def acquire(self, tokens, timeout):
+        """Block until one request and tokens fit; False when that takes longer than timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._wait_time(tokens, now)
+                if wait <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    return True
+            if now + wait > deadline:
+                return False
+            time.sleep(min(wait, 1.0))
+
+    def settle(self, estimated, actual):
+        with self._lock:
+            self.tokens.adjust(actual - estimated)
+
+    def pause(self, seconds):
+        """Stop issuing requests for a while (provider sent Retry-After)."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class ChatResult:
+    """Outcome of a chat call."""
+
+    def __init__(self, content, model, usage, latency_ms, attempts, fallback_used, raw):
+        self.content = content
+        self.model = model
+        self.usage = usage
+        self.latency_ms = latency_ms
+        self.attempts = attempts
+        self.fallback_used = fallback_used
+        self.raw = raw
+
+
+class UsageLedger:
+    """Per-model totals of calls, tokens, latency, retries and failures."""
+
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, usage=None, latency_ms=0.0, retries=0, error=False, fallback=False):
+        usage = usage or {}
+        with self._lock:
+            totals = self._totals.setdefault(model, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'fallbacks': 0,
+                'prompt_tokens': 0, 'completion_tokens': 0, 'latency_ms': 0.0,
+            })
+            totals['calls'] += 1
+            totals['errors'] += int(error)
+            totals['retries'] += retries
+            totals['fallbacks'] += int(fallback)
+            totals['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            totals['completion_tokens'] += usage.get('completion_tokens') or 0
+            totals['latency_ms'] += latency_ms
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for model, totals in self._totals.items():
+                successes = totals['calls'] - totals['errors']
+                snapshot[model] = dict(
+                    totals,
+                    latency_ms=round(totals['latency_ms'], 1),
+                    mean_latency_ms=round(totals['latency_ms'] / successes, 1) if successes else None,
+                )
+            return snapshot
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Prompt tokens plus the completion reservation, for rate-limit scheduling."""
+    prompt = sum(count_tokens(message.get('content') or '') + 4 for message in messages)
+    return prompt + (max_tokens or 1024)
+
+
+class LLMGateway:
+    """One pooled client for every chat completion made by a service."""
+
+    def __init__(self, base_url=None, api_key=None, fallback_model=FALLBACK_MODEL):
+        # Read at construction so services that call load_dotenv() after importing still pick them up.
+        # LLM_BASE_URL is any OpenAI-compatible endpoint, e.g. mock_llm_server.py for local testing
+        base_url = base_url or os.getenv("LLM_BASE_URL", os.getenv("GROQ_BASE_URL", "https://api.groq.com") + "/openai/v1")
+        api_key = api_key or os.getenv("LLM_API_KEY", os.getenv("GROQ_API_KEY", ""))
+        self.base_url = base_url.rstrip("/")
+        self.fallback_model = fallback_model
+        self.client = httpx.Client(
+            http2=HTTP2_AVAILABLE,
+            headers={'Authorization': f"Bearer {api_key}"} if api_key else {},
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        )
+        self.ledger = UsageLedger()
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model):
+        with self._lock:
+            if model not in self._limiters:
+                limits = RATE_LIMITS.get(model, {})
+                self._limiters[model] = ModelLimiter(limits.get('rpm', DEFAULT_RPM), limits.get('tpm', DEFAULT_TPM))
+            return self._limiters[model]
+
+    def _schedule(self, model, estimated, fallback):
+        """Reserve capacity and return the model to call, falling back when the primary is saturated."""
+        if fallback and self.fallback_model and model != self.fallback_model:
+            if (self.limiter(model).estimated_wait(estimated) > LLM_FALLBACK_WAIT
+                    and self.limiter(self.fallback_model).estimated_wait(estimated) <= LLM_FALLBACK_WAIT):
+                llm_fallbacks.inc(model=model, fallback=self.fallback_model)
+                model = self.fallback_model
+        if not self.limiter(model).acquire(estimated, LLM_QUEUE_TIMEOUT):
+            raise LLMRateLimitError(f"Rate limit capacity for {model} not available within {LLM_QUEUE_TIMEOUT}s", 429)
+        return model
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, retry_after)
+        time.sleep(delay)
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get('retry-after')
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+    def _payload(self, model, messages, temperature, max_tokens, params):
+        payload = dict(params, model=model, messages=messages)
+        if temperature is not None:
+            payload['temperature'] = temperature
+        if max_tokens is not None:
+            payload['max_tokens'] = max_tokens
+        return payload
+
+    def _post(self, model, payload, estimated, stream):
+        """Send with retries; returns (response, retries). The caller closes streaming responses."""
+        limiter = self.limiter(model)
+        retries = 0
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if attempt:
+                if not limiter.acquire(estimated, LLM_QUEUE_TIMEOUT):
+                    raise LLMRateLimitError(f"Rate limit capacity for {model} not available", 429)
+            try:
+                request = self.client.build_request("POST", f"{self.base_url}/chat/completions", json=payload)
+                response = self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                limiter.settle(estimated, 0)
+                if attempt == LLM_MAX_RETRIES:
+                    raise LLMError(f"{model} request failed: {e}")
+                retries += 1
+                llm_retries.inc(model=model, reason=type(e).__name__)
+                self._backoff(attempt)
+                continue
+            if response.status_code < 400:
+                return response, retries
+            if stream:
+                response.read()
+                response.close()
+            limiter.settle(estimated, 0)
+            retry_after = self._retry_after(response)
+            if response.status_code == 429 and retry_after:
+                limiter.pause(retry_after)
+            if response.status_code not in RETRYABLE_STATUSES or attempt == LLM_MAX_RETRIES:
+                raise LLMError(f"{model} returned {response.status_code}: {response.text[:500]}", response.status_code)
+            retries += 1
+            llm_retries.inc(model=model, reason=str(response.status_code))
+            self._backoff(attempt, retry_after)
+
+    def chat(self, messages, model=DEFAULT_MODEL, stage="llm.chat", temperature=None, max_tokens=None,
+             fallback=True, **params):
+        """Blocking chat completion. Extra params (response_format, top_p, ...) are passed through."""
+        estimated = estimate_tokens(messages, max_tokens)
+        with span(stage, model=model) as call_span:
+            started = time.perf_counter()
+            target = self._schedule(model, estimated, fallback)
+            fallback_used = target != model
+            try:
+                response, retries = self._post(target, self._payload(target, messages, temperature, max_tokens, params), estimated, False)
+            except LLMError as e:
+                self.ledger.record(target, error=True)
+                record_llm_call(target, "error")
+                if not (fallback and not fallback_used and e.status in OVERLOAD_STATUSES
+                        and self.fallback_model and target != self.fallback_model):
+                    raise
+                # Primary overloaded even after retries: one attempt on the cheaper model
+                llm_fallbacks.inc(model=target, fallback=self.fallback_model)
+                target, fallback_used = self.fallback_model, True
+                if not self.limiter(target).acquire(estimated, LLM_QUEUE_TIMEOUT):
+                    raise
+                response, retries = self._post(target, self._payload(target, messages, temperature, max_tokens, params), estimated, False)
+            data = response.json()
+            usage = data.get('usage') or {}
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            self.limiter(target).settle(estimated, (usage.get('prompt_tokens') or 0) + (usage.get('completion_tokens') or 0) or estimated)
+            self.ledger.record(target, usage, latency_ms, retries, fallback=fallback_used)
+            record_llm_call(target)
+            record_tokens(target, usage)
+            llm_prompt_tokens.observe(usage.get('prompt_tokens') or 0, stage=stage, model=target)
+            call_span.set_attribute("llm.model_used", target)
+            call_span.set_attribute("llm.retries", retries)
+            call_span.set_attribute("llm.fallback", fallback_used)
+            return ChatResult(
+                data['choices'][0]['message'].get('content') or "",
+                target, usage, latency_ms, retries + 1, fallback_used, data
+            )
+
+    def chat_stream(self, messages, model=DEFAULT_MODEL, stage="llm.chat_stream", temperature=None,
+                    max_tokens=None, fallback=True, **params):
+        """Streaming chat completion yielding content deltas. Retries only apply before the first delta."""
+        estimated = estimate_tokens(messages, max_tokens)
+        with span(stage, model=model) as call_span:
+            started = time.perf_counter()
+            target = self._schedule(model, estimated, fallback)
+            fallback_used = target != model
+            payload = self._payload(target, messages, temperature, max_tokens, dict(params, stream=True))
+            try:
+                response, retries = self._post(target, payload, estimated, True)
+            except LLMError:
+                self.ledger.record(target, error=True)
+                record_llm_call(target, "error")
+                raise
+            usage = {}
+            first_delta = False
+            try:
+                for line in response.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    # Groq puts usage under x_groq on the last chunk; OpenAI-style servers use "usage"
+                    usage = (chunk.get('x_groq') or {}).get('usage') or chunk.get('usage') or usage
+                    for choice in chunk.get('choices') or []:
+                        delta = (choice.get('delta') or {}).get('content')
+                        if delta:
+                            if not first_delta:
+                                first_delta = True
+                                call_span.set_attribute("time_to_first_token_ms", call_span.elapsed_ms())
+                            yield delta
+            finally:
+                response.close()
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            self.limiter(target).settle(estimated, (usage.get('prompt_tokens') or 0) + (usage.get('completion_tokens') or 0) or estimated)
+            self.ledger.record(target, usage, latency_ms, retries, fallback=fallback_used)
+            record_llm_call(target)
+            record_tokens(target, usage)
+            llm_prompt_tokens.observe(usage.get('prompt_tokens') or 0, stage=stage, model=target)
+            call_span.set_attribute("llm.model_used", target)
+            call_span.set_attribute("llm.fallback", fallback_used)
+
+    def chat_json(self, messages, response_model, model=DEFAULT_MODEL, stage="llm.chat_json", max_validation_retries=1, **kwargs):
+        """Chat in JSON mode and validate the reply into a pydantic model.
+
+        On a validation error the model is shown the error and asked again,
+        like instructor's JSON mode.
+        """
+        schema = json.dumps(response_model.model_json_schema())
+        messages = [dict(message) for message in messages]
+        messages[0]['content'] = f"{messages[0]['content']}\n\nRespond with a JSON object matching this schema:\n{schema}"
+        for attempt in range(max_validation_retries + 1):
+            result = self.chat(messages, model=model, stage=stage, response_format={'type': 'json_object'}, **kwargs)
+            try:
+                return response_model.model_validate_json(result.content)
+            except ValueError as e:
+                if attempt == max_validation_retries:
+                    raise LLMError(f"{model} returned JSON that does not match {response_model.__name__}: {e}")
+                messages = messages + [
+                    {'role': 'assistant', 'content': result.content},
+                    {'role': 'user', 'content': f"That JSON was invalid: {e}. Reply again with only the corrected JSON."},
+                ]
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Process-wide gateway so every caller shares one connection pool and rate limiter."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
@@ -0,0 +1,90 @@
+"""Local stand-in for the Cohere rerank API, for load-testing the retrieval paths without the provider
+
+Run with: python mock_cohere_server.py [port]
+then set CO_API_URL=http://localhost:<port> (read by the cohere client behind CohereRerank)
+"""
+
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+# Base latency plus a per-document cost, roughly what rerank-english-v3.0 shows from a nearby region
+MOCK_COHERE_LATENCY_MS = float(os.getenv("MOCK_COHERE_LATENCY_MS", "120"))
+MOCK_COHERE_PER_DOC_MS = float(os.getenv("MOCK_COHERE_PER_DOC_MS", "2"))
+# Fraction of requests answered with 429
+MOCK_COHERE_RATE_LIMIT_RATE = float(os.getenv("MOCK_COHERE_RATE_LIMIT_RATE", "0"))
+
+app = Flask(__name__)
+stats = {'requests': 0, 'rate_limited': 0, 'documents': 0}
+stats_lock = threading.Lock()
+
+
+def _count(key, amount=1):
+    with stats_lock:
+        stats[key] += amount
+
+
+def _terms(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def _document_text(document):
+    if isinstance(document, dict):
+        return document.get('text') or " ".join(str(value) for value in document.values())
+    return str(document)
+
+
+def relevance(query, text):
+    """Share of query terms found in the document, so rankings are stable across runs."""
+    query_terms = _terms(query)
+    if not query_terms:
+        return 0.0
+    return round(len(query_terms & _terms(text)) / len(query_terms), 6)
+
+
+@app.route('/v1/rerank', methods=['POST'])
+@app.route('/v2/rerank', methods=['POST'])
+def rerank():
+    _count('requests')
+    if random.random() < MOCK_COHERE_RATE_LIMIT_RATE:
+        _count('rate_limited')
+        return jsonify({'message': 'You are using a Trial key, which is limited to 10 API calls / minute.'}), 429
+
+    body = request.get_json()
+    query = body.get('query', '')
+    documents = body.get('documents') or []
+    top_n = body.get('top_n') or len(documents)
+    _count('documents', len(documents))
+    time.sleep((MOCK_COHERE_LATENCY_MS + MOCK_COHERE_PER_DOC_MS * len(documents)) / 1000)
+
+    scored = sorted(
+        ((relevance(query, _document_text(document)), index) for index, document in enumerate(documents)),
+        key=lambda pair: (-pair[0], pair[1]),
+    )[:top_n]
+    results = []
+    for score, index in scored:
+        result = {'index': index, 'relevance_score': score}
+        if body.get('return_documents'):
+            result['document'] = {'text': _document_text(documents[index])}
+        results.append(result)
+    return jsonify({
+        'id': f"mock-rerank-{random.getrandbits(32):08x}",
+        'results': results,
+        'meta': {'api_version': {'version': '1'}, 'billed_units': {'search_units': 1}},
+    })
+
+
+@app.route('/mock/stats', methods=['GET'])
+def mock_stats():
+    with stats_lock:
+        return jsonify(stats)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8002
+    app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,137 @@
+"""Local stand-in for the Groq chat completions API, for exercising llm_gateway without the provider
+
+Run with: python mock_llm_server.py [port]
+then set LLM_BASE_URL=http://localhost:<port>/openai/v1
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+
+# Base response latency and streaming speed
+MOCK_LLM_LATENCY_MS = float(os.getenv("MOCK_LLM_LATENCY_MS", "200"))
+MOCK_LLM_TOKENS_PER_SEC = float(os.getenv("MOCK_LLM_TOKENS_PER_SEC", "250"))
+# Fraction of requests answered with 429 + Retry-After
+MOCK_LLM_RATE_LIMIT_RATE = float(os.getenv("MOCK_LLM_RATE_LIMIT_RATE", "0"))
+# Models that always answer 503 (to exercise fallback), comma separated
+MOCK_LLM_OVERLOADED_MODELS = {m for m in os.getenv("MOCK_LLM_OVERLOADED_MODELS", "").split(",") if m}
+
+CANNED_REPLY = """QUERY:
+SELECT c.customer_id, SUM(o.total_amount) AS total_spent
+FROM orders o
+JOIN customers c ON o.customer_id = c.customer_id
+GROUP BY c.customer_id
+ORDER BY total_spent DESC
+LIMIT 10
+
+EXPLANATION:
+Aggregates order totals per customer and returns the top spenders.
+
+OPTIMIZATIONS:
+- Filter early so predicates are pushed down to the connector."""
+
+app = Flask(__name__)
+stats = {'requests': 0, 'rate_limited': 0, 'overloaded': 0, 'streams': 0}
+stats_lock = threading.Lock()
+
+
+def _count(key):
+    with stats_lock:
+        stats[key] += 1
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _json_reply(messages):
+    """An object with a placeholder for every string property of the schema in the prompt."""
+    prompt = "\n".join(message.get('content') or '' for message in messages)
+    match = re.search(r"matching this schema:\n(\{.*\})", prompt, re.DOTALL)
+    properties = {}
+    if match:
+        try:
+            properties = json.loads(match.group(1)).get('properties', {})
+        except json.JSONDecodeError:
+            pass
+    return json.dumps({name: CANNED_REPLY if 'sql' in name else f"mock {name}" for name in properties})
+
+
+@app.route('/openai/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    _count('requests')
+    body = request.get_json()
+    model = body.get('model', '')
+    if model in MOCK_LLM_OVERLOADED_MODELS:
+        _count('overloaded')
+        return jsonify({'error': {'message': f"{model} is over capacity", 'type': 'overloaded'}}), 503
+    if random.random() < MOCK_LLM_RATE_LIMIT_RATE:
+        _count('rate_limited')
+        response = jsonify({'error': {'message': 'Rate limit reached', 'type': 'rate_limit_exceeded'}})
+        response.status_code = 429
+        response.headers['retry-after'] = '1'
+        return response
+
+    messages = body.get('messages', [])
+    json_mode = (body.get('response_format') or {}).get('type') == 'json_object'
+    content = _json_reply(messages) if json_mode else CANNED_REPLY
+    max_tokens = body.get('max_tokens')
+    if max_tokens:
+        content = content[:max_tokens * 4]
+    usage = {
+        'prompt_tokens': sum(_tokens(message.get('content') or '') for message in messages),
+        'completion_tokens': _tokens(content),
+    }
+    usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+    created = int(time.time())
+    completion_id = f"chatcmpl-mock-{random.getrandbits(32):08x}"
+    time.sleep(MOCK_LLM_LATENCY_MS / 1000)
+
+    if body.get('stream'):
+        _count('streams')
+
+        def generate():
+            pieces = re.findall(r"\S+\s*", content)
+            for piece in pieces:
+                time.sleep(1 / MOCK_LLM_TOKENS_PER_SEC)
+                chunk = {
+                    'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                'x_groq': {'id': completion_id, 'usage': usage},
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return Response(generate(), mimetype='text/event-stream')
+
+    time.sleep(usage['completion_tokens'] / MOCK_LLM_TOKENS_PER_SEC)
+    return jsonify({
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': created,
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': usage,
+    })
+
+
+@app.route('/mock/stats', methods=['GET'])
+def mock_stats():
+    with stats_lock:
+        return jsonify(stats)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    app.run(host='0.0.0.0', port=port, threaded=True)
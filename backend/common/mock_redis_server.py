@@ -0,0 +1,243 @@
+"""Local stand-in for a Redis server, for running the shared cache tier without one
+
+Speaks enough of the Redis protocol (RESP) for shared_cache.py: PING, AUTH,
+SELECT, GET, SET (EX/PX/NX/XX), DEL/UNLINK, STRLEN, SCAN (MATCH/COUNT),
+DBSIZE, FLUSHDB and INFO. Keys expire lazily on access and in a periodic
+sweep; above MOCK_REDIS_MAXMEMORY bytes the least recently used keys are
+evicted, like maxmemory-policy allkeys-lru.
+
+Run with: python mock_redis_server.py [port]
+then set CACHE_SHARED_URL=redis://localhost:<port>
+"""
+
+import fnmatch
+import os
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Bytes of values kept before least recently used keys are evicted (0 for no limit)
+MOCK_REDIS_MAXMEMORY = int(os.getenv("MOCK_REDIS_MAXMEMORY", str(256 * 1024 * 1024)))
+# Added to every command, to model a server across the network instead of on loopback
+MOCK_REDIS_LATENCY_MS = float(os.getenv("MOCK_REDIS_LATENCY_MS", "0"))
+
+store = OrderedDict()  # key -> (value, expires_at or None), least recently used first
+store_lock = threading.Lock()
+stats = {'commands': 0, 'hits': 0, 'misses': 0, 'evicted': 0, 'expired': 0, 'used_memory': 0}
+
+
+class CommandError(Exception):
+    pass
+
+
+def _live(key, now):
+    """Value of key, dropping it if expired; None if missing. Caller holds store_lock."""
+    entry = store.get(key)
+    if entry is None:
+        return None
+    if entry[1] is not None and entry[1] <= now:
+        _drop(key)
+        stats['expired'] += 1
+        return None
+    return entry[0]
+
+
+def _drop(key):
+    value, _ = store.pop(key)
+    stats['used_memory'] -= len(key) + len(value)
+
+
+def _evict():
+    while MOCK_REDIS_MAXMEMORY and stats['used_memory'] > MOCK_REDIS_MAXMEMORY and store:
+        _drop(next(iter(store)))
+        stats['evicted'] += 1
+
+
+def cmd_set(args):
+    if len(args) < 2:
+        raise CommandError("wrong number of arguments for 'set' command")
+    key, value = args[0], args[1]
+    expires_at, mode = None, None
+    options = [arg.upper() for arg in args[2:]]
+    i = 0
+    while i < len(options):
+        if options[i] in (b"EX", b"PX") and i + 1 < len(options):
+            amount = int(options[i + 1])
+            expires_at = time.time() + (amount if options[i] == b"EX" else amount / 1000)
+            i += 2
+        elif options[i] in (b"NX", b"XX"):
+            mode = options[i]
+            i += 1
+        else:
+            raise CommandError("syntax error")
+    with store_lock:
+        exists = _live(key, time.time()) is not None
+        if (mode == b"NX" and exists) or (mode == b"XX" and not exists):
+            return None
+        if exists:
+            _drop(key)
+        store[key] = (value, expires_at)
+        stats['used_memory'] += len(key) + len(value)
+        _evict()
+    return "OK"
+
+
+def cmd_get(args):
+    with store_lock:
+        value = _live(args[0], time.time())
+        if value is None:
+            stats['misses'] += 1
+        else:
+            stats['hits'] += 1
+            store.move_to_end(args[0])
+        return value
+
+
+def cmd_del(args):
+    with store_lock:
+        now = time.time()
+        removed = 0
+        for key in args:
+            if _live(key, now) is not None:
+                _drop(key)
+                removed += 1
+        return removed
+
+
+def cmd_strlen(args):
+    with store_lock:
+        value = _live(args[0], time.time())
+        return 0 if value is None else len(value)
+
+
+def cmd_scan(args):
+    """Cursor is an offset into the key list; good enough for a store that is not resized mid-scan."""
+    cursor = int(args[0])
+    pattern, count = b"*", 10
+    for i in range(1, len(args) - 1, 2):
+        if args[i].upper() == b"MATCH":
+            pattern = args[i + 1]
+        elif args[i].upper() == b"COUNT":
+            count = int(args[i + 1])
+    with store_lock:
+        keys = list(store)
+    batch = keys[cursor:cursor + count]
+    next_cursor = cursor + count if cursor + count < len(keys) else 0
+    matched = [key for key in batch if fnmatch.fnmatchcase(key.decode(errors="replace"), pattern.decode())]
+    return [str(next_cursor).encode(), matched]
+
+
+def cmd_dbsize(args):
+    with store_lock:
+        return len(store)
+
+
+def cmd_flushdb(args):
+    with store_lock:
+        store.clear()
+        stats['used_memory'] = 0
+    return "OK"
+
+
+def cmd_info(args):
+    with store_lock:
+        lines = [f"{key}:{value}" for key, value in stats.items()] + [f"keys:{len(store)}"]
+    return ("\r\n".join(lines) + "\r\n").encode()
+
+
+COMMANDS = {
+    b"PING": lambda args: args[0] if args else "PONG",
+    b"AUTH": lambda args: "OK",
+    b"SELECT": lambda args: "OK",
+    b"SET": cmd_set,
+    b"GET": cmd_get,
+    b"DEL": cmd_del,
+    b"UNLINK": cmd_del,
+    b"STRLEN": cmd_strlen,
+    b"SCAN": cmd_scan,
+    b"DBSIZE": cmd_dbsize,
+    b"FLUSHDB": cmd_flushdb,
+    b"INFO": cmd_info,
+}
+
+
+def encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, CommandError):
+        return f"-ERR {reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, as typed into telnet
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            stats['commands'] += 1
+            if MOCK_REDIS_LATENCY_MS:
+                time.sleep(MOCK_REDIS_LATENCY_MS / 1000)
+            handler = COMMANDS.get(args[0].upper())
+            try:
+                if handler is None:
+                    raise CommandError(f"unknown command '{args[0].decode(errors='replace')}'")
+                reply = handler(args[1:])
+            except CommandError as e:
+                reply = e
+            except (IndexError, ValueError):
+                reply = CommandError("wrong arguments")
+            try:
+                self.wfile.write(encode(reply))
+            except ConnectionError:
+                return
+
+
+def sweep_expired(interval=1.0):
+    """Drop expired keys in the background so memory use tracks live entries."""
+    while True:
+        time.sleep(interval)
+        now = time.time()
+        with store_lock:
+            for key in [key for key, (_, expires_at) in store.items() if expires_at is not None and expires_at <= now]:
+                _drop(key)
+                stats['expired'] += 1
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 6379
+    threading.Thread(target=sweep_expired, daemon=True).start()
+    with Server(("0.0.0.0", port), RESPHandler) as server:
+        print(f"Mock Redis listening on port {port}")
+        server.serve_forever()
@@ -0,0 +1,171 @@
+"""Local stand-in for a Weaviate instance serving hybrid search, for load-testing without Weaviate Cloud
+
+Implements the REST/GraphQL calls made by weaviate.Client (v3) and
+WeaviateHybridSearchRetriever: meta, readiness, schema, batch import and
+Get queries with hybrid/nearText/bm25 arguments. Every class is answered
+from the same corpus, chunked on blank lines.
+
+Run with: python mock_weaviate_server.py [port]
+then set WEAVIATE_URL=http://localhost:<port>
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+from flask import Flask, jsonify, request
+
+MOCK_WEAVIATE_LATENCY_MS = float(os.getenv("MOCK_WEAVIATE_LATENCY_MS", "40"))
+MOCK_WEAVIATE_CORPUS = os.getenv(
+    "MOCK_WEAVIATE_CORPUS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql_query_generator", "trino_data.md"),
+)
+MOCK_WEAVIATE_CHUNK_CHARS = int(os.getenv("MOCK_WEAVIATE_CHUNK_CHARS", "1000"))
+
+app = Flask(__name__)
+stats = {'queries': 0, 'objects_imported': 0}
+stats_lock = threading.Lock()
+classes = {name: {'class': name, 'properties': [{'name': 'content', 'dataType': ['text']}]} for name in ("RAG", "TrinoDoc")}
+
+
+def _terms(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def load_corpus(path, chunk_chars=MOCK_WEAVIATE_CHUNK_CHARS):
+    """Paragraphs of the corpus merged into chunks of about chunk_chars characters."""
+    if not os.path.exists(path):
+        print(f"Mock Weaviate corpus {path} not found, serving an empty index")
+        return []
+    with open(path, encoding="utf-8") as f:
+        paragraphs = [p.strip() for p in f.read().split("\n\n") if p.strip()]
+    chunks, current = [], ""
+    for paragraph in paragraphs:
+        if current and len(current) + len(paragraph) > chunk_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return [(chunk, _terms(chunk)) for chunk in chunks]
+
+
+corpus = load_corpus(MOCK_WEAVIATE_CORPUS)
+
+
+def search(query, limit):
+    query_terms = _terms(query)
+    scored = []
+    for index, (text, terms) in enumerate(corpus):
+        score = len(query_terms & terms) / (len(query_terms) or 1)
+        if score:
+            scored.append((score, index))
+    scored.sort(key=lambda pair: (-pair[0], pair[1]))
+    return [(corpus[index][0], score) for score, index in scored[:limit]]
+
+
+def _selection(block):
+    """Top-level field names of a GraphQL selection set, skipping nested blocks such as _additional."""
+    fields, depth, token = [], 0, ""
+    for char in block:
+        if depth == 0 and (char.isalnum() or char == "_"):
+            token += char
+            continue
+        if token:
+            fields.append(token)
+            token = ""
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+    if token:
+        fields.append(token)
+    return fields
+
+
+def answer_get(graphql):
+    match = re.search(r"Get\s*\{\s*(\w+)\s*(\((.*?)\))?\s*\{(.*)\}\s*\}\s*\}", graphql, re.DOTALL)
+    if not match:
+        return {'errors': [{'message': 'mock Weaviate only supports Get queries'}]}
+    class_name, arguments, selection = match.group(1), match.group(3) or "", match.group(4)
+    query_match = re.search(r'(?:query|concepts)\s*:\s*\[?\s*"((?:[^"\\]|\\.)*)"', arguments)
+    limit_match = re.search(r"limit\s*:\s*(\d+)", arguments)
+    query = json.loads(f'"{query_match.group(1)}"') if query_match else ""
+    limit = int(limit_match.group(1)) if limit_match else 10
+    properties = [field for field in _selection(selection) if field != "_additional"]
+    objects = []
+    for text, score in search(query, limit):
+        obj = {name: text if name in ("content", "text", "page_content") else None for name in properties}
+        if "_additional" in selection:
+            obj['_additional'] = {'id': str(uuid.uuid5(uuid.NAMESPACE_URL, text)), 'score': str(score), 'distance': 1 - score}
+        objects.append(obj)
+    return {'data': {'Get': {class_name: objects}}}
+
+
+@app.route('/v1/graphql', methods=['POST'])
+def graphql():
+    with stats_lock:
+        stats['queries'] += 1
+    time.sleep(MOCK_WEAVIATE_LATENCY_MS / 1000)
+    return jsonify(answer_get(request.get_json().get('query', '')))
+
+
+@app.route('/v1/meta', methods=['GET'])
+def meta():
+    return jsonify({'hostname': 'http://[::]:8080', 'version': '1.24.0', 'modules': {'text2vec-huggingface': {}}})
+
+
+@app.route('/v1/.well-known/ready', methods=['GET'])
+@app.route('/v1/.well-known/live', methods=['GET'])
+def ready():
+    return "", 200
+
+
+@app.route('/v1/.well-known/openid-configuration', methods=['GET'])
+def openid_configuration():
+    return jsonify({'error': 'oidc not enabled'}), 404
+
+
+@app.route('/v1/schema', methods=['GET'])
+def get_schema():
+    return jsonify({'classes': list(classes.values())})
+
+
+@app.route('/v1/schema', methods=['POST'])
+def create_class():
+    definition = request.get_json()
+    classes[definition['class']] = definition
+    return jsonify(definition)
+
+
+@app.route('/v1/schema/<class_name>', methods=['GET'])
+def get_class(class_name):
+    if class_name not in classes:
+        return jsonify({'error': [{'message': f"class {class_name} not found"}]}), 404
+    return jsonify(classes[class_name])
+
+
+@app.route('/v1/batch/objects', methods=['POST'])
+def batch_objects():
+    objects = request.get_json().get('objects', [])
+    with stats_lock:
+        stats['objects_imported'] += len(objects)
+    return jsonify([
+        dict(obj, id=obj.get('id') or str(uuid.uuid4()), result={})
+        for obj in objects
+    ])
+
+
+@app.route('/mock/stats', methods=['GET'])
+def mock_stats():
+    with stats_lock:
+        return jsonify(dict(stats, corpus_chunks=len(corpus)))
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8003
+    app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,304 @@
+"""Prompt templates compiled once, laid out as a static prefix followed by per-call fields
+
+Everything that does not change between calls (role, rules, output format)
+is in the system message, so consecutive requests share an identical prefix
+that provider-side and local prompt caches can reuse. Per-call fields go in
+the final user message, most stable first (schema, then retrieved context,
+then the question).
+"""
+
+import hashlib
+import inspect
+from string import Formatter
+
+from context_budget import count_tokens
+from telemetry import Counter, register, current_span
+
+prompt_tokens = register(Counter(
+    "prompt_tokens_estimated_total", "Estimated input tokens by prompt and part (static prefix or per-call).", ("prompt", "part")
+))
+prompt_renders = register(Counter("prompt_renders_total", "Prompts rendered.", ("prompt",)))
+
+
+class PromptTemplate:
+    """A compiled prompt: a fixed system prefix and a user message template."""
+
+    def __init__(self, name, system, user_template):
+        self.name = name
+        self.system = inspect.cleandoc(system)
+        self.user_template = inspect.cleandoc(user_template)
+        if any(field for _, field, _, _ in Formatter().parse(self.system)):
+            raise ValueError(f"Prompt {name}: the static prefix must not contain fields")
+        self.fields = [field for _, field, _, _ in Formatter().parse(self.user_template) if field]
+        self.prefix_tokens = count_tokens(self.system)
+        self.prefix_hash = hashlib.sha256(self.system.encode("utf-8")).hexdigest()[:12]
+        self._chat_prompt = None
+
+    def _record(self, user_content):
+        dynamic_tokens = count_tokens(user_content)
+        prompt_renders.inc(prompt=self.name)
+        prompt_tokens.inc(self.prefix_tokens, prompt=self.name, part="static")
+        prompt_tokens.inc(dynamic_tokens, prompt=self.name, part="dynamic")
+        span = current_span()
+        if span is not None:
+            span.set_attribute("prompt.name", self.name)
+            span.set_attribute("prompt.prefix_hash", self.prefix_hash)
+            span.set_attribute("prompt.static_tokens", self.prefix_tokens)
+            span.set_attribute("prompt.dynamic_tokens", dynamic_tokens)
+
+    def messages(self, **values):
+        """Chat messages for one call."""
+        missing = [field for field in self.fields if field not in values]
+        if missing:
+            raise KeyError(f"Prompt {self.name} is missing {', '.join(missing)}")
+        user_content = self.user_template.format(**values)
+        self._record(user_content)
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": user_content},
+        ]
+
+    def chat_prompt(self):
+        """The same prompt as a LangChain ChatPromptTemplate, built once."""
+        if self._chat_prompt is None:
+            from langchain_core.prompts import ChatPromptTemplate
+            from langchain_core.runnables import RunnableLambda
+
+            template = ChatPromptTemplate.from_messages([
+                ("system", self.system.replace("{", "{{").replace("}", "}}")),
+                ("user", self.user_template),
+            ])
+
+            def record(values):
+                self._record(self.user_template.format(**{field: values[field] for field in self.fields}))
+                return values
+
+            self._chat_prompt = RunnableLambda(record) | template
+        return self._chat_prompt
+
+
+TRINO_SQL = PromptTemplate(
+    "trino_sql",
+    system="""
+    You are a Trino SQL expert specializing in distributed query optimization.
+    The queries must adhere to the semantics and syntax and should use Trino specific functions.
+    Only reference tables and columns listed in the database schema.
+
+    Please provide:
+    1. A detailed Trino SQL query that addresses the user's question
+    2. An explanation of the query components
+    3. Any relevant Trino-specific optimizations or best practices
+
+    Consider:
+    - Trino's distributed query execution
+    - Appropriate use of Trino's supported data types
+    - Partition pruning and predicate pushdown
+    - Proper join strategies
+    - Performance optimization techniques
+
+    Format your response as:
+    QUERY:
+    <the SQL query>
+
+    EXPLANATION:
+    <detailed explanation>
+
+    OPTIMIZATIONS:
+    <list of Trino-specific optimizations>
+    """,
+    user_template="""
+    Database Schema:
+    {schema}
+
+    Context from Documentation:
+    {context}
+
+    Similar past questions with SQL that ran successfully:
+    {examples}
+
+    User Question: {question}
+    """,
+)
+
+# Draft-tier variant of TRINO_SQL for the small model: same rules and fields, plus a self-rated confidence
+TRINO_SQL_DRAFT = PromptTemplate(
+    "trino_sql_draft",
+    system=(
+        TRINO_SQL.system + "\n\nEnd with one final line:\n"
+        "CONFIDENCE: <a number from 0.0 to 1.0 rating how sure you are that the query is correct "
+        "and answers the question using only the listed schema>"
+    ),
+    user_template=TRINO_SQL.user_template,
+)
+
+REPAIR_SQL = PromptTemplate(
+    "repair_sql",
+    system="""
+    You are a Trino SQL expert fixing a query that failed validation before execution.
+    Fix exactly the reported errors and keep everything else about the query unchanged.
+    Only reference tables and columns listed in the database schema.
+    Return a single statement without a trailing semicolon and without commentary.
+
+    Format your response as:
+    QUERY:
+    <the corrected SQL query>
+    """,
+    user_template="""
+    Database Schema:
+    {schema}
+
+    User Question: {question}
+
+    Query:
+    {sql}
+
+    Validation errors:
+    {errors}
+    """,
+)
+
+TRINO_BEST_PRACTICES = PromptTemplate(
+    "trino_best_practices",
+    system="""
+    You are a Trino expert focusing on query optimization and best practices.
+    Only give valid suggestions, not too many and not too few; suggest something only if it is needed at all.
+    Provide Trino-specific best practices for the user's query considering:
+    - Connector optimization
+    - Query optimization
+    - Resource management
+    - Performance tuning
+    - Data distribution
+    Only include Trino-specific recommendations.
+    """,
+    user_template="""
+    Query: {question}
+    """,
+)
+
+REFINE_QUERY = PromptTemplate(
+    "refine_query",
+    system="""
+    You refine user queries to make them clearer for SQL generation.
+    You are a Trino SQL query understanding expert.
+    Your job is to refine and expand the user's query to ensure it's clear and comprehensive.
+
+    Analyze the query and:
+    1. Identify any ambiguities or missing information
+    2. Expand it to include any implied requirements
+    3. Structure it in a way that would help generate optimal Trino SQL
+
+    Return only the refined query without explanation.
+    """,
+    user_template="""
+    Original Query: {question}
+    """,
+)
+
+EXPLAIN_CONCEPTS = PromptTemplate(
+    "explain_concepts",
+    system="""
+    You are a Trino educator specializing in explaining complex database concepts.
+    Provide a clear, educational explanation of the Trino concepts relevant to the user's query.
+    Focus on helping the user understand the underlying principles and how they apply to their query.
+    """,
+    user_template="""
+    Documentation context:
+    {context}
+
+    User query: {question}
+    """,
+)
+
+OPTIMIZE_QUERY = PromptTemplate(
+    "optimize_query",
+    system="""
+    You are a Trino performance optimization expert.
+    Provide specific, actionable Trino optimization strategies for the generated SQL considering:
+    - Query structure optimizations
+    - Join optimizations
+    - Predicate pushdown opportunities
+    - Partition pruning techniques
+    - Resource allocation recommendations
+    - Any Trino-specific functions or syntax that could improve performance
+
+    Format your response with clear sections and code examples where appropriate.
+    """,
+    user_template="""
+    Context from Documentation:
+    {context}
+
+    User Query: {question}
+
+    Generated SQL:
+    {sql}
+    """,
+)
+
+DETECT_INTENT = PromptTemplate(
+    "detect_intent",
+    system="""
+    You analyze user intent for database queries.
+    Determine which of these intents apply (respond ONLY with a comma-separated list of the applicable intents):
+    - SQL (user wants an SQL query)
+    - Explanation (user wants explanation of Trino concepts)
+    - Optimization (user wants performance optimization advice)
+    """,
+    user_template="""
+    Query: "{question}"
+    """,
+)
+
+OLAP_BEST_PRACTICES = PromptTemplate(
+    "olap_best_practices",
+    system="""
+    Provide best OLAP practices for the user's request and recommend either a Star or Snowflake schema.
+    """,
+    user_template="""
+    The user has asked: '{question}'
+    """,
+)
+
+SCHEMA_DRAFT = PromptTemplate(
+    "schema_draft",
+    system="""
+    Given OLAP documentation context and best-practice notes, generate a relational database schema for the user's request including:
+    - SQL query to create schema in MySQL
+    - Tables and their relationships
+    - Columns with appropriate data types
+    - Primary and foreign keys
+    - Schema type (Star/Snowflake or any other) and its reasoning.
+    """,
+    user_template="""
+    OLAP context:
+    {context}
+
+    Best-practice notes:
+    {best_practices}
+
+    The user has asked: '{question}'
+    """,
+)
+
+EXTRACT_SQL = PromptTemplate(
+    "extract_sql",
+    system="""
+    Provide OLAP schema data in JSON format.
+    The input explains the reason for a schema choice along with its SQL code; extract and return only the code part and nothing else.
+    """,
+    user_template="""
+    Input:
+    {draft}
+    """,
+)
+
+EXTRACT_EXPLANATION = PromptTemplate(
+    "extract_explanation",
+    system="""
+    Provide OLAP schema explanation in JSON format.
+    From the input, extract and return only the explanation, reasoning, and non-code parts. Do not include SQL code.
+    """,
+    user_template="""
+    Input:
+    {draft}
+    """,
+)
@@ -0,0 +1,401 @@
+"""Query history: generated and executed SQL with full-text, vector and fingerprint search
+
+Entries (NL question, SQL, engine, latency, success, row count) live in a
+SQLite database shared by the services on a host. questions, SQL and saved
+names are indexed with FTS5; question embeddings, when an embed function
+is available, are kept in an in-memory matrix for cosine search. Every
+entry is keyed by the fingerprint of its SQL (literals replaced, formatting
+normalized), so reruns of the same query shape can be found directly.
+
+examples() returns the closest past successful (question, SQL) pairs for
+use as few-shot examples in the generation prompt.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import sqlglot
+from sqlglot import exp
+
+from telemetry import Counter, Histogram, register
+
+# Shared by every service on the host unless overridden
+QUERY_HISTORY_DB = os.getenv(
+    "QUERY_HISTORY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "query_history.db")
+)
+# Record generations and executions (0 turns recording and few-shot reuse off)
+QUERY_HISTORY = os.getenv("QUERY_HISTORY", "1") == "1"
+# Past (question, SQL) pairs added to the generation prompt
+HISTORY_FEW_SHOT_K = int(os.getenv("HISTORY_FEW_SHOT_K", "3"))
+# Cosine similarity a past question needs to be used as an example
+HISTORY_MIN_SIMILARITY = float(os.getenv("HISTORY_MIN_SIMILARITY", "0.6"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    question TEXT,
+    sql TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    engine TEXT,
+    source TEXT NOT NULL,
+    name TEXT,
+    latency_ms REAL,
+    success INTEGER,
+    row_count INTEGER,
+    error TEXT,
+    rating TEXT,
+    embedding BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_queries_fingerprint ON queries(fingerprint);
+CREATE INDEX IF NOT EXISTS idx_queries_created ON queries(created_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS queries_fts USING fts5(question, sql, name, content='queries', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS queries_ai AFTER INSERT ON queries BEGIN
+    INSERT INTO queries_fts(rowid, question, sql, name) VALUES (new.id, new.question, new.sql, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS queries_ad AFTER DELETE ON queries BEGIN
+    INSERT INTO queries_fts(queries_fts, rowid, question, sql, name) VALUES ('delete', old.id, old.question, old.sql, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS queries_au AFTER UPDATE OF question, sql, name ON queries BEGIN
+    INSERT INTO queries_fts(queries_fts, rowid, question, sql, name) VALUES ('delete', old.id, old.question, old.sql, old.name);
+    INSERT INTO queries_fts(rowid, question, sql, name) VALUES (new.id, new.question, new.sql, new.name);
+END;
+-- Bumped whenever an existing entry stops or starts being a few-shot candidate, so every
+-- process can tell (with MAX(id) for new entries) that its vector index is stale
+CREATE TABLE IF NOT EXISTS history_version (id INTEGER PRIMARY KEY CHECK (id = 1), changes INTEGER NOT NULL);
+INSERT OR IGNORE INTO history_version (id, changes) VALUES (1, 0);
+CREATE TRIGGER IF NOT EXISTS queries_version_au AFTER UPDATE OF success, question, embedding ON queries BEGIN
+    UPDATE history_version SET changes = changes + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS queries_version_ad AFTER DELETE ON queries BEGIN
+    UPDATE history_version SET changes = changes + 1 WHERE id = 1;
+END;
+"""
+
+COLUMNS = ("id", "created_at", "question", "sql", "fingerprint", "engine", "source", "name",
+           "latency_ms", "success", "row_count", "error", "rating")
+
+history_searches = register(Histogram("query_history_search_seconds", "Query history search latency by kind.", ("kind",)))
+history_few_shot = register(Counter(
+    "query_history_few_shot_total", "Generations by whether past successful queries were used as examples.", ("result",)
+))
+
+
+def sql_fingerprint(sql, dialect="trino"):
+    """Stable hash of a query's shape: literals replaced by placeholders, formatting and keyword case normalized."""
+    try:
+        tree = sqlglot.parse_one(sql, read=dialect)
+        normalized = tree.transform(
+            lambda node: exp.Placeholder() if isinstance(node, exp.Literal) else node
+        ).sql(dialect=dialect, normalize=True)
+    except sqlglot.errors.SqlglotError:
+        normalized = re.sub(r"'(?:[^']|'')*'|\b\d+(\.\d+)?\b", "?", sql)
+        normalized = re.sub(r"\s+", " ", normalized).strip().rstrip(";").lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def format_examples(examples):
+    """Few-shot block for the generation prompt."""
+    if not examples:
+        return "None"
+    return "\n\n".join(f"Question: {example['question']}\nSQL:\n{example['sql']}" for example in examples)
+
+
+def _fts_query(text, operator):
+    """FTS5 MATCH expression from free text: every word quoted, prefix-matched and joined with operator."""
+    words = re.findall(r"\w+", text.lower())
+    return f" {operator} ".join(f'"{word}"*' for word in words)
+
+
+class QueryHistory:
+    """SQLite-backed history with FTS5 and an in-memory vector index.
+
+    embed maps text -> list of floats (e.g. the service's embedding model);
+    without it, search and examples() use full-text ranking only.
+    """
+
+    def __init__(self, path=QUERY_HISTORY_DB, embed=None):
+        self.path = path
+        self.embed = embed
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._vectors = None  # (ids, normalized matrix, max id, changes) of successful entries, see _vector_index
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+
+    def _connection(self):
+        # One connection per thread; WAL lets the services on the host read while one writes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _embed(self, text, embedding=None):
+        if embedding is None and self.embed is not None and text:
+            try:
+                embedding = self.embed(text)
+            except Exception as e:
+                print(f"Query history embedding failed: {e}")
+                return None
+        if embedding is None:
+            return None
+        import numpy as np
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    @staticmethod
+    def _row(row):
+        entry = dict(zip(COLUMNS, row))
+        entry['created_at'] = datetime.fromtimestamp(entry['created_at'], timezone.utc).isoformat(timespec="seconds")
+        entry['success'] = None if entry['success'] is None else bool(entry['success'])
+        return entry
+
+    def record(self, sql, question=None, engine=None, source="generated", name=None, latency_ms=None,
+               success=None, row_count=None, error=None, embedding=None, dialect="trino"):
+        """Store one entry and return its id; embedding skips re-encoding a question the caller already embedded."""
+        vector = self._embed(question, embedding) if question else None
+        conn = self._connection()
+        cursor = conn.execute(
+            "INSERT INTO queries (created_at, question, sql, fingerprint, engine, source, name, latency_ms, success, "
+            "row_count, error, embedding) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), question, sql, sql_fingerprint(sql, dialect), engine, source, name, latency_ms,
+             None if success is None else int(bool(success)), row_count, error,
+             vector.tobytes() if vector is not None else None)
+        )
+        conn.commit()
+        return cursor.lastrowid
+
+    def update_outcome(self, entry_id, success, latency_ms=None, row_count=None, error=None, engine=None):
+        """Record how an entry's SQL did when executed; successful entries become few-shot candidates."""
+        conn = self._connection()
+        conn.execute(
+            "UPDATE queries SET success = ?, latency_ms = COALESCE(?, latency_ms), row_count = COALESCE(?, row_count), "
+            "error = ?, engine = COALESCE(?, engine) WHERE id = ?",
+            (int(bool(success)), latency_ms, row_count, error, engine, entry_id)
+        )
+        conn.commit()
+        return self.get(entry_id)
+
+    def rate(self, entry_id, rating):
+        conn = self._connection()
+        conn.execute("UPDATE queries SET rating = ? WHERE id = ?", (rating, entry_id))
+        conn.commit()
+        return self.get(entry_id)
+
+    def get(self, entry_id):
+        row = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM queries WHERE id = ?", (entry_id,)
+        ).fetchone()
+        return self._row(row) if row else None
+
+    def recent(self, limit=50, success=None, engine=None):
+        clauses, params = [], []
+        if success is not None:
+            clauses.append("success = ?")
+            params.append(int(success))
+        if engine:
+            clauses.append("engine = ?")
+            params.append(engine)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM queries {where} ORDER BY created_at DESC LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def by_fingerprint(self, fingerprint, limit=50):
+        """Every run of the same query shape, newest first."""
+        started = time.perf_counter()
+        rows = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM queries WHERE fingerprint = ? ORDER BY created_at DESC LIMIT ?",
+            (fingerprint, limit)
+        ).fetchall()
+        history_searches.observe(time.perf_counter() - started, kind="fingerprint")
+        return [self._row(row) for row in rows]
+
+    def _text_ids(self, text, limit, operator="AND", successful_only=False):
+        match = _fts_query(text, operator)
+        if not match:
+            return []
+        extra = "AND q.success = 1 AND q.question IS NOT NULL" if successful_only else ""
+        rows = self._connection().execute(
+            f"SELECT q.id FROM queries_fts JOIN queries q ON q.id = queries_fts.rowid "
+            f"WHERE queries_fts MATCH ? {extra} ORDER BY bm25(queries_fts) LIMIT ?",
+            (match, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _vector_rows(self, after, up_to):
+        import numpy as np
+        rows = self._connection().execute(
+            "SELECT id, embedding FROM queries WHERE id > ? AND id <= ? AND success = 1 "
+            "AND question IS NOT NULL AND embedding IS NOT NULL ORDER BY id",
+            (after, up_to)
+        ).fetchall()
+        return [row[0] for row in rows], [np.frombuffer(row[1], dtype=np.float32) for row in rows]
+
+    def _vector_index(self):
+        """(ids, matrix) of successful entries, kept in step with writes from every process on the host.
+
+        New entries (a higher MAX(id)) are appended; an outcome change or delete
+        anywhere (history_version.changes) rebuilds the matrix.
+        """
+        import numpy as np
+        with self._lock:
+            max_id, changes = self._connection().execute(
+                "SELECT (SELECT COALESCE(MAX(id), 0) FROM queries), changes FROM history_version WHERE id = 1"
+            ).fetchone()
+            if self._vectors is None or self._vectors[3] != changes:
+                ids, vectors = self._vector_rows(0, max_id)
+                matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+                self._vectors = (ids, matrix, max_id, changes)
+            elif self._vectors[2] != max_id:
+                ids, matrix, known, _ = self._vectors
+                new_ids, vectors = self._vector_rows(known, max_id)
+                if vectors:
+                    matrix = np.vstack([matrix] + vectors) if ids else np.vstack(vectors)
+                self._vectors = (ids + new_ids, matrix, max_id, changes)
+            return self._vectors[0], self._vectors[1]
+
+    def _vector_ids(self, vector, limit):
+        """(id, cosine similarity) of the closest successful questions."""
+        import numpy as np
+        ids, matrix = self._vector_index()
+        if not ids or matrix.shape[1] != vector.shape[0]:
+            return []
+        scores = matrix @ vector
+        top = np.argsort(-scores)[:limit]
+        return [(ids[i], float(scores[i])) for i in top]
+
+    def search(self, text, limit=20, embedding=None):
+        """Full-text matches fused with vector matches (reciprocal rank fusion), best first."""
+        started = time.perf_counter()
+        ranked = {}
+        for rank, entry_id in enumerate(self._text_ids(text, limit)):
+            ranked[entry_id] = ranked.get(entry_id, 0.0) + 1 / (60 + rank)
+        vector = self._embed(text, embedding)
+        if vector is not None:
+            for rank, (entry_id, _) in enumerate(self._vector_ids(vector, limit)):
+                ranked[entry_id] = ranked.get(entry_id, 0.0) + 1 / (60 + rank)
+        entries = [self.get(entry_id) for entry_id in sorted(ranked, key=ranked.get, reverse=True)[:limit]]
+        history_searches.observe(time.perf_counter() - started, kind="search")
+        return [entry for entry in entries if entry]
+
+    def examples(self, question, k=HISTORY_FEW_SHOT_K, embedding=None, min_similarity=HISTORY_MIN_SIMILARITY):
+        """Top-k past successful (question, SQL) pairs for question, one per query fingerprint."""
+        started = time.perf_counter()
+        vector = self._embed(question, embedding)
+        if vector is not None:
+            candidates = [entry_id for entry_id, score in self._vector_ids(vector, k * 4) if score >= min_similarity]
+        else:
+            candidates = self._text_ids(question, k * 4, operator="OR", successful_only=True)
+        examples, seen = [], set()
+        for entry_id in candidates:
+            entry = self.get(entry_id)
+            # The outcome may have changed since the index was last synced
+            if entry is None or not entry['success'] or entry['fingerprint'] in seen:
+                continue
+            seen.add(entry['fingerprint'])
+            examples.append({'id': entry['id'], 'question': entry['question'], 'sql': entry['sql']})
+            if len(examples) >= k:
+                break
+        history_searches.observe(time.perf_counter() - started, kind="examples")
+        history_few_shot.inc(result="hit" if examples else "miss")
+        return examples
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history(embed=None):
+    """Process-wide QueryHistory, or None when QUERY_HISTORY is off; embed is used on first creation."""
+    global _history
+    if not QUERY_HISTORY:
+        return None
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                _history = QueryHistory(embed=embed)
+    return _history
+
+
+def add_history_endpoints(app, history):
+    """Register the history API used by the History page and the SQL editor."""
+    from flask import jsonify, request
+
+    def flag(value):
+        return None if value is None else value.lower() in ("1", "true", "yes")
+
+    @app.route('/api/queries', methods=['GET'])
+    def list_queries():
+        """Recent entries, or search with ?q= (text) / ?fingerprint= / ?sql= (same query shape)."""
+        try:
+            limit = min(int(request.args.get('limit', 50)), 500)
+            if request.args.get('fingerprint') or request.args.get('sql'):
+                fingerprint = request.args.get('fingerprint') or sql_fingerprint(request.args['sql'])
+                entries = history.by_fingerprint(fingerprint, limit)
+            elif request.args.get('q'):
+                entries = history.search(request.args['q'], limit)
+            else:
+                entries = history.recent(limit, success=flag(request.args.get('success')), engine=request.args.get('engine'))
+            return jsonify({'queries': entries})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/queries/<int:entry_id>', methods=['GET'])
+    def get_query(entry_id):
+        entry = history.get(entry_id)
+        if entry is None:
+            return jsonify({'error': f'Unknown query: {entry_id}'}), 404
+        return jsonify(entry)
+
+    @app.route('/api/query/save', methods=['POST'])
+    def save_query():
+        """Save a query from the editor: {query, dialect, name, question}."""
+        data = request.get_json() or {}
+        sql = data.get('query') or data.get('sql')
+        if not sql:
+            return jsonify({'error': 'No query provided'}), 400
+        try:
+            entry_id = history.record(
+                sql,
+                question=data.get('question'),
+                engine=(data.get('dialect') or data.get('engine') or 'trino').lower(),
+                source="saved",
+                name=data.get('name')
+            )
+            return jsonify(history.get(entry_id)), 201
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/queries/<int:entry_id>/outcome', methods=['POST'])
+    def query_outcome(entry_id):
+        """Report an execution result: {success, latency_ms, row_count, error, engine}."""
+        data = request.get_json() or {}
+        if 'success' not in data:
+            return jsonify({'error': 'success is required'}), 400
+        if history.get(entry_id) is None:
+            return jsonify({'error': f'Unknown query: {entry_id}'}), 404
+        return jsonify(history.update_outcome(
+            entry_id, data['success'], data.get('latency_ms'), data.get('row_count'), data.get('error'), data.get('engine')
+        ))
+
+    @app.route('/api/queries/<int:entry_id>/rating', methods=['POST'])
+    def rate_query(entry_id):
+        """Like or dislike an entry: {rating: "like" | "dislike" | null}."""
+        rating = (request.get_json() or {}).get('rating')
+        if rating not in ('like', 'dislike', None):
+            return jsonify({'error': 'rating must be like, dislike or null'}), 400
+        if history.get(entry_id) is None:
+            return jsonify({'error': f'Unknown query: {entry_id}'}), 404
+        return jsonify(history.rate(entry_id, rating))
@@ -0,0 +1,723 @@
+"""Two-tier cache shared by the worker processes of the services on a host
+
+Every process keeps a small LRU of recently used entries in front of a shared
+tier that all workers read and fill, selected by CACHE_SHARED_URL:
+    sqlite:///path          a SQLite file in WAL mode (the default)
+    redis://host:port[/db]  any Redis-protocol server; mock_redis_server.py stands in locally
+    none                    in-process tier only
+Entries live in namespaces ("embeddings", "retrieval", "llm", "metadata",
+...), each with its own TTL. get_or_compute() runs the computation for a
+missing key once across threads and processes (single-flight): other callers
+wait for that result instead of recomputing it. Lookups per namespace and
+tier, compute time and the bytes held by the in-process tier are exported on
+/metrics; GET /cache/stats adds the shared tier's sizes.
+
+Values are stored as JSON. Types JSON lacks (tuples, LangChain Documents,
+Decimal, dates and times, bytes, numpy scalars and arrays) are written as
+tagged objects and rebuilt on read, so a hit returns what the computation
+returned. Anything else is
+pickled and signed with CACHE_SIGNING_KEY (HMAC-SHA256), and the signature is
+checked before it is unpickled. Without a signing key such values stay in the
+in-process tier, so nothing another process wrote is ever unpickled unchecked.
+"""
+
+import base64
+import datetime
+import decimal
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from telemetry import Counter, Gauge, Histogram, register, span
+
+# Shared tier: sqlite:///<path>, redis://host:port[/db] or none
+CACHE_SHARED_URL = os.getenv(
+    "CACHE_SHARED_URL",
+    "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "shared_cache.db")
+)
+# Use the cache at all (0 makes every lookup a miss and computes directly)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+# Bytes of encoded values kept by the in-process tier of each worker
+CACHE_LOCAL_MAX_BYTES = int(os.getenv("CACHE_LOCAL_MAX_BYTES", str(64 * 1024 * 1024)))
+# Longest a worker serves its own copy of a shared entry, so clears and overwrites by other workers show up
+CACHE_LOCAL_MAX_TTL = float(os.getenv("CACHE_LOCAL_MAX_TTL", "30"))
+# Bytes kept by the SQLite shared tier before least recently used entries are evicted (Redis uses its maxmemory policy)
+CACHE_SHARED_MAX_BYTES = int(os.getenv("CACHE_SHARED_MAX_BYTES", str(512 * 1024 * 1024)))
+# Seconds a caller waits for another process computing the same key before computing it itself
+CACHE_LOCK_TIMEOUT = float(os.getenv("CACHE_LOCK_TIMEOUT", "30"))
+# Seconds the shared tier is skipped after an error before it is tried again
+CACHE_SHARED_RETRY_SECONDS = float(os.getenv("CACHE_SHARED_RETRY_SECONDS", "5"))
+# Prefix of every key in the shared tier, so several deployments can share one Redis
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "sqlgen:")
+# Secret shared by all workers for signing values that cannot be stored as JSON (unset keeps them per process)
+CACHE_SIGNING_KEY = os.getenv("CACHE_SIGNING_KEY", "")
+# Default TTLs of the namespaces used by the services
+CACHE_TTL_EMBEDDINGS = float(os.getenv("CACHE_TTL_EMBEDDINGS", "86400"))
+CACHE_TTL_RETRIEVAL = float(os.getenv("CACHE_TTL_RETRIEVAL", "3600"))
+CACHE_TTL_LLM = float(os.getenv("CACHE_TTL_LLM", "3600"))
+
+# Sleep between polls while another process computes a key
+LOCK_POLL_SECONDS = 0.02
+# Sets between SQLite evictions
+EVICT_EVERY = 200
+
+cache_requests = register(Counter(
+    "cache_requests_total", "Cache lookups by namespace and the tier that answered (local_hit, shared_hit, miss).",
+    ("namespace", "result")
+))
+cache_waits = register(Counter(
+    "cache_singleflight_waits_total", "Misses served by another caller's computation instead of computing again.",
+    ("namespace", "scope")
+))
+cache_compute = register(Histogram("cache_compute_seconds", "Time to compute missed cache entries.", ("namespace",)))
+cache_local_bytes = register(Gauge("cache_local_bytes", "Bytes held by this process's in-process cache tier.", ("namespace",)))
+
+_MISSING = object()
+
+# First byte of a stored value: JSON, or an HMAC-SHA256 signature followed by a pickle
+JSON_FORMAT = b"j"
+SIGNED_PICKLE_FORMAT = b"p"
+# Key of the tag naming the type of an object JSON cannot hold
+TYPE_TAG = "__cache_type__"
+
+# Signs the pickled values this process keeps to itself when no CACHE_SIGNING_KEY is shared
+_process_key = secrets.token_bytes(32)
+
+
+def _to_json(value):
+    """JSON-compatible copy of value, with tagged objects for the types above; TypeError for anything else."""
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    if isinstance(value, tuple):
+        return {TYPE_TAG: "tuple", "value": [_to_json(item) for item in value]}
+    if isinstance(value, dict):
+        if TYPE_TAG in value or not all(isinstance(key, str) for key in value):
+            raise TypeError("dict keys must be strings")
+        return {key: _to_json(item) for key, item in value.items()}
+    if isinstance(value, decimal.Decimal):
+        return {TYPE_TAG: "decimal", "value": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {TYPE_TAG: "datetime", "value": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {TYPE_TAG: "date", "value": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {TYPE_TAG: "time", "value": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {TYPE_TAG: "timedelta", "value": [value.days, value.seconds, value.microseconds]}
+    if isinstance(value, (bytes, bytearray)):
+        return {TYPE_TAG: "bytes", "value": base64.b64encode(value).decode()}
+    if type(value).__name__ == "Document" and hasattr(value, "page_content") and hasattr(value, "metadata"):
+        return {TYPE_TAG: "document", "page_content": value.page_content, "metadata": _to_json(value.metadata)}
+    if type(value).__module__ == "numpy" and hasattr(value, "tolist"):
+        # Embeddings become float lists, numpy scalars plain numbers
+        return _to_json(value.tolist())
+    raise TypeError(f"{type(value).__name__} is not JSON-serializable")
+
+
+def _from_json(value):
+    """Inverse of _to_json."""
+    if isinstance(value, list):
+        return [_from_json(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    kind = value.get(TYPE_TAG)
+    if kind is None:
+        return {key: _from_json(item) for key, item in value.items()}
+    if kind == "tuple":
+        return tuple(_from_json(item) for item in value["value"])
+    if kind == "decimal":
+        return decimal.Decimal(value["value"])
+    if kind == "datetime":
+        return datetime.datetime.fromisoformat(value["value"])
+    if kind == "date":
+        return datetime.date.fromisoformat(value["value"])
+    if kind == "time":
+        return datetime.time.fromisoformat(value["value"])
+    if kind == "timedelta":
+        return datetime.timedelta(*value["value"])
+    if kind == "bytes":
+        return base64.b64decode(value["value"])
+    if kind == "document":
+        from langchain_core.documents import Document
+        return Document(page_content=value["page_content"], metadata=_from_json(value["metadata"]))
+    raise ValueError(f"Unknown cached type {kind!r}")
+
+
+def encode_value(value):
+    """(blob, shareable): JSON when possible, else a signed pickle that other processes can only read with CACHE_SIGNING_KEY."""
+    try:
+        return JSON_FORMAT + json.dumps(_to_json(value), separators=(",", ":")).encode(), True
+    except (TypeError, ValueError):
+        pass
+    payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    key = CACHE_SIGNING_KEY.encode() if CACHE_SIGNING_KEY else _process_key
+    signature = hmac.new(key, payload, hashlib.sha256).digest()
+    return SIGNED_PICKLE_FORMAT + signature + payload, bool(CACHE_SIGNING_KEY)
+
+
+def decode_value(blob):
+    """Value of a blob from encode_value, or _MISSING if it is malformed or its signature does not verify."""
+    try:
+        if blob[:1] == JSON_FORMAT:
+            return _from_json(json.loads(blob[1:]))
+        if blob[:1] == SIGNED_PICKLE_FORMAT:
+            signature, payload = blob[1:33], blob[33:]
+            for key in ([CACHE_SIGNING_KEY.encode()] if CACHE_SIGNING_KEY else []) + [_process_key]:
+                if hmac.compare_digest(signature, hmac.new(key, payload, hashlib.sha256).digest()):
+                    return pickle.loads(payload)
+            print("Shared cache entry has a bad signature; ignoring it")
+            return _MISSING
+    except Exception as e:
+        print(f"Shared cache entry could not be decoded; ignoring it: {e}")
+        return _MISSING
+    # Written by an older version or something else entirely
+    return _MISSING
+
+
+class LocalTier:
+    """Byte-bounded LRU of encoded values with per-entry expiry and per-namespace size accounting."""
+
+    def __init__(self, max_bytes=CACHE_LOCAL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (namespace, expires_at, blob)
+        self._namespace_bytes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, namespace, blob, ttl):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (namespace, time.time() + ttl, blob)
+            self._account(namespace, len(blob))
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self, namespace):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0] == namespace]:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            entries = {}
+            for namespace, _, _ in self._entries.values():
+                entries[namespace] = entries.get(namespace, 0) + 1
+            return {namespace: {'entries': entries.get(namespace, 0), 'bytes': size}
+                    for namespace, size in self._namespace_bytes.items()}
+
+    def _remove(self, key):
+        namespace, _, blob = self._entries.pop(key)
+        self._account(namespace, -len(blob))
+
+    def _account(self, namespace, size):
+        self.bytes += size
+        self._namespace_bytes[namespace] = self._namespace_bytes.get(namespace, 0) + size
+        cache_local_bytes.set(self._namespace_bytes[namespace], namespace=namespace)
+
+
+class SQLiteTier:
+    """Shared tier in a SQLite file; workers on the host share it through WAL mode."""
+
+    def __init__(self, path, max_bytes=CACHE_SHARED_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._sets = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_namespace ON entries(namespace);
+            CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at);
+        """)
+
+    def _connection(self):
+        # One connection per thread in autocommit mode; add() opens its own write transaction
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        # Recency for eviction; local hits never reach this, so the write is rare
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def set(self, key, namespace, blob, ttl):
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO entries (key, namespace, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, namespace, blob, len(blob), now + ttl, now)
+        )
+        self._sets += 1
+        if self._sets % EVICT_EVERY == 0:
+            self.evict()
+
+    def add(self, key, namespace, blob, ttl):
+        """Set key only if it is missing or expired; True if this call set it."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM entries WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO entries (key, namespace, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, blob, len(blob), now + ttl, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def release(self, key, token):
+        """Delete key only while it still holds token, i.e. a lock nobody else has taken over."""
+        self._connection().execute("DELETE FROM entries WHERE key = ? AND value = ?", (key, token))
+
+    def clear(self, namespace):
+        self._connection().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until the file holds at most max_bytes."""
+        conn = self._connection()
+        conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            # Evict down to 90% so the next few sets do not trigger another pass
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM ("
+                "SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC) AS kept FROM entries"
+                ") WHERE kept > ?)",
+                (int(self.max_bytes * 0.9),)
+            )
+
+    def stats(self):
+        rows = self._connection().execute(
+            "SELECT namespace, COUNT(*), SUM(size) FROM entries WHERE expires_at >= ? GROUP BY namespace", (time.time(),)
+        ).fetchall()
+        return {namespace: {'entries': count, 'bytes': size} for namespace, count, size in rows}
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+class RedisTier:
+    """Shared tier on a Redis-protocol server, spoken directly over RESP (GET/SET/DEL/SCAN/STRLEN)."""
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        # One socket per thread, reopened after an error
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+            if self.password:
+                self.command("AUTH", self.password)
+            if self.db:
+                self.command("SELECT", self.db)
+        return conn
+
+    def command(self, *args):
+        sock, reader = self._connection()
+        parts = [str(arg).encode() if not isinstance(arg, bytes) else arg for arg in args]
+        payload = b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+        try:
+            sock.sendall(payload)
+            return self._read(reader)
+        except (OSError, EOFError):
+            self._local.conn = None
+            sock.close()
+            raise
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise EOFError("Connection closed by the cache server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read(reader) for _ in range(length)]
+        raise RedisError(f"Unexpected reply from the cache server: {line!r}")
+
+    def get(self, key):
+        return self.command("GET", key)
+
+    def set(self, key, namespace, blob, ttl):
+        self.command("SET", key, blob, "PX", max(int(ttl * 1000), 1))
+
+    def add(self, key, namespace, blob, ttl):
+        return self.command("SET", key, blob, "PX", max(int(ttl * 1000), 1), "NX") == "OK"
+
+    def delete(self, key):
+        self.command("DEL", key)
+
+    def release(self, key, token):
+        """Delete key only while it still holds token. Without scripting this is GET then DEL, which
+        leaves a window of one round trip; the lock it guards only deduplicates work."""
+        if self.command("GET", key) == token:
+            self.command("DEL", key)
+
+    def _scan(self, pattern):
+        cursor = "0"
+        while True:
+            cursor, keys = self.command("SCAN", cursor, "MATCH", pattern, "COUNT", 500)
+            cursor = cursor.decode() if isinstance(cursor, bytes) else cursor
+            yield from keys
+            if cursor == "0":
+                return
+
+    def clear(self, namespace):
+        keys = list(self._scan(f"{CACHE_KEY_PREFIX}{namespace}:*"))
+        for start in range(0, len(keys), 500):
+            self.command("DEL", *keys[start:start + 500])
+
+    def evict(self):
+        # Expiry and memory limits are the server's job
+        pass
+
+    def stats(self):
+        namespaces = {}
+        for key in self._scan(f"{CACHE_KEY_PREFIX}*"):
+            namespace = key.decode()[len(CACHE_KEY_PREFIX):].split(":", 1)[0]
+            item = namespaces.setdefault(namespace, {'entries': 0, 'bytes': 0})
+            item['entries'] += 1
+            item['bytes'] += self.command("STRLEN", key)
+        return namespaces
+
+
+def open_shared_tier(url=CACHE_SHARED_URL):
+    """Shared tier for a CACHE_SHARED_URL, or None for none/empty."""
+    if not url or url == "none":
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative/path and sqlite:////absolute/path, as in SQLAlchemy URLs
+        return SQLiteTier(url[len("sqlite:///"):])
+    if parsed.scheme == "redis":
+        db = int(parsed.path.strip("/") or 0)
+        return RedisTier(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"Unsupported CACHE_SHARED_URL: {url}")
+
+
+class _Flight:
+    """A computation in progress in this process, awaited by other threads asking for the same key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.blob = None
+
+
+class SharedCache:
+    """In-process LRU in front of an optional shared tier, with single-flight computation of misses."""
+
+    def __init__(self, shared=None, local_max_bytes=CACHE_LOCAL_MAX_BYTES, local_max_ttl=CACHE_LOCAL_MAX_TTL,
+                 lock_timeout=CACHE_LOCK_TIMEOUT, enabled=CACHE_ENABLED):
+        self.local = LocalTier(local_max_bytes)
+        self.shared = shared
+        self.local_max_ttl = local_max_ttl
+        self.lock_timeout = lock_timeout
+        self.enabled = enabled
+        self._shared_down_until = 0.0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._namespaces = {}
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def namespace(self, name, ttl):
+        """Handle for the entries of one namespace; values stay valid for ttl seconds."""
+        if name not in self._namespaces:
+            self._namespaces[name] = CacheNamespace(self, name, ttl)
+        return self._namespaces[name]
+
+    @staticmethod
+    def full_key(namespace, key):
+        """Shared-tier key: the namespace plus a hash of the key (a string or anything JSON-serializable)."""
+        text = key if isinstance(key, str) else json.dumps(key, sort_keys=True, default=str)
+        return f"{CACHE_KEY_PREFIX}{namespace}:{hashlib.sha256(text.encode()).hexdigest()[:32]}"
+
+    def _shared(self, operation, *args):
+        """Call the shared tier; it is best effort, so errors are logged and treated as misses."""
+        if self.shared is None or time.time() < self._shared_down_until:
+            return None
+        try:
+            return getattr(self.shared, operation)(*args)
+        except Exception as e:
+            # Skip the tier for a while instead of paying a connection timeout on every lookup
+            self._shared_down_until = time.time() + CACHE_SHARED_RETRY_SECONDS
+            print(f"Shared cache {operation} failed, using the in-process tier for {CACHE_SHARED_RETRY_SECONDS:.0f}s: {e}")
+            return None
+
+    def _count(self, namespace, result):
+        cache_requests.inc(namespace=namespace, result=result)
+        with self._stats_lock:
+            counts = self._stats.setdefault(namespace, {'local_hit': 0, 'shared_hit': 0, 'miss': 0})
+            counts[result] += 1
+
+    def get(self, namespace, key, ttl):
+        """Cached value or _MISSING, trying the in-process tier first."""
+        if not self.enabled:
+            return _MISSING
+        full_key = self.full_key(namespace, key)
+        blob = self.local.get(full_key)
+        if blob is not None:
+            self._count(namespace, 'local_hit')
+            return decode_value(blob)
+        value, _ = self._shared_value(namespace, full_key, ttl)
+        if value is not _MISSING:
+            self._count(namespace, 'shared_hit')
+            return value
+        self._count(namespace, 'miss')
+        return _MISSING
+
+    def _shared_value(self, namespace, full_key, ttl):
+        """(value, blob) of a shared-tier entry, copied into the in-process tier; value is _MISSING if absent or unreadable."""
+        blob = self._shared('get', full_key)
+        if blob is None:
+            return _MISSING, None
+        value = decode_value(blob)
+        if value is not _MISSING:
+            self.local.set(full_key, namespace, blob, min(ttl, self.local_max_ttl))
+        return value, blob
+
+    def set(self, namespace, key, value, ttl):
+        """Store value in both tiers (values that need a signing key the workers lack stay local); returns its encoded form."""
+        if not self.enabled:
+            return None
+        full_key = self.full_key(namespace, key)
+        blob, shareable = encode_value(value)
+        shared = self.shared is not None and shareable
+        self.local.set(full_key, namespace, blob, min(ttl, self.local_max_ttl) if shared else ttl)
+        if shared:
+            self._shared('set', full_key, namespace, blob, ttl)
+        return blob
+
+    def delete(self, namespace, key):
+        full_key = self.full_key(namespace, key)
+        self.local.delete(full_key)
+        self._shared('delete', full_key)
+
+    def clear(self, namespace):
+        """Drop a namespace here and in the shared tier; other workers drop their copies within local_max_ttl."""
+        self.local.clear(namespace)
+        self._shared('clear', namespace)
+
+    def get_or_compute(self, namespace, key, compute, ttl):
+        """Cached value, or compute() run once across threads and processes and stored for ttl seconds."""
+        value = self.get(namespace, key, ttl)
+        if value is not _MISSING:
+            return value
+        if not self.enabled:
+            return compute()
+
+        full_key = self.full_key(namespace, key)
+        with self._flights_lock:
+            flight = self._flights.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[full_key] = _Flight()
+        if not leader:
+            cache_waits.inc(namespace=namespace, scope='thread')
+            flight.done.wait(self.lock_timeout)
+            if flight.blob is not None:
+                # Every caller gets its own copy, as on a cache hit
+                value = decode_value(flight.blob)
+                if value is not _MISSING:
+                    return value
+            # The computing thread failed or is too slow; compute without waiting again
+            return compute()
+
+        try:
+            value, flight.blob = self._compute_once(namespace, key, full_key, compute, ttl)
+            return value
+        finally:
+            with self._flights_lock:
+                self._flights.pop(full_key, None)
+            flight.done.set()
+
+    def _compute_once(self, namespace, key, full_key, compute, ttl):
+        """Compute under a shared lock, or wait for the process that holds it to store the value; returns (value, blob)."""
+        lock_key = f"{CACHE_KEY_PREFIX}lock:{full_key[len(CACHE_KEY_PREFIX):]}"
+        token = uuid.uuid4().hex.encode()
+        deadline = time.time() + self.lock_timeout
+        waited = False
+        locked = False
+        while self.shared is not None and time.time() < deadline:
+            # A holder that dies leaves the lock to expire after lock_timeout; a failing tier means no lock
+            acquired = self._shared('add', lock_key, 'lock', token, self.lock_timeout)
+            if acquired is not False:
+                locked = bool(acquired)
+                break
+            if not waited:
+                cache_waits.inc(namespace=namespace, scope='process')
+                waited = True
+            time.sleep(LOCK_POLL_SECONDS)
+            value, blob = self._shared_value(namespace, full_key, ttl)
+            if value is not _MISSING:
+                return value, blob
+
+        started = time.perf_counter()
+        try:
+            with span("cache.compute", namespace=namespace):
+                value = compute()
+            cache_compute.observe(time.perf_counter() - started, namespace=namespace)
+            return value, self.set(namespace, key, value, ttl)
+        finally:
+            if locked:
+                # The lock may have expired during a slow compute and been taken by another process
+                self._shared('release', lock_key, token)
+
+    def stats(self, include_shared=True):
+        """Per-namespace lookups and hit rate in this process, plus the sizes of both tiers."""
+        with self._stats_lock:
+            lookups = {namespace: dict(counts) for namespace, counts in self._stats.items()}
+        local = self.local.stats()
+        shared = (self._shared('stats') or {}) if include_shared else {}
+        # Single-flight locks are stored next to the entries
+        shared.pop('lock', None)
+        namespaces = {}
+        for name in sorted(set(lookups) | set(local) | set(shared) | set(self._namespaces)):
+            counts = lookups.get(name, {'local_hit': 0, 'shared_hit': 0, 'miss': 0})
+            total = sum(counts.values())
+            namespaces[name] = {
+                'ttl': self._namespaces[name].ttl if name in self._namespaces else None,
+                'lookups': counts,
+                'hit_rate': round((counts['local_hit'] + counts['shared_hit']) / total, 4) if total else None,
+                'local': local.get(name, {'entries': 0, 'bytes': 0}),
+                'shared': shared.get(name) if self.shared is not None else None,
+            }
+        return {
+            'shared_tier': type(self.shared).__name__ if self.shared is not None else None,
+            'local_bytes': self.local.bytes,
+            'local_max_bytes': self.local.max_bytes,
+            'namespaces': namespaces,
+        }
+
+
+class CacheNamespace:
+    """The entries of one namespace, with its TTL bound in."""
+
+    def __init__(self, cache, name, ttl):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        value = self.cache.get(self.name, key, self.ttl)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        self.cache.set(self.name, key, value, self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(self.name, key)
+
+    def get_or_compute(self, key, compute):
+        return self.cache.get_or_compute(self.name, key, compute, self.ttl)
+
+    def clear(self):
+        self.cache.clear(self.name)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide SharedCache on CACHE_SHARED_URL; falls back to the in-process tier if it cannot be opened."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    shared = open_shared_tier() if CACHE_ENABLED else None
+                except Exception as e:
+                    print(f"Shared cache unavailable, using the in-process tier only: {e}")
+                    shared = None
+                _cache = SharedCache(shared)
+    return _cache
+
+
+def add_cache_endpoints(app, cache):
+    """Register GET /cache/stats and DELETE /cache/<namespace>."""
+    from flask import jsonify, request
+
+    @app.route('/cache/stats', methods=['GET'])
+    def cache_stats():
+        try:
+            return jsonify(cache.stats(include_shared=request.args.get('shared', '1') != '0'))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/cache/<namespace>', methods=['DELETE'])
+    def clear_cache(namespace):
+        cache.clear(namespace)
+        return jsonify({'cleared': namespace})
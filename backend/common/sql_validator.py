@@ -0,0 +1,288 @@
+"""Local validation of generated SQL, with a bounded repair loop
+
+A candidate query goes through three checks, cheapest first:
+    parse    sqlglot parses it for the target dialect (errors carry line/column)
+    catalog  every table and column resolves against the cached catalog
+    explain  Trino EXPLAIN (TYPE VALIDATE) analyzes it without planning or running it
+The first failing check's errors are fed back to the LLM for a targeted fix,
+at most SQL_REPAIR_MAX_ATTEMPTS times. Every query repaired here, or withheld
+from execution because it failed (see tiered_generation), is a round trip
+through /execute that would otherwise have failed.
+"""
+
+import difflib
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import OptimizeError, SqlglotError
+from sqlglot.optimizer.qualify import qualify
+
+from catalog_metadata import TRINO_CONFIG, get_catalog
+from telemetry import Counter, register, current_span, span
+
+# Repair requests sent back to the LLM after the first candidate fails validation
+SQL_REPAIR_MAX_ATTEMPTS = int(os.getenv("SQL_REPAIR_MAX_ATTEMPTS", "2"))
+
+# Dry-run Trino queries with EXPLAIN (TYPE VALIDATE); skipped whenever Trino is unreachable
+SQL_VALIDATE_EXPLAIN = os.getenv("SQL_VALIDATE_EXPLAIN", "1") == "1"
+
+# Seconds to wait for the dry run, and to wait before retrying after Trino was unreachable
+SQL_EXPLAIN_TIMEOUT = float(os.getenv("SQL_EXPLAIN_TIMEOUT", "10"))
+SQL_EXPLAIN_RETRY_SECONDS = float(os.getenv("SQL_EXPLAIN_RETRY_SECONDS", "60"))
+
+CHECKS = ("parse", "catalog", "explain")
+
+# Statements a generated query may be; anything else (prose parsed as a column, Command fallbacks) fails to parse
+STATEMENT_TYPES = (exp.Query, exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter)
+
+validations = register(Counter(
+    "sql_validation_checks_total", "Validation checks run on generated SQL, by check and result.", ("dialect", "check", "result")
+))
+generations = register(Counter(
+    "sql_validated_generations_total", "Generated queries by final outcome (valid, repaired, invalid).", ("dialect", "outcome")
+))
+repair_attempts = register(Counter(
+    "sql_repair_attempts_total", "Repair requests sent to the LLM, by whether the repaired query validated.", ("dialect", "result")
+))
+round_trips_saved = register(Counter(
+    "sql_execution_round_trips_saved_total",
+    "Queries that failed validation and were repaired or withheld from execution, by the check that first caught them.",
+    ("dialect", "check")
+))
+
+
+class ValidationResult:
+    """Outcome of validating one query."""
+
+    def __init__(self, sql, valid, check=None, errors=None, checks=None):
+        self.sql = sql
+        self.valid = valid
+        self.check = check  # the check that failed, if any
+        self.errors = errors or []
+        self.checks = checks or {}
+
+    def to_dict(self):
+        return {'valid': self.valid, 'failed_check': self.check, 'errors': self.errors, 'checks': self.checks}
+
+
+class RepairResult:
+    """Final response of a validate-and-repair loop."""
+
+    def __init__(self, response, sql, validation, attempts, history):
+        self.response = response
+        self.sql = sql
+        self.validation = validation
+        self.attempts = attempts
+        self.history = history
+
+    @property
+    def repaired(self):
+        return self.validation.valid and self.attempts > 0
+
+    def to_dict(self):
+        return dict(self.validation.to_dict(), repair_attempts=self.attempts, repaired=self.repaired, history=self.history)
+
+
+def extract_sql(response: str) -> str:
+    """The SQL after QUERY: in a TRINO_SQL style response, without markdown fences."""
+    match = re.search(r"QUERY:\s*(.*?)(?=EXPLANATION:|OPTIMIZATIONS:|$)", response, re.DOTALL)
+    sql = match.group(1) if match else response
+    fenced = re.search(r"```(?:sql)?\s*(.*?)```", sql, re.DOTALL | re.IGNORECASE)
+    if fenced:
+        sql = fenced.group(1)
+    return sql.strip().rstrip(";").strip()
+
+
+def replace_sql(response: str, sql: str) -> str:
+    """The response with its QUERY: block replaced by sql, keeping the explanation that follows."""
+    match = re.search(r"(QUERY:\s*)(.*?)(?=EXPLANATION:|OPTIMIZATIONS:|$)", response, re.DOTALL)
+    if not match:
+        return f"QUERY:\n{sql}\n"
+    return f"{response[:match.start(2)]}{sql}\n\n{response[match.end(2):]}"
+
+
+def _parse(sql, dialect):
+    try:
+        trees = [tree for tree in sqlglot.parse(sql, read=dialect) if tree is not None]
+    except SqlglotError as e:
+        # ParseError carries located errors; TokenError (e.g. an unterminated string) only a message
+        errors = []
+        for error in getattr(e, 'errors', None) or [{'description': str(e)}]:
+            location = f" at line {error['line']}, col {error['col']}" if error.get('line') else ""
+            near = f" near '{error['highlight']}'" if error.get('highlight') else ""
+            errors.append(f"Syntax error{location}: {error['description']}{near}")
+        return None, errors
+    if not trees:
+        return None, ["No SQL statement found"]
+    if len(trees) > 1:
+        return None, [f"Expected a single statement, found {len(trees)}"]
+    tree = trees[0]
+    if not isinstance(tree, STATEMENT_TYPES) or tree.find(exp.Command):
+        # sqlglot reads stray words as a column or alias, and unknown syntax as an opaque Command
+        return None, [f"Not a SQL query: expected a statement such as SELECT or WITH, got '{sql[:80]}'"]
+    return tree, []
+
+
+def _local_schema(table, schema_name):
+    """True when a table reference points at the catalog's own schema (or is unqualified)."""
+    qualifier = ".".join(part for part in (table.catalog, table.db) if part).lower()
+    return not qualifier or schema_name.lower().endswith(qualifier) or qualifier.endswith(schema_name.lower())
+
+
+def _check_catalog(tree, tables, schema_name):
+    """Unknown tables and columns, with close matches as suggestions. None when the check does not apply."""
+    known = {name.lower(): name for name in tables}
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    references = [table for table in tree.find_all(exp.Table) if table.name and table.name.lower() not in ctes]
+    if not references or not all(_local_schema(table, schema_name) for table in references):
+        # Cross-catalog queries (e.g. hive joined to mysql) cannot be checked against one schema
+        return None
+    errors = []
+    for table in references:
+        if table.name.lower() not in known:
+            suggestion = difflib.get_close_matches(table.name.lower(), known, n=1)
+            hint = f"; did you mean {known[suggestion[0]]}?" if suggestion else f"; available tables: {', '.join(sorted(tables))}"
+            errors.append(f"Table {table.name} does not exist in {schema_name}{hint}")
+    if errors:
+        return errors
+
+    copy = tree.copy()
+    for table in copy.find_all(exp.Table):
+        table.set('catalog', None)
+        table.set('db', None)
+    mapping = {name: {column: "UNKNOWN" for column, _ in columns} for name, columns in tables.items()}
+    try:
+        qualify(copy, schema=mapping, dialect="trino", validate_qualify_columns=True, quote_identifiers=False)
+    except OptimizeError as e:
+        message = str(e)
+        column = re.search(r"[Cc]olumn:? '?(\w+)'?", message)
+        if column:
+            columns = {c for table in references for c, _ in tables[known[table.name.lower()]]}
+            suggestion = difflib.get_close_matches(column.group(1), columns, n=1)
+            if suggestion:
+                message += f"; did you mean {suggestion[0]}?"
+        return [message]
+    except Exception:
+        return None
+    return []
+
+
+class TrinoDryRun:
+    """EXPLAIN (TYPE VALIDATE) against Trino, backing off while the coordinator is unreachable."""
+
+    def __init__(self, config=TRINO_CONFIG, timeout=SQL_EXPLAIN_TIMEOUT, retry_seconds=SQL_EXPLAIN_RETRY_SECONDS):
+        self.config = config
+        self.timeout = timeout
+        self.retry_seconds = retry_seconds
+        self._unavailable_until = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, sql):
+        """Errors reported by Trino for sql, or None if the dry run could not be made."""
+        if time.time() < self._unavailable_until:
+            return None
+        try:
+            import trino
+            from trino.exceptions import TrinoUserError
+        except ImportError:
+            return None
+        try:
+            conn = trino.dbapi.connect(**self.config, request_timeout=self.timeout)
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"EXPLAIN (TYPE VALIDATE) {sql}")
+                cursor.fetchall()
+            finally:
+                conn.close()
+        except TrinoUserError as e:
+            location = e.error_location
+            where = f" at line {location[0]}, col {location[1]}" if location else ""
+            return [f"{e.error_name}{where}: {e.message}"]
+        except Exception as e:
+            print(f"Trino dry run unavailable, skipping for {self.retry_seconds:.0f}s: {e}")
+            with self._lock:
+                self._unavailable_until = time.time() + self.retry_seconds
+            return None
+        return []
+
+
+trino_dry_run = TrinoDryRun()
+
+
+def validate_sql(sql: str, dialect: str = "trino", tables: Optional[Dict] = None,
+                 explain: Optional[Callable[[str], Optional[List[str]]]] = None) -> ValidationResult:
+    """Run the parse, catalog and explain checks, stopping at the first one that fails.
+
+    tables defaults to the cached catalog and explain to the Trino dry run (for the
+    trino dialect when SQL_VALIDATE_EXPLAIN is set); a check that cannot run is skipped.
+    """
+    checks = {}
+
+    def finish(check, errors):
+        result = "error" if errors else ("skipped" if errors is None else "ok")
+        checks[check] = result
+        validations.inc(dialect=dialect, check=check, result=result)
+        if errors:
+            return ValidationResult(sql, False, check, errors, checks)
+        return None
+
+    with span("sql.validate", dialect=dialect) as validate_span:
+        tree, errors = _parse(sql, dialect)
+        failed = finish("parse", errors)
+        if failed is None:
+            if tables is None:
+                try:
+                    catalog = get_catalog()
+                    tables, schema_name = catalog.tables(), catalog.schema_name
+                except Exception as e:
+                    print(f"Catalog unavailable for SQL validation: {e}")
+                    tables, schema_name = None, ""
+            else:
+                schema_name = TRINO_CONFIG['schema']
+            failed = finish("catalog", _check_catalog(tree, tables, schema_name) if tables else None)
+        if failed is None:
+            if explain is None and dialect == "trino" and SQL_VALIDATE_EXPLAIN:
+                explain = trino_dry_run
+            failed = finish("explain", explain(sql) if explain else None)
+        result = failed or ValidationResult(sql, True, checks=checks)
+        validate_span.set_attribute("valid", result.valid)
+        if not result.valid:
+            validate_span.set_attribute("failed_check", result.check)
+        return result
+
+
+def validate_and_repair(response: str, repair: Callable[[str, List[str]], str], dialect: str = "trino",
+                        max_attempts: int = SQL_REPAIR_MAX_ATTEMPTS, **validate_kwargs) -> RepairResult:
+    """Validate the SQL in an LLM response; while it fails, ask repair(sql, errors) for a new response.
+
+    Returns the original response with its query replaced by the last candidate,
+    which is the first valid one or, after max_attempts repairs, the last invalid one.
+    """
+    sql = extract_sql(response)
+    validation = validate_sql(sql, dialect, **validate_kwargs)
+    history = []
+    attempts = 0
+    while not validation.valid and attempts < max_attempts:
+        attempts += 1
+        history.append({'sql': sql, 'failed_check': validation.check, 'errors': validation.errors})
+        with span("sql.repair", attempt=attempts, failed_check=validation.check):
+            sql = extract_sql(repair(sql, validation.errors))
+        validation = validate_sql(sql, dialect, **validate_kwargs)
+        repair_attempts.inc(dialect=dialect, result="valid" if validation.valid else "invalid")
+
+    outcome = "invalid" if not validation.valid else ("repaired" if attempts else "valid")
+    generations.inc(dialect=dialect, outcome=outcome)
+    if outcome == "repaired":
+        round_trips_saved.inc(dialect=dialect, check=history[0]['failed_check'])
+    current = current_span()
+    if current is not None:
+        current.set_attribute("sql.outcome", outcome)
+        current.set_attribute("sql.repair_attempts", attempts)
+    if attempts:
+        response = replace_sql(response, sql)
+    return RepairResult(response, sql, validation, attempts, history)
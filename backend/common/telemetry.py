@@ -0,0 +1,377 @@
+"""Lightweight tracing spans, latency histograms and token counters shared by the Flask services"""
+
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueListener, RotatingFileHandler
+
+# console | file | both | none
+TELEMETRY_EXPORTER = os.getenv("TELEMETRY_EXPORTER", "none")
+# Span log for the file exporter; relative paths are resolved once, at import
+TELEMETRY_FILE = os.path.abspath(os.getenv("TELEMETRY_FILE", os.path.join(tempfile.gettempdir(), "telemetry_spans.jsonl")))
+# Size at which the span log is rotated, and how many rotated files are kept
+TELEMETRY_FILE_MAX_BYTES = int(os.getenv("TELEMETRY_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+TELEMETRY_FILE_BACKUPS = int(os.getenv("TELEMETRY_FILE_BACKUPS", "3"))
+# Spans waiting for the background writer; further spans are dropped while it is full
+TELEMETRY_QUEUE_SIZE = int(os.getenv("TELEMETRY_QUEUE_SIZE", "10000"))
+TELEMETRY_SERVICE_NAME = os.getenv("TELEMETRY_SERVICE_NAME", "")
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_service_name = TELEMETRY_SERVICE_NAME or "unknown"
+
+
+def set_service_name(name):
+    """Name attached to every span and metric from this process."""
+    global _service_name
+    _service_name = TELEMETRY_SERVICE_NAME or name
+
+
+class Span:
+    """A timed operation in a trace, shaped like an OpenTelemetry span."""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.error = None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self._start) * 1000, 3)
+
+    def end(self):
+        self.duration_ms = self.elapsed_ms()
+
+    def to_dict(self):
+        return {
+            'service': _service_name,
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class SpanExporter:
+    """Writes finished spans as JSON lines to stderr and/or a rotating file.
+
+    File writes go through a bounded queue drained by a background thread, so a
+    request never waits on disk; spans that do not fit are counted and dropped.
+    """
+
+    def __init__(self, mode=TELEMETRY_EXPORTER, path=TELEMETRY_FILE, max_bytes=TELEMETRY_FILE_MAX_BYTES,
+                 backups=TELEMETRY_FILE_BACKUPS, queue_size=TELEMETRY_QUEUE_SIZE):
+        self.mode = mode
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._listener = None
+        self._pid = None
+
+    def _file_queue(self):
+        """Queue feeding the writer thread, started on first use and again after a fork."""
+        if self._pid == os.getpid():
+            return self._queue
+        with self._lock:
+            if self._pid != os.getpid():
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups,
+                                              encoding="utf-8", delay=True)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._queue = queue.Queue(self.queue_size)
+                self._listener = QueueListener(self._queue, handler)
+                self._listener.start()
+                self._pid = os.getpid()
+                atexit.register(self.close)
+        return self._queue
+
+    def export(self, span):
+        if self.mode == "none":
+            return
+        line = json.dumps(span.to_dict(), default=str)
+        if self.mode in ("console", "both"):
+            with self._lock:
+                print(line, file=sys.stderr)
+        if self.mode in ("file", "both"):
+            try:
+                self._file_queue().put_nowait(logging.makeLogRecord({'msg': line}))
+            except queue.Full:
+                self.dropped += 1
+
+    def close(self):
+        """Write out queued spans and stop the writer thread."""
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None and self._pid == os.getpid():
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+
+
+exporter = SpanExporter()
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = _labels(self.label_names, key)
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series['sum']}")
+                lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by label values."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_labels(self.label_names, key)}}} {value}")
+        return lines
+
+
+class Gauge:
+    """Last-set value keyed by label values."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_labels(self.label_names, key)}}} {value}")
+        return lines
+
+
+def _labels(names, values):
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+stage_latency = Histogram(
+    "stage_duration_seconds", "Latency of instrumented pipeline stages.", ("service", "stage", "status")
+)
+llm_tokens = Counter("llm_tokens_total", "Tokens used by LLM calls.", ("service", "model", "kind"))
+llm_calls = Counter("llm_calls_total", "LLM calls made.", ("service", "model", "status"))
+# Extra metrics registered by other modules are rendered after the built-in ones
+_registry = [stage_latency, llm_tokens, llm_calls]
+
+
+def register(metric):
+    """Add a Histogram, Counter or Gauge to the /metrics output."""
+    _registry.append(metric)
+    return metric
+
+
+# Callables handed every finished span, e.g. to collect one trace's stages
+_span_listeners = []
+
+
+def add_span_listener(listener):
+    _span_listeners.append(listener)
+    return listener
+
+
+def remove_span_listener(listener):
+    _span_listeners.remove(listener)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a stage as a child of the current span and record it in the latency histogram."""
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+        stage_latency.observe(current.duration_ms / 1000, service=_service_name, stage=name, status=current.status)
+        exporter.export(current)
+        for listener in list(_span_listeners):
+            listener(current)
+
+
+def traced(name):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    return _current_span.get()
+
+
+def bind_context(fn):
+    """Carry the current trace into a worker thread (e.g. ThreadPoolExecutor.submit)."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return wrapper
+
+
+def _field(obj, key):
+    return obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
+
+
+def record_tokens(model, usage):
+    """Count prompt/completion tokens from an OpenAI-style usage object or dict."""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = _field(usage, kind)
+        if value:
+            llm_tokens.inc(value, service=_service_name, model=model, kind=kind.replace("_tokens", ""))
+    # Prompt tokens served from the provider's prefix cache, when reported
+    details = _field(usage, "prompt_tokens_details")
+    cached = _field(details, "cached_tokens") if details else None
+    if cached:
+        llm_tokens.inc(cached, service=_service_name, model=model, kind="cached_prompt")
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute("llm.prompt_tokens", _field(usage, "prompt_tokens"))
+        current.set_attribute("llm.completion_tokens", _field(usage, "completion_tokens"))
+        if cached:
+            current.set_attribute("llm.cached_prompt_tokens", cached)
+
+
+def record_llm_call(model, status="ok"):
+    llm_calls.inc(service=_service_name, model=model, status=status)
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def instrument_app(app, service_name):
+    """Trace every request of a Flask app and expose GET /metrics."""
+    from flask import Response, g, request
+
+    set_service_name(service_name)
+
+    @app.before_request
+    def _start_request_span():
+        if request.path == "/metrics":
+            return
+        g.telemetry_span = span(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+        g.telemetry_span_obj = g.telemetry_span.__enter__()
+
+    @app.teardown_request
+    def _end_request_span(error=None):
+        manager = g.pop("telemetry_span", None)
+        if manager is None:
+            return
+        span_obj = g.pop("telemetry_span_obj")
+        if error is not None:
+            span_obj.status = "error"
+            span_obj.error = f"{type(error).__name__}: {error}"
+        manager.__exit__(None, None, None)
+
+    @app.after_request
+    def _tag_response(response):
+        span_obj = g.get("telemetry_span_obj")
+        if span_obj is not None:
+            span_obj.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span_obj.status = "error"
+            response.headers["X-Trace-Id"] = span_obj.trace_id
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+    return app
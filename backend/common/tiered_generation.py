@@ -0,0 +1,274 @@
+"""Small-model-first SQL generation with escalation to the large model
+
+The draft model answers first. Its SQL is validated locally (sql_validator:
+parse, catalog resolution, optional Trino EXPLAIN) and returned when it passes,
+the model's self-rated confidence is high enough and the query is not
+structurally complex. Anything else is regenerated by the escalation model,
+whose answer goes through the usual validate-and-repair loop. Per-tier latency
+and cost, the escalation rate and the savings against sending every request
+to the escalation model are kept for /metrics and stats().
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+import sqlglot
+from sqlglot import exp
+
+from llm_gateway import LLMError, get_gateway
+from prompts import TRINO_SQL, TRINO_SQL_DRAFT, REPAIR_SQL
+from sql_validator import extract_sql, round_trips_saved, validate_sql, validate_and_repair
+from telemetry import Counter, Histogram, register, span
+
+SQL_DRAFT_MODEL = os.getenv("SQL_DRAFT_MODEL", "llama-3.1-8b-instant")
+SQL_ESCALATION_MODEL = os.getenv("SQL_ESCALATION_MODEL", "llama-3.3-70b-versatile")
+
+# Drafts rating themselves below this escalate; drafts that omit the rating are judged on validation alone
+SQL_DRAFT_MIN_CONFIDENCE = float(os.getenv("SQL_DRAFT_MIN_CONFIDENCE", "0.6"))
+
+# Drafts whose structural complexity (see sql_complexity) exceeds this escalate
+SQL_DRAFT_MAX_COMPLEXITY = int(os.getenv("SQL_DRAFT_MAX_COMPLEXITY", "6"))
+
+# USD per million input/output tokens, for the cost report; override or extend with LLM_MODEL_PRICES
+MODEL_PRICES = {
+    'llama-3.1-8b-instant': {'input': 0.05, 'output': 0.08},
+    'llama-3.3-70b-versatile': {'input': 0.59, 'output': 0.79},
+}
+MODEL_PRICES.update(json.loads(os.getenv("LLM_MODEL_PRICES", "{}")))
+
+tier_requests = register(Counter(
+    "sql_tier_requests_total", "Tiered SQL generations by the tier that served them and why.", ("tier", "reason")
+))
+tier_latency = register(Histogram(
+    "sql_tier_latency_seconds", "End-to-end tiered SQL generation latency by serving tier.", ("tier",)
+))
+tier_cost = register(Counter("sql_tier_cost_usd_total", "Estimated LLM cost of tiered SQL generation by serving tier.", ("tier",)))
+tier_saved = register(Counter(
+    "sql_tier_saved_total", "Estimated cost and latency saved by draft answers against always using the escalation model.", ("unit",)
+))
+tier_wasted = register(Counter(
+    "sql_tier_wasted_total", "Estimated cost and latency spent on drafts that were escalated or slower than escalating.", ("unit",)
+))
+
+
+def cost_usd(model, usage):
+    """Estimated price of one call from its reported token usage."""
+    prices = MODEL_PRICES.get(model)
+    if not prices or not usage:
+        return 0.0
+    return ((usage.get('prompt_tokens') or 0) * prices['input'] + (usage.get('completion_tokens') or 0) * prices['output']) / 1e6
+
+
+def sql_complexity(tree):
+    """Rough structural complexity: one point per join, CTE or set operation, two per subquery, window, UNNEST or lambda."""
+    simple = (exp.Join, exp.CTE, exp.Union, exp.Intersect, exp.Except)
+    involved = (exp.Subquery, exp.Window, exp.Unnest, exp.Lambda)
+    return sum(1 for _ in tree.find_all(*simple)) + 2 * sum(1 for _ in tree.find_all(*involved))
+
+
+def add_usage(total, usage):
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        total[kind] = total.get(kind, 0) + ((usage or {}).get(kind) or 0)
+    return total
+
+
+def split_confidence(response):
+    """The response without its trailing CONFIDENCE line, and the rating (None when missing)."""
+    match = re.search(r"\n?\s*CONFIDENCE:\s*([0-9]*\.?[0-9]+)\s*$", response)
+    if not match:
+        return response, None
+    return response[:match.start()].rstrip(), min(1.0, float(match.group(1)))
+
+
+class TieredResult:
+    """The served response plus how it was produced."""
+
+    def __init__(self, response, sql, tier, reason, validation, draft, latency_ms, cost, usage):
+        self.response = response
+        self.sql = sql
+        self.tier = tier
+        self.reason = reason
+        self.validation = validation
+        self.draft = draft
+        self.latency_ms = latency_ms
+        self.cost_usd = cost
+        self.usage = usage  # tokens summed over every call made for this request
+
+    def to_dict(self):
+        return {
+            'tier': self.tier,
+            'reason': self.reason,
+            'draft': self.draft,
+            'latency_ms': self.latency_ms,
+            'cost_usd': round(self.cost_usd, 6),
+            'usage': self.usage,
+        }
+
+
+class TieredSQLGenerator:
+    """Drafts with the small model and escalates failed or doubtful drafts to the large one."""
+
+    def __init__(self, gateway=None, draft_model=SQL_DRAFT_MODEL, escalation_model=SQL_ESCALATION_MODEL,
+                 min_confidence=SQL_DRAFT_MIN_CONFIDENCE, max_complexity=SQL_DRAFT_MAX_COMPLEXITY, dialect="trino"):
+        self.gateway = gateway or get_gateway()
+        self.draft_model = draft_model
+        self.escalation_model = escalation_model
+        self.min_confidence = min_confidence
+        self.max_complexity = max_complexity
+        self.dialect = dialect
+        self._lock = threading.Lock()
+        self._tiers = {tier: {'requests': 0, 'latency_ms': 0.0, 'cost_usd': 0.0} for tier in ("draft", "escalation")}
+        self._reasons = {}
+        self._savings = {'cost_usd': 0.0, 'latency_ms': 0.0}
+
+    def _draft(self, question, schema, context, examples, validate_kwargs):
+        """Draft response, its validation and the reason to escalate it (None to accept)."""
+        draft = {'model': self.draft_model}
+        try:
+            result = self.gateway.chat(
+                TRINO_SQL_DRAFT.messages(schema=schema, context=context, examples=examples, question=question),
+                model=self.draft_model,
+                stage="llm.generate_sql.draft",
+                max_tokens=2000,
+                temperature=0.2,
+                fallback=False,
+            )
+        except LLMError as e:
+            print(f"Draft model failed, escalating: {e}")
+            return None, None, dict(draft, error=str(e)), "draft_error"
+        response, confidence = split_confidence(result.content)
+        draft.update(usage=result.usage, latency_ms=result.latency_ms, confidence=confidence, cost_usd=cost_usd(result.model, result.usage))
+        validation = validate_sql(extract_sql(response), self.dialect, **validate_kwargs)
+        draft['validation'] = validation.to_dict()
+        if not validation.valid:
+            return response, validation, draft, f"invalid_{validation.check}"
+        if confidence is not None and confidence < self.min_confidence:
+            return response, validation, draft, "low_confidence"
+        draft['complexity'] = sql_complexity(sqlglot.parse_one(validation.sql, read=self.dialect))
+        if draft['complexity'] > self.max_complexity:
+            return response, validation, draft, "complex"
+        return response, validation, draft, None
+
+    def _escalate(self, question, schema, context, examples, validate_kwargs):
+        # No gateway fallback: it would answer with the draft-sized model while reporting an escalation
+        result = self.gateway.chat(
+            TRINO_SQL.messages(schema=schema, context=context, examples=examples, question=question),
+            model=self.escalation_model,
+            stage="llm.generate_sql.escalation",
+            max_tokens=2000,
+            temperature=0.3,
+            fallback=False,
+        )
+        cost = cost_usd(result.model, result.usage)
+        usage = add_usage({}, result.usage)
+
+        def repair(sql, errors):
+            nonlocal cost
+            repaired = self.gateway.chat(
+                REPAIR_SQL.messages(schema=schema, question=question, sql=sql, errors="\n".join(f"- {error}" for error in errors)),
+                model=self.escalation_model,
+                stage="llm.repair_sql",
+                max_tokens=1000,
+                temperature=0.0,
+                fallback=False,
+            )
+            cost += cost_usd(repaired.model, repaired.usage)
+            add_usage(usage, repaired.usage)
+            return repaired.content
+
+        return validate_and_repair(result.content, repair, self.dialect, **validate_kwargs), cost, usage
+
+    def generate(self, question, schema, context, examples="None", **validate_kwargs):
+        """Generate a validated query for question, drafting first; validate_kwargs go to validate_sql.
+
+        examples is the few-shot block for the prompt (see query_history.format_examples).
+        """
+        started = time.perf_counter()
+        with span("sql.tiered_generation", draft_model=self.draft_model) as tier_span:
+            with span("sql.tier.draft"):
+                response, validation, draft, reason = self._draft(question, schema, context, examples, validate_kwargs)
+            draft_ms = (time.perf_counter() - started) * 1000
+            draft_cost = draft.get('cost_usd', 0.0)
+            usage = add_usage({}, draft.get('usage'))
+            if reason is None:
+                served = TieredResult(response, validation.sql, "draft", "accepted", validation.to_dict(),
+                                      draft, round(draft_ms, 1), draft_cost, usage)
+            else:
+                if validation is not None and not validation.valid:
+                    # The failing draft is withheld instead of being sent to /execute
+                    round_trips_saved.inc(dialect=self.dialect, check=validation.check)
+                try:
+                    with span("sql.tier.escalation", reason=reason):
+                        checked, escalation_cost, escalation_usage = self._escalate(question, schema, context, examples, validate_kwargs)
+                except LLMError as e:
+                    if validation is None or not validation.valid:
+                        raise
+                    # A valid but doubtful draft beats no answer while the escalation model is unavailable
+                    print(f"Escalation model failed, serving the draft: {e}")
+                    served = TieredResult(response, validation.sql, "draft", "escalation_unavailable", validation.to_dict(),
+                                          draft, round((time.perf_counter() - started) * 1000, 1), draft_cost, usage)
+                else:
+                    served = TieredResult(checked.response, checked.sql, "escalation", reason, checked.to_dict(), draft,
+                                          round((time.perf_counter() - started) * 1000, 1), draft_cost + escalation_cost,
+                                          add_usage(usage, escalation_usage))
+            tier_span.set_attribute("tier", served.tier)
+            tier_span.set_attribute("reason", served.reason)
+        self._record(served, draft, draft_ms)
+        return served
+
+    def _record(self, served, draft, draft_ms):
+        tier_requests.inc(tier=served.tier, reason=served.reason)
+        tier_latency.observe(served.latency_ms / 1000, tier=served.tier)
+        tier_cost.inc(served.cost_usd, tier=served.tier)
+        with self._lock:
+            totals = self._tiers[served.tier]
+            totals['requests'] += 1
+            totals['latency_ms'] += served.latency_ms
+            totals['cost_usd'] += served.cost_usd
+            self._reasons[served.reason] = self._reasons.get(served.reason, 0) + 1
+            if served.tier == "draft":
+                # The same prompt and answer priced at the escalation model; latency from escalations seen so far
+                saved_cost = cost_usd(self.escalation_model, draft.get('usage')) - served.cost_usd
+                escalations = self._tiers['escalation']
+                average_escalation_ms = (escalations['latency_ms'] / escalations['requests']) if escalations['requests'] else None
+                saved_ms = (average_escalation_ms - draft_ms) if average_escalation_ms is not None else 0.0
+            else:
+                # The draft was wasted work
+                saved_cost, saved_ms = -draft.get('cost_usd', 0.0), -draft_ms
+            self._savings['cost_usd'] += saved_cost
+            self._savings['latency_ms'] += saved_ms
+        # Counters only go up, so net savings are split into saved and wasted series
+        for amount, unit in ((saved_cost, "cost_usd"), (saved_ms / 1000, "latency_seconds")):
+            if amount > 0:
+                tier_saved.inc(amount, unit=unit)
+            elif amount < 0:
+                tier_wasted.inc(-amount, unit=unit)
+
+    def stats(self):
+        """Escalation rate, per-tier request counts, mean latency and cost, and estimated savings."""
+        with self._lock:
+            total = sum(tier['requests'] for tier in self._tiers.values())
+            tiers = {
+                name: {
+                    'requests': tier['requests'],
+                    'mean_latency_ms': round(tier['latency_ms'] / tier['requests'], 1) if tier['requests'] else None,
+                    'mean_cost_usd': round(tier['cost_usd'] / tier['requests'], 6) if tier['requests'] else None,
+                    'cost_usd': round(tier['cost_usd'], 6),
+                }
+                for name, tier in self._tiers.items()
+            }
+            return {
+                'draft_model': self.draft_model,
+                'escalation_model': self.escalation_model,
+                'requests': total,
+                'escalation_rate': round(self._tiers['escalation']['requests'] / total, 4) if total else None,
+                'reasons': dict(self._reasons),
+                'tiers': tiers,
+                'estimated_savings': {
+                    'cost_usd': round(self._savings['cost_usd'], 6),
+                    'latency_ms': round(self._savings['latency_ms'], 1),
+                },
+            }
@@ -0,0 +1,53 @@
+"""Optional warm-up of lazily loaded dependencies, exposed as POST /warmup
+
+Services import drivers and load models on first use so a process is ready
+to serve as soon as Flask is up. A load balancer or deploy hook can then call
+POST /warmup (optionally {"targets": [...]}) before sending traffic, or set
+WARMUP_ON_START=1 to warm in a background thread right after start-up.
+"""
+
+import os
+import threading
+import time
+
+from telemetry import span
+
+# Warm every target in a background thread as soon as the service module is loaded
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "0") == "1"
+
+
+def warm_up(warmers, targets):
+    """Run the named warmers in order and report how long each took; failures are reported, not raised."""
+    report = {}
+    for target in targets:
+        started = time.perf_counter()
+        with span("warmup", target=target) as warmup_span:
+            try:
+                warmers[target]()
+                report[target] = {'status': 'ok'}
+            except Exception as e:
+                warmup_span.set_attribute("error", str(e))
+                report[target] = {'status': 'error', 'error': str(e)}
+        report[target]['ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+def add_warmup_endpoint(app, warmers, default_targets=None):
+    """Register POST /warmup for warmers (name -> callable) and honour WARMUP_ON_START."""
+    from flask import jsonify, request
+
+    default_targets = list(default_targets or warmers)
+
+    @app.route('/warmup', methods=['POST'])
+    def warmup():
+        data = request.get_json(silent=True) or {}
+        targets = data.get('targets') or default_targets
+        unknown = [target for target in targets if target not in warmers]
+        if unknown:
+            return jsonify({'error': f"Unknown warm-up targets: {', '.join(unknown)}", 'available': list(warmers)}), 400
+        report = warm_up(warmers, targets)
+        status = 200 if all(result['status'] == 'ok' for result in report.values()) else 503
+        return jsonify({'warmup': report}), status
+
+    if WARMUP_ON_START:
+        threading.Thread(target=warm_up, args=(warmers, default_targets), daemon=True).start()
@@ -1,30 +1,45 @@
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
 from db_setup import get_weaviate_client
 from langchain_community.retrievers import WeaviateHybridSearchRetriever
 from langchain.retrievers.document_compressors import CohereRerank
 from langchain.retrievers import ContextualCompressionRetriever
 import os
-import re
+import sys
+import time
 from dotenv import load_dotenv
 from typing import List, Dict, Any, Optional
-from groq import Groq as DirectGroqClient
+
+# Shared backend modules live in backend/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from context_budget import assemble_documents
+from catalog_metadata import schema_context_for
+from gateway_chat_model import GatewayChatModel
+from prompts import REFINE_QUERY, TRINO_SQL, EXPLAIN_CONCEPTS, OPTIMIZE_QUERY, DETECT_INTENT, REPAIR_SQL
+from sql_validator import extract_sql, validate_and_repair
+from tiered_generation import TieredSQLGenerator
+from query_history import get_history, format_examples
+from shared_cache import get_cache, CACHE_TTL_RETRIEVAL, CACHE_TTL_LLM
 
 # Load environment variables
 load_dotenv()
 
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 
+# Validate generated SQL locally (parse, catalog, Trino dry run) and repair it before returning it
+SQL_VALIDATION = os.getenv("SQL_VALIDATION", "1") == "1"
+
+# Draft SQL with the small model and escalate only failed or low-confidence drafts to the 70B model
+SQL_TIERED_GENERATION = os.getenv("SQL_TIERED_GENERATION", "1") == "1"
+
+# Retrieved documents and refined queries, shared by the workers on the host
+cache = get_cache()
+retrieval_cache = cache.namespace("retrieval", CACHE_TTL_RETRIEVAL)
+llm_cache = cache.namespace("llm", CACHE_TTL_LLM)
+
 # Initialize Weaviate Client
 client = get_weaviate_client()
 
-# Initialize Groq client for direct API calls (for compatibility with existing code)
-groq_direct = DirectGroqClient(api_key=GROQ_API_KEY)
-
-# Configure LangChain's Groq integration
-llm = ChatGroq(
-    api_key=GROQ_API_KEY,
+# All agents share the LLM gateway (pooled connections, rate limiting, retries, fallback)
+llm = GatewayChatModel(
     model_name="llama-3.3-70b-versatile",
     temperature=0.2
 )
@@ -61,25 +76,14 @@ class QueryRefinementAgent:
     """Agent responsible for refining and expanding user queries"""
     
     def __init__(self):
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", "You refine user queries to make them clearer for SQL generation."),
-            ("user", """You are a Trino SQL query understanding expert.
-            Your job is to refine and expand the user's query to ensure it's clear and comprehensive.
-            
-            Original Query: {query}
-            
-            Please analyze this query and:
-            1. Identify any ambiguities or missing information
-            2. Expand it to include any implied requirements
-            3. Structure it in a way that would help generate optimal Trino SQL
-            
-            Return only the refined query without explanation.""")
-        ])
+        self.chain = REFINE_QUERY.chat_prompt() | llm.with_stage("llm.refine_query")
     
     def refine_query(self, query: str) -> str:
-        """Refine and expand the user query"""
-        chain = self.prompt | llm
-        return chain.invoke({"query": query}).content.strip()
+        """Refine and expand the user query; a repeated question gets the same refinement, so its retrieval is cached too"""
+        return llm_cache.get_or_compute(
+            (llm.model_name, REFINE_QUERY.prefix_hash, query),
+            lambda: self.chain.invoke({"question": query}).content.strip()
+        )
 
 class RetrievalAgent:
     """Agent responsible for retrieving relevant documentation chunks"""
@@ -95,100 +99,67 @@ class RetrievalAgent:
         else:
             self.retriever = compression_retriever
     
-    def retrieve(self, query: str) -> str:
-        """Retrieve relevant documentation chunks"""
-        docs = self.retriever.get_relevant_documents(query)
-        return "\n\n".join([doc.page_content for doc in docs])
+    def retrieve(self, query: str, max_tokens: Optional[int] = None) -> str:
+        """Retrieve relevant documentation chunks packed into a token budget"""
+        docs = retrieval_cache.get_or_compute(
+            ("weaviate", self.retriever_type, query),
+            lambda: self.retriever.get_relevant_documents(query)
+        )
+        return assemble_documents(docs, max_tokens=max_tokens)
 
 class SQLGenerationAgent:
     """Agent responsible for generating Trino SQL queries"""
     
     def __init__(self):
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a Trino SQL expert specializing in distributed query optimization."),
-            ("user", """You are a Trino SQL expert. The queries must adhere to the semantics and syntax and should use Trino specific functions.
-            Given the following:
-            User Question: {query}
-            Context from Documentation: {context}
-            
-            Please provide:
-            1. A detailed Trino SQL query that addresses the user's question
-            2. An explanation of the query components
-            3. Any relevant Trino-specific optimizations or best practices
-            
-            Consider:
-            - Trino's distributed query execution
-            - Appropriate use of Trino's supported data types
-            - Partition pruning and predicate pushdown
-            - Proper join strategies
-            - Performance optimization techniques
-            
-            Format your response as:
-            QUERY:
-            <the SQL query>
-            
-            EXPLANATION:
-            <detailed explanation>
-            
-            OPTIMIZATIONS:
-            <list of Trino-specific optimizations>""")
-        ])
+        self.chain = TRINO_SQL.chat_prompt() | llm.with_stage("llm.generate_sql")
+        self.repair_chain = REPAIR_SQL.chat_prompt() | llm.with_stage("llm.repair_sql")
+        self.tiered_generator = TieredSQLGenerator(escalation_model=llm.model_name)
+    
+    def generate_sql(self, query: str, context: str, schema: Optional[str] = None, examples: str = "None") -> str:
+        """Generate a Trino SQL query based on the refined query, schema, context and past examples"""
+        if schema is None:
+            schema = schema_context_for(query)
+        return self.chain.invoke({"question": query, "schema": schema, "context": context, "examples": examples}).content.strip()
     
-    def generate_sql(self, query: str, context: str) -> str:
-        """Generate a Trino SQL query based on the refined query and context"""
-        chain = self.prompt | llm
-        return chain.invoke({"query": query, "context": context}).content.strip()
+    def generate_validated_sql(self, query: str, context: str, schema: Optional[str] = None, examples: str = "None"):
+        """Generate a Trino SQL query, then validate it locally and repair it until it passes or attempts run out"""
+        if schema is None:
+            schema = schema_context_for(query)
+        response = self.generate_sql(query, context, schema, examples)
+        
+        def repair(sql: str, errors: List[str]) -> str:
+            errors_text = "\n".join(f"- {error}" for error in errors)
+            return self.repair_chain.invoke(
+                {"question": query, "schema": schema, "sql": sql, "errors": errors_text}
+            ).content.strip()
+        
+        return validate_and_repair(response, repair)
+    
+    def generate_tiered_sql(self, query: str, context: str, schema: Optional[str] = None, examples: str = "None"):
+        """Draft a Trino SQL query with the small model, escalating to the 70B model when the draft fails or is doubtful"""
+        if schema is None:
+            schema = schema_context_for(query)
+        return self.tiered_generator.generate(query, schema, context, examples)
 
 class ExplanationAgent:
     """Agent responsible for explaining Trino concepts"""
     
     def __init__(self):
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a Trino educator specializing in explaining complex database concepts."),
-            ("user", """You are a Trino educator specializing in explaining complex Trino concepts.
-            
-            Based on this user query: {query}
-            
-            And this documentation context: {context}
-            
-            Provide a clear, educational explanation of the relevant Trino concepts.
-            Focus on helping the user understand the underlying principles and how they apply to their query.""")
-        ])
+        self.chain = EXPLAIN_CONCEPTS.chat_prompt() | llm.with_stage("llm.explanation")
     
     def generate_explanation(self, query: str, context: str) -> str:
         """Generate an explanation of Trino concepts relevant to the query"""
-        chain = self.prompt | llm
-        return chain.invoke({"query": query, "context": context}).content.strip()
+        return self.chain.invoke({"question": query, "context": context}).content.strip()
 
 class OptimizationAgent:
     """Agent responsible for providing Trino optimization strategies"""
     
     def __init__(self):
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a Trino performance optimization expert."),
-            ("user", """You are a Trino performance optimization expert.
-            
-            User Query: {query}
-            
-            Generated SQL: {sql}
-            
-            Context from Documentation: {context}
-            
-            Provide specific, actionable Trino optimization strategies for this query considering:
-            - Query structure optimizations
-            - Join optimizations
-            - Predicate pushdown opportunities
-            - Partition pruning techniques
-            - Resource allocation recommendations
-            - Any Trino-specific functions or syntax that could improve performance
-            
-            Format your response with clear sections and code examples where appropriate.""")
-        ])
+        self.chain = OPTIMIZE_QUERY.chat_prompt() | llm.with_stage("llm.optimization")
     
     def generate_optimizations(self, query: str, sql: str, context: str) -> str:
         """Generate optimization strategies for the Trino query"""
-        chain = self.prompt | llm
-        return chain.invoke({"query": query, "sql": sql, "context": context}).content.strip()
+        return self.chain.invoke({"question": query, "sql": sql, "context": context}).content.strip()
 
 class TrinoAgentOrchestrator:
     """Orchestrator for managing the workflow between Trino agents"""
@@ -202,20 +173,11 @@ class TrinoAgentOrchestrator:
         self.explanation_agent = ExplanationAgent()
         self.optimization_agent = OptimizationAgent()
         
-        self.intent_prompt = ChatPromptTemplate.from_messages([
-            ("system", "You analyze user intent for database queries."),
-            ("user", """Analyze this query: "{query}"
-            
-            Determine which of these intents apply (respond ONLY with a comma-separated list of the applicable intents):
-            - SQL (user wants an SQL query)
-            - Explanation (user wants explanation of Trino concepts)
-            - Optimization (user wants performance optimization advice)""")
-        ])
+        self.intent_chain = DETECT_INTENT.chat_prompt() | llm.with_stage("llm.intent")
     
     def determine_intent(self, query: str) -> List[str]:
         """Determine the user's intent to decide which tools to use"""
-        chain = self.intent_prompt | llm
-        response = chain.invoke({"query": query}).content
+        response = self.intent_chain.invoke({"question": query}).content
         intents = [intent.strip() for intent in response.split(',')]
         return intents
     
@@ -231,17 +193,41 @@ class TrinoAgentOrchestrator:
         
         # Step 3: Process based on intent
         if "SQL" in intents:
+            started = time.perf_counter()
             # Retrieve SQL-related documentation
             sql_context = self.sql_retriever.retrieve(refined_query)
+            # Past successful questions like this one, with their SQL, as few-shot examples
+            history = get_history()
+            past = history.examples(user_query) if history is not None else []
+            result["examples"] = [example["id"] for example in past]
+            examples = format_examples(past)
             # Generate SQL
-            sql_response = self.sql_generation_agent.generate_sql(refined_query, sql_context)
-            result["sql_response"] = sql_response
-            
-            # Extract just the SQL for optimization if needed
-            sql_pattern = r"QUERY:\s*(.*?)(?=EXPLANATION:|$)"
-            sql_match = re.search(sql_pattern, sql_response, re.DOTALL)
-            sql_only = sql_match.group(1).strip() if sql_match else sql_response
-            result["sql_only"] = sql_only
+            if SQL_TIERED_GENERATION:
+                served = self.sql_generation_agent.generate_tiered_sql(refined_query, sql_context, examples=examples)
+                result["sql_response"] = served.response
+                result["sql_only"] = served.sql
+                result["validation"] = served.validation
+                result["generation"] = served.to_dict()
+            elif SQL_VALIDATION:
+                checked = self.sql_generation_agent.generate_validated_sql(refined_query, sql_context, examples=examples)
+                result["sql_response"] = checked.response
+                result["sql_only"] = checked.sql
+                result["validation"] = checked.to_dict()
+            else:
+                sql_response = self.sql_generation_agent.generate_sql(refined_query, sql_context, examples=examples)
+                result["sql_response"] = sql_response
+                # Extract just the SQL for optimization if needed
+                result["sql_only"] = extract_sql(sql_response)
+            if history is not None:
+                # Validated SQL counts as successful until an execution outcome says otherwise
+                validation = result.get("validation")
+                result["history_id"] = history.record(
+                    result["sql_only"],
+                    question=user_query,
+                    engine="trino",
+                    latency_ms=round((time.perf_counter() - started) * 1000, 1),
+                    success=validation["valid"] if validation else None
+                )
         
         if "Explanation" in intents:
             # Retrieve explanation-related documentation
@@ -272,6 +258,10 @@ class TrinoAgentOrchestrator:
         
         if "sql_response" in results:
             response_parts.append(f"\n{results['sql_response']}")
+            validation = results.get("validation")
+            if validation and not validation["valid"]:
+                errors = "\n".join(f"- {error}" for error in validation["errors"])
+                response_parts.append(f"\n## Validation Warnings\nThis query did not pass {validation['failed_check']} validation:\n{errors}")
         
         if "explanation" in results and "Explanation" in results["intents"]:
             response_parts.append(f"\n## Trino Concept Explanation\n{results['explanation']}")
@@ -282,9 +272,18 @@ class TrinoAgentOrchestrator:
         return "\n".join(response_parts)
 
 # Main function to use the orchestrator
+_orchestrator = None
+
+def get_orchestrator() -> TrinoAgentOrchestrator:
+    """Orchestrator shared across calls so prompts and agents are built once"""
+    global _orchestrator
+    if _orchestrator is None:
+        _orchestrator = TrinoAgentOrchestrator()
+    return _orchestrator
+
 def process_query(user_query: str) -> str:
     """Process a user query and return a formatted response"""
-    orchestrator = TrinoAgentOrchestrator()
+    orchestrator = get_orchestrator()
     results = orchestrator.process_query(user_query)
     return orchestrator.format_response(results)
 
@@ -1,18 +1,31 @@
 from db_setup import get_weaviate_client
-from groq import Groq
 from langchain_community.retrievers import WeaviateHybridSearchRetriever  # Updated import
 from langchain.retrievers.document_compressors import CohereRerank
 from langchain.retrievers import ContextualCompressionRetriever
 import os
 import re
+import sys
+import time
 from dotenv import load_dotenv
 
+# Shared backend modules live in backend/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from context_budget import assemble_documents
+from catalog_metadata import schema_context_for
+from llm_gateway import get_gateway
+from prompts import TRINO_SQL, TRINO_BEST_PRACTICES, REPAIR_SQL
+from sql_validator import extract_sql, validate_and_repair
+from tiered_generation import TieredSQLGenerator
+from query_history import get_history, format_examples
+
 # Load environment variables
 load_dotenv()
 
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 
+# Validate generated SQL locally (parse, catalog, Trino dry run) and repair it before returning it
+SQL_VALIDATION = os.getenv("SQL_VALIDATION", "1") == "1"
+
 # Initialize Weaviate Client
 client = get_weaviate_client()
 
@@ -33,88 +46,52 @@ compression_retriever = ContextualCompressionRetriever(
     base_retriever=retriever
 )
 
-# Initialize Groq client
-clientg = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Shared LLM gateway (pooled connections, rate limiting, retries, fallback)
+gateway = get_gateway()
 
-def get_trino_query_template():
-    return """
-    You are a Trino SQL expert. The queries must adhere to the semantics and syntax and should use Trino specific functions.
-    Given the following:
-    User Question: {user_query}
-    Context from Documentation: {context}
-    
-    Please provide:
-    1. A detailed Trino SQL query that addresses the user's question
-    2. An explanation of the query components
-    3. Any relevant Trino-specific optimizations or best practices
-    
-    Consider:
-    - Trino's distributed query execution
-    - Appropriate use of Trino's supported data types
-    - Partition pruning and predicate pushdown
-    - Proper join strategies
-    - Performance optimization techniques
-    
-    Format your response as:
-    QUERY:
-    <the SQL query>
-    
-    EXPLANATION:
-    <detailed explanation>
-    
-    OPTIMIZATIONS:
-    <list of Trino-specific optimizations>
-    """
-
-def generate_trino_query(user_query, context):
-    """Generate a Trino-specific SQL query based on user input and context."""
-    chat_completion = clientg.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a Trino SQL expert specializing in distributed query optimization."
-            },
-            {
-                "role": "user",
-                "content": get_trino_query_template().format(
-                    user_query=user_query,
-                    context=context
-                )
-            }
-        ],
+# Draft SQL with the small model and escalate only failed or low-confidence drafts to the 70B model
+SQL_TIERED_GENERATION = os.getenv("SQL_TIERED_GENERATION", "1") == "1"
+tiered_generator = TieredSQLGenerator(gateway, escalation_model="llama-3.3-70b-versatile")
+
+def generate_trino_query(user_query, context, schema=None, examples="None"):
+    """Generate a Trino-specific SQL query based on user input, live schema, context and past examples."""
+    if schema is None:
+        schema = schema_context_for(user_query)
+    result = gateway.chat(
+        stage="llm.generate_trino_query",
+        messages=TRINO_SQL.messages(schema=schema, context=context, examples=examples, question=user_query),
         model="llama-3.3-70b-versatile",
         max_tokens=2000,
         temperature=0.3  # Lower temperature for more focused SQL generation
     )
     
-    return chat_completion.choices[0].message.content
+    return result.content
 
 def get_trino_best_practices(user_query):
     """Get Trino-specific best practices based on the query."""
-    chat_completion = clientg.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a Trino expert focusing on query optimization and best practices. Only give valid suggestsions not too much not to less, a perfect balance with suggestion only if needed at all. "
-            },
-            {
-                "role": "user",
-                "content": f"""
-                Based on this query: '{user_query}', provide Trino-specific best practices considering:
-                - Connector optimization
-                - Query optimization
-                - Resource management
-                - Performance tuning
-                - Data distribution
-                Only include Trino-specific recommendations.
-                """
-            }
-        ],
+    result = gateway.chat(
+        stage="llm.best_practices",
+        messages=TRINO_BEST_PRACTICES.messages(question=user_query),
         model="llama-3.3-70b-versatile",
         temperature=0.4
     )
     
-    return clean_text(chat_completion.choices[0].message.content)
+    return clean_text(result.content)
+
+def repair_trino_query(user_query, schema):
+    """Repair callback for validate_and_repair: sends the validation errors back to the LLM."""
+    def repair(sql, errors):
+        result = gateway.chat(
+            stage="llm.repair_sql",
+            messages=REPAIR_SQL.messages(
+                schema=schema, question=user_query, sql=sql, errors="\n".join(f"- {error}" for error in errors)
+            ),
+            model="llama-3.3-70b-versatile",
+            max_tokens=1000,
+            temperature=0.0
+        )
+        return result.content
+    return repair
 
 def clean_text(text):
     """Clean and format text response."""
@@ -122,22 +99,56 @@ def clean_text(text):
     text = re.sub(r'\s+', ' ', text).strip()  # Normalize spaces
     return text
 
-def process_query(user_query):
+def process_query(user_query, validate=SQL_VALIDATION, tiered=SQL_TIERED_GENERATION):
     """Process the user query and return relevant Trino information."""
     # Get Trino best practices
     trino_practices = get_trino_best_practices(user_query)
     
     # Retrieve relevant documentation
     retrieved_docs = compression_retriever.get_relevant_documents(user_query)
-    doc_context = "\n\n".join(doc.page_content for doc in retrieved_docs)
+    doc_context = assemble_documents(retrieved_docs)
+
+    # Past successful questions like this one, with their SQL, as few-shot examples
+    history = get_history()
+    past = history.examples(user_query) if history is not None else []
+    examples = format_examples(past)
     
     # Generate Trino query
-    trino_query = generate_trino_query(user_query, doc_context)
+    started = time.perf_counter()
+    schema = schema_context_for(user_query)
+    validation = None
+    generation = None
+    if tiered:
+        # Validation decides whether the draft is served, so it always runs in this mode
+        served = tiered_generator.generate(user_query, schema, doc_context, examples)
+        trino_query, validation, generation = served.response, served.validation, served.to_dict()
+    else:
+        trino_query = generate_trino_query(user_query, doc_context, schema, examples)
+        # Check the query locally and let the LLM fix what fails, instead of failing at execution
+        if validate:
+            checked = validate_and_repair(trino_query, repair_trino_query(user_query, schema))
+            trino_query = checked.response
+            validation = checked.to_dict()
+
+    history_id = None
+    if history is not None:
+        # Validated SQL counts as successful until an execution outcome says otherwise
+        history_id = history.record(
+            extract_sql(trino_query),
+            question=user_query,
+            engine="trino",
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            success=validation["valid"] if validation else None
+        )
     
     return {
         "best_practices": trino_practices,
         "documentation_context": doc_context,
-        "generated_query": trino_query
+        "generated_query": trino_query,
+        "validation": validation,
+        "generation": generation,
+        "examples": [example["id"] for example in past],
+        "history_id": history_id
     }
 
 if __name__ == "__main__":
@@ -153,5 +164,8 @@ if __name__ == "__main__":
         print("\nGenerated Trino Query and Explanation:")
         print(results["generated_query"])
         
+        if results["generation"]:
+            print(f"\nServed by the {results['generation']['tier']} tier ({results['generation']['reason']})")
+        
         print("\nTrino Best Practices:")
         print(results["best_practices"])
\ No newline at end of file
@@ -5,8 +5,8 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-weaviate_url="https://9yqwkasqgihqvmw3koycg.c0.asia-southeast1.gcp.weaviate.cloud"
-weaviate_api_key="yTIQQldOtWhMlkmVPx2Fan3o6ZyVEgv32573"
+weaviate_url = os.getenv("WEAVIATE_URL", "https://9yqwkasqgihqvmw3koycg.c0.asia-southeast1.gcp.weaviate.cloud")
+weaviate_api_key = os.getenv("WEAVIATE_API_KEY", "yTIQQldOtWhMlkmVPx2Fan3o6ZyVEgv32573")
 HF_TOKEN = os.getenv("HF_TOKEN")
 
 # Initialize Weaviate Client
@@ -0,0 +1,172 @@
+"""Local extraction of SQL DDL and explanation text from a generated schema answer"""
+
+import re
+from typing import List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError, TokenError
+from sqlglot.tokens import Tokenizer, TokenType
+
+# Dialect the schema prompt asks the model to write
+DDL_DIALECT = "mysql"
+
+FENCE_PATTERN = re.compile(r"```[ \t]*([\w+-]*)[^\n]*\n(.*?)```", re.DOTALL)
+CREATE_PATTERN = re.compile(
+    r"\bCREATE\s+(?:OR\s+REPLACE\s+)?(?:UNIQUE\s+|TEMPORARY\s+)?(?:TABLE|INDEX|VIEW|DATABASE|SCHEMA)\b",
+    re.IGNORECASE,
+)
+SQL_FENCE_LANGUAGES = {"", "sql", "mysql"}
+
+# Statements allowed next to the CREATE TABLE/INDEX/VIEW statements in a schema script
+ALLOWED_STATEMENTS = (exp.Create, exp.Alter, exp.Use, exp.Drop)
+
+
+class DDLExtractionError(ValueError):
+    """Raised when the answer does not contain a valid DDL script."""
+
+
+def _bare_statement_end(text: str, start: int) -> int:
+    """End offset of a bare (unfenced) statement: its ';' or the first blank line
+    outside parentheses and quotes."""
+    depth = 0
+    quote = None
+    i = start
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+        elif char == ";" and depth == 0:
+            return i + 1
+        elif char == "\n" and depth == 0 and text.startswith("\n", i + 1):
+            return i
+        i += 1
+    return len(text)
+
+
+def _find_code_spans(text: str) -> List[Tuple[int, int, str]]:
+    """Locate SQL code as (start, end, code) spans: fenced blocks first,
+    otherwise bare CREATE statements in the prose."""
+    spans = []
+    for match in FENCE_PATTERN.finditer(text):
+        language = match.group(1).lower()
+        code = match.group(2)
+        if language in SQL_FENCE_LANGUAGES and CREATE_PATTERN.search(code):
+            spans.append((match.start(), match.end(), code))
+    if spans:
+        return spans
+
+    position = 0
+    while True:
+        match = CREATE_PATTERN.search(text, position)
+        if not match:
+            break
+        end = _bare_statement_end(text, match.start())
+        spans.append((match.start(), end, text[match.start():end]))
+        position = end
+    return spans
+
+
+def split_statements(code: str) -> List[str]:
+    """Split a script into statements on top-level semicolons using the SQL tokenizer."""
+    try:
+        tokens = Tokenizer(dialect=DDL_DIALECT).tokenize(code)
+    except TokenError as e:
+        raise DDLExtractionError(f"Unable to tokenize SQL: {e}")
+
+    statements = []
+    start = None
+    for token in tokens:
+        if token.token_type == TokenType.SEMICOLON:
+            if start is not None:
+                statements.append(code[start:token.start].strip())
+            start = None
+        elif start is None:
+            start = token.start
+    if start is not None:
+        statements.append(code[start:].strip())
+    return [statement for statement in statements if statement]
+
+
+# Token pairs that only occur around an empty list element, which the parser silently drops
+EMPTY_ELEMENT_TOKENS = {
+    (TokenType.COMMA, TokenType.COMMA),
+    (TokenType.L_PAREN, TokenType.COMMA),
+    (TokenType.COMMA, TokenType.R_PAREN),
+}
+
+
+def _check_table_elements(expression: exp.Expression, statement: str) -> None:
+    """Reject column lists the parser accepted leniently: empty elements and columns without a type."""
+    tokens = Tokenizer(dialect=DDL_DIALECT).tokenize(statement)
+    for previous, token in zip(tokens, tokens[1:]):
+        if (previous.token_type, token.token_type) in EMPTY_ELEMENT_TOKENS:
+            raise DDLExtractionError(f"Empty element at line {token.line}, col {token.col}: {statement[:60]}")
+    schema = expression.this if isinstance(expression, exp.Create) else None
+    if isinstance(schema, exp.Schema):
+        for element in schema.expressions:
+            if isinstance(element, exp.Identifier) or (isinstance(element, exp.ColumnDef) and not element.args.get("kind")):
+                raise DDLExtractionError(f"Column {element.name} has no type: {statement[:60]}")
+
+
+def validate_statement(statement: str) -> exp.Expression:
+    """Parse a single statement and make sure it belongs in a schema script."""
+    try:
+        expression = sqlglot.parse_one(statement, read=DDL_DIALECT)
+    except SqlglotError as e:
+        raise DDLExtractionError(f"Invalid SQL statement: {e}")
+    if expression.find(exp.Command):
+        # sqlglot falls back to an opaque Command for text it cannot parse, so it proves nothing
+        raise DDLExtractionError(f"Unparseable statement in schema: {statement[:60]}")
+    if not isinstance(expression, ALLOWED_STATEMENTS):
+        raise DDLExtractionError(f"Unexpected statement in schema: {statement[:60]}")
+    _check_table_elements(expression, statement)
+    return expression
+
+
+def extract_ddl(text: str) -> Tuple[str, str]:
+    """Split a generated schema answer into (sql_statements, explanation).
+
+    Raises DDLExtractionError when no CREATE TABLE/INDEX/VIEW statement is found
+    or any statement fails to parse, so the caller can fall back to the LLM.
+    """
+    spans = _find_code_spans(text)
+    statements = []
+    for _, _, code in spans:
+        statements.extend(split_statements(code))
+
+    creates = 0
+    for statement in statements:
+        expression = validate_statement(statement)
+        if isinstance(expression, exp.Create) and expression.args.get("kind", "").upper() in ("TABLE", "INDEX", "VIEW"):
+            creates += 1
+    if not creates:
+        raise DDLExtractionError("No CREATE TABLE/INDEX/VIEW statements found")
+
+    sql_statements = "\n\n".join(f"{statement};" for statement in statements)
+
+    prose = []
+    position = 0
+    for start, end, _ in spans:
+        prose.append(text[position:start])
+        position = end
+    prose.append(text[position:])
+    explanation = re.sub(r"\n{3,}", "\n\n", "".join(prose)).strip()
+
+    return sql_statements, explanation
+
+
+def try_extract_ddl(text: str) -> Optional[Tuple[str, str]]:
+    """extract_ddl that returns None instead of raising."""
+    try:
+        return extract_ddl(text)
+    except DDLExtractionError as e:
+        print(f"Local DDL extraction failed, falling back to LLM: {str(e)}")
+        return None
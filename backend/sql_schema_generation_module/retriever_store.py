@@ -0,0 +1,310 @@
+"""Versioned on-disk format for the BM25 + dense ensemble retriever.
+
+Layout of a store directory:
+
+    manifest.json         format name, version, fusion weights and BM25/dense parameters
+    texts.bin             UTF-8 page contents, concatenated
+    text_offsets.npy      int64 [num_docs + 1] byte offsets into texts.bin
+    metadata.bin          one JSON object per document, concatenated
+    metadata_offsets.npy  int64 [num_docs + 1] byte offsets into metadata.bin
+    vocab.json            BM25 term -> term id
+    bm25_indptr.npy       int64 [num_terms + 1] CSR row pointers (one row per term)
+    bm25_indices.npy      int32 document ids of each posting
+    bm25_weights.npy      float32 precomputed BM25 weight of each posting
+    dense.npy             float32 [num_dense, dim] document vectors
+    dense_sqnorm.npy      float32 [num_dense] squared vector norms (L2 ranking)
+    dense_doc_ids.npy     int32 [num_dense] document id of each vector row
+
+Arrays are opened with np.load(mmap_mode="r") on first use, so loading is
+lazy and every worker process shares the same page-cache pages.
+"""
+
+import json
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import PrivateAttr
+
+STORE_FORMAT = "ensemble-retriever-store"
+STORE_VERSION = 1
+
+
+class RetrieverStoreError(Exception):
+    """Raised when a store directory is missing, corrupt or of another version."""
+
+
+class EnsembleStore:
+    """Read-only, lazily memory-mapped view of an exported ensemble retriever."""
+
+    def __init__(self, path: str, embed_query: Optional[Callable[[str], List[float]]] = None):
+        self.path = path
+        self._embed_query = embed_query
+        self._lock = threading.Lock()
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._vocab: Optional[Dict[str, int]] = None
+        self._texts = None
+        self._metadata = None
+
+    @property
+    def manifest(self) -> Dict[str, Any]:
+        if self._manifest is None:
+            manifest_path = os.path.join(self.path, "manifest.json")
+            if not os.path.exists(manifest_path):
+                raise RetrieverStoreError(f"No retriever store at {self.path}")
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("format") != STORE_FORMAT:
+                raise RetrieverStoreError(f"{self.path} is not an {STORE_FORMAT}")
+            if manifest.get("version") != STORE_VERSION:
+                raise RetrieverStoreError(
+                    f"Unsupported store version {manifest.get('version')} (expected {STORE_VERSION})"
+                )
+            self._manifest = manifest
+        return self._manifest
+
+    def _array(self, name: str) -> np.ndarray:
+        array = self._arrays.get(name)
+        if array is None:
+            with self._lock:
+                array = self._arrays.get(name)
+                if array is None:
+                    array = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+                    self._arrays[name] = array
+        return array
+
+    def _blob(self, name: str) -> np.memmap:
+        return np.memmap(os.path.join(self.path, name), dtype=np.uint8, mode="r")
+
+    @property
+    def vocab(self) -> Dict[str, int]:
+        if self._vocab is None:
+            with open(os.path.join(self.path, "vocab.json"), encoding="utf-8") as f:
+                self._vocab = json.load(f)
+        return self._vocab
+
+    def document(self, doc_id: int) -> Document:
+        """Materialize a single document from the text and metadata blobs."""
+        if self._texts is None:
+            self._texts = self._blob("texts.bin")
+            self._metadata = self._blob("metadata.bin")
+        text_offsets = self._array("text_offsets")
+        meta_offsets = self._array("metadata_offsets")
+        text = bytes(self._texts[text_offsets[doc_id]:text_offsets[doc_id + 1]]).decode("utf-8")
+        metadata = json.loads(bytes(self._metadata[meta_offsets[doc_id]:meta_offsets[doc_id + 1]]))
+        return Document(page_content=text, metadata=metadata)
+
+    def bm25_search(self, query: str, k: int) -> List[int]:
+        """Top-k document ids by BM25 using the CSR postings."""
+        indptr = self._array("bm25_indptr")
+        indices = self._array("bm25_indices")
+        weights = self._array("bm25_weights")
+        scores = np.zeros(self.manifest["num_docs"], dtype=np.float64)
+        vocab = self.vocab
+        # Duplicate query terms count once per occurrence, as in rank_bm25
+        for term in query.split():
+            term_id = vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = indptr[term_id], indptr[term_id + 1]
+            np.add.at(scores, indices[start:end], weights[start:end])
+        # Same ordering (ties included) as BM25Retriever's rank_bm25.get_top_n
+        return [int(i) for i in np.argsort(scores)[::-1][:k]]
+
+    def dense_search(self, query: str, k: int) -> List[int]:
+        """Top-k document ids by vector similarity over the memory-mapped matrix."""
+        dense = self.manifest.get("dense")
+        if not dense:
+            return []
+        vectors = self._array("dense")
+        query_vector = np.asarray(self._get_embed_query()(query), dtype=np.float32)
+        dots = vectors @ query_vector
+        if dense.get("metric", "l2") == "l2":
+            # argmin ||v - q||^2 == argmax 2 v.q - ||v||^2
+            scores = 2 * dots - self._array("dense_sqnorm")
+        else:
+            scores = dots
+        rows = _top_k(scores, k)
+        doc_ids = self._array("dense_doc_ids")
+        return [int(doc_ids[row]) for row in rows]
+
+    def _get_embed_query(self) -> Callable[[str], List[float]]:
+        if self._embed_query is None:
+            with self._lock:
+                if self._embed_query is None:
+                    # backend/common is on sys.path in the services; ONNX + micro-batching once the model is exported
+                    from embedding_service import get_embeddings
+                    model_name = self.manifest["dense"]["model_name"]
+                    self._embed_query = get_embeddings(model_name).embed_query
+        return self._embed_query
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Document]:
+        """Weighted reciprocal rank fusion of BM25 and dense results."""
+        manifest = self.manifest
+        bm25_weight, dense_weight = manifest["weights"]
+        c = manifest["c"]
+        fused: Dict[int, float] = {}
+        ranked_lists = [(self.bm25_search(query, manifest["bm25"]["k"]), bm25_weight)]
+        if manifest.get("dense"):
+            ranked_lists.append((self.dense_search(query, manifest["dense"]["k"]), dense_weight))
+        for doc_ids, weight in ranked_lists:
+            for rank, doc_id in enumerate(doc_ids, start=1):
+                fused[doc_id] = fused.get(doc_id, 0.0) + weight / (rank + c)
+        ordered = sorted(fused, key=lambda doc_id: fused[doc_id], reverse=True)
+        if k is not None:
+            ordered = ordered[:k]
+        return [self.document(doc_id) for doc_id in ordered]
+
+
+def _top_k(scores: np.ndarray, k: int) -> List[int]:
+    """Indices of the k highest scores, best first, ties by lower index as in FAISS."""
+    if k <= 0 or scores.size == 0:
+        return []
+    k = min(k, scores.size)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return [int(i) for i in candidates[np.argsort(-scores[candidates], kind="stable")]]
+
+
+class EnsembleStoreRetriever(BaseRetriever):
+    """LangChain retriever backed by an EnsembleStore directory."""
+
+    path: str
+    k: Optional[int] = None
+
+    _store: Optional[EnsembleStore] = PrivateAttr(default=None)
+
+    def _get_store(self) -> EnsembleStore:
+        if self._store is None:
+            self._store = EnsembleStore(self.path)
+        return self._store
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self._get_store().search(query, self.k)
+
+
+def load_ensemble_retriever(path: str, k: Optional[int] = None) -> EnsembleStoreRetriever:
+    """Open a store lazily, validating only its manifest."""
+    retriever = EnsembleStoreRetriever(path=path, k=k)
+    # Fail fast on a missing or incompatible store; arrays stay unmapped until the first query
+    _ = retriever._get_store().manifest
+    return retriever
+
+
+def _write_blob(path: str, blob_name: str, offsets_name: str, items: List[bytes]) -> None:
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    with open(os.path.join(path, blob_name), "wb") as f:
+        for i, item in enumerate(items):
+            f.write(item)
+            offsets[i + 1] = offsets[i] + len(item)
+    np.save(os.path.join(path, f"{offsets_name}.npy"), offsets)
+
+
+def export_ensemble(ensemble, path: str) -> Dict[str, Any]:
+    """Export a LangChain EnsembleRetriever (BM25Retriever + vector store retriever)."""
+    bm25 = next((r for r in ensemble.retrievers if hasattr(r, "vectorizer")), None)
+    dense = next((r for r in ensemble.retrievers if hasattr(r, "vectorstore")), None)
+    if bm25 is None:
+        raise RetrieverStoreError("Ensemble has no BM25Retriever to export")
+    weights = list(ensemble.weights)
+    if ensemble.retrievers[0] is not bm25:
+        weights.reverse()
+
+    os.makedirs(path, exist_ok=True)
+
+    # Documents: BM25 corpus first, then anything only the vector store knows
+    docs = list(bm25.docs)
+    doc_ids = {doc.page_content: i for i, doc in enumerate(docs)}
+
+    # BM25 postings, term-major CSR with the full per-posting BM25 weight
+    model = bm25.vectorizer
+    k1, b = model.k1, model.b
+    terms = sorted(model.idf)
+    vocab = {term: i for i, term in enumerate(terms)}
+    postings: List[List[tuple]] = [[] for _ in terms]
+    for doc_id, freqs in enumerate(model.doc_freqs):
+        norm = k1 * (1 - b + b * model.doc_len[doc_id] / model.avgdl)
+        for term, tf in freqs.items():
+            term_id = vocab.get(term)
+            if term_id is not None:
+                weight = model.idf[term] * (tf * (k1 + 1)) / (tf + norm)
+                postings[term_id].append((doc_id, weight))
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    for term_id, plist in enumerate(postings):
+        indptr[term_id + 1] = indptr[term_id] + len(plist)
+    indices = np.fromiter((d for plist in postings for d, _ in plist), dtype=np.int32, count=int(indptr[-1]))
+    bm25_weights = np.fromiter((w for plist in postings for _, w in plist), dtype=np.float32, count=int(indptr[-1]))
+    np.save(os.path.join(path, "bm25_indptr.npy"), indptr)
+    np.save(os.path.join(path, "bm25_indices.npy"), indices)
+    np.save(os.path.join(path, "bm25_weights.npy"), bm25_weights)
+    with open(os.path.join(path, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f)
+
+    manifest: Dict[str, Any] = {
+        "format": STORE_FORMAT,
+        "version": STORE_VERSION,
+        "weights": weights,
+        "c": getattr(ensemble, "c", 60),
+        "bm25": {"k": bm25.k, "k1": k1, "b": b, "tokenizer": "whitespace"},
+        "dense": None,
+    }
+
+    if dense is not None:
+        vectorstore = dense.vectorstore
+        if hasattr(vectorstore, "index_to_docstore_id"):
+            # FAISS: reuse the stored vectors instead of re-embedding
+            ids = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+            dense_docs = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+            vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+            strategy = str(getattr(vectorstore, "distance_strategy", "EUCLIDEAN_DISTANCE"))
+            metric = "l2" if "EUCLIDEAN" in strategy.upper() else "ip"
+        else:
+            dense_docs = docs
+            vectors = vectorstore.embeddings.embed_documents([doc.page_content for doc in docs])
+            metric = "ip"
+        dense_doc_ids = []
+        for doc in dense_docs:
+            if doc.page_content not in doc_ids:
+                doc_ids[doc.page_content] = len(docs)
+                docs.append(doc)
+            dense_doc_ids.append(doc_ids[doc.page_content])
+        vectors = np.asarray(vectors, dtype=np.float32)
+        np.save(os.path.join(path, "dense.npy"), vectors)
+        np.save(os.path.join(path, "dense_sqnorm.npy"), np.einsum("ij,ij->i", vectors, vectors))
+        np.save(os.path.join(path, "dense_doc_ids.npy"), np.asarray(dense_doc_ids, dtype=np.int32))
+        manifest["dense"] = {
+            "k": dense.search_kwargs.get("k", 4),
+            "dim": int(vectors.shape[1]),
+            "metric": metric,
+            "model_name": getattr(vectorstore.embeddings, "model_name", "all-MiniLM-L6-v2"),
+        }
+
+    _write_blob(path, "texts.bin", "text_offsets", [doc.page_content.encode("utf-8") for doc in docs])
+    _write_blob(path, "metadata.bin", "metadata_offsets", [json.dumps(doc.metadata or {}, default=str).encode("utf-8") for doc in docs])
+    manifest["num_docs"] = len(docs)
+
+    # Manifest last, so a half-written store is never picked up
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    # One-off conversion of a trusted legacy pickle:
+    #   python retriever_store.py ensemble_retriever.pkl ensemble_retriever_store
+    import pickle
+
+    if len(sys.argv) != 3:
+        print("Usage: python retriever_store.py <ensemble_retriever.pkl> <store_dir>")
+        sys.exit(1)
+    with open(sys.argv[1], "rb") as f:
+        legacy = pickle.load(f)
+    result = export_ensemble(legacy, sys.argv[2])
+    print(f"Exported {result['num_docs']} documents to {sys.argv[2]}")
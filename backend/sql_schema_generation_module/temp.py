@@ -1,31 +1,85 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
+import sys
 import json
 import re
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from groq import Groq
-import instructor
 from pydantic import BaseModel, Field
-from db_setup import get_weaviate_client
-from langchain.retrievers.weaviate_hybrid_search import WeaviateHybridSearchRetriever
-from langchain.retrievers.document_compressors import CohereRerank
-from langchain.retrievers import ContextualCompressionRetriever
+from ddl_extractor import try_extract_ddl
 import pickle
+
+# Shared backend modules live in backend/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from context_budget import assemble_documents
+from telemetry import span, instrument_app, bind_context
+from llm_gateway import get_gateway
+from prompts import OLAP_BEST_PRACTICES, SCHEMA_DRAFT, EXTRACT_SQL, EXTRACT_EXPLANATION
+from warmup import add_warmup_endpoint
+from shared_cache import get_cache, add_cache_endpoints, CACHE_TTL_RETRIEVAL, CACHE_TTL_LLM
+
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Allow CORS for testing with Thunder Client
+instrument_app(app, "schema_generator")
 
-with open("ensemble_retriever.pkl", "rb") as f:
-    ensemble_retriever = pickle.load(f)
-print("Ensemble retriever successfully loaded!")
+# Ensemble retriever: memory-mapped store (see retriever_store.py)
+ENSEMBLE_STORE_PATH = os.getenv("ENSEMBLE_STORE_PATH", "ensemble_retriever_store")
+# Unpickling runs arbitrary code, so the legacy ensemble_retriever.pkl is only loaded when explicitly allowed
+ENSEMBLE_ALLOW_PICKLE = os.getenv("ENSEMBLE_ALLOW_PICKLE", "0") == "1"
+# Opened on first use (or by POST /warmup) so the service is ready as soon as Flask is up
+ensemble_retriever = None
 # Get API keys
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 
+_lazy_lock = threading.Lock()
+_compressor = None
+
+def get_ensemble_retriever():
+    """The ensemble retriever, opened on first use."""
+    global ensemble_retriever
+    if ensemble_retriever is None:
+        with _lazy_lock:
+            if ensemble_retriever is None:
+                ensemble_retriever = _open_ensemble_retriever()
+    return ensemble_retriever
+
+def _open_ensemble_retriever():
+    if os.path.exists(os.path.join(ENSEMBLE_STORE_PATH, "manifest.json")):
+        from retriever_store import load_ensemble_retriever
+        # Only the manifest is read here; arrays and the embedding model load on the first query
+        retriever = load_ensemble_retriever(ENSEMBLE_STORE_PATH)
+        print("Ensemble retriever store successfully opened!")
+        return retriever
+    convert = f"python retriever_store.py ensemble_retriever.pkl {ENSEMBLE_STORE_PATH}"
+    if not ENSEMBLE_ALLOW_PICKLE:
+        raise RuntimeError(
+            f"No retriever store at {ENSEMBLE_STORE_PATH}. Build it from a trusted ensemble_retriever.pkl with: "
+            f"{convert} (or set ENSEMBLE_ALLOW_PICKLE=1 to load the pickle directly)"
+        )
+    print(f"No retriever store at {ENSEMBLE_STORE_PATH}, loading legacy ensemble_retriever.pkl. Convert it with: {convert}")
+    with open("ensemble_retriever.pkl", "rb") as f:
+        retriever = pickle.load(f)
+    print("Ensemble retriever successfully loaded!")
+    return retriever
+
+def get_compressor():
+    """Cohere reranker, imported and built on first use."""
+    global _compressor
+    if _compressor is None:
+        with _lazy_lock:
+            if _compressor is None:
+                from langchain.retrievers.document_compressors import CohereRerank
+                _compressor = CohereRerank(cohere_api_key=COHERE_API_KEY)
+    return _compressor
+
 # Initialize Weaviate Client
 # client = get_weaviate_client()
 
@@ -40,37 +94,31 @@ COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 #     k=1
 # )
 
-# Contextual Compression with Cohere
-compressor = CohereRerank(cohere_api_key=COHERE_API_KEY)
-compression_retriever = ContextualCompressionRetriever(
-    base_compressor=compressor,
-    base_retriever=ensemble_retriever
-)
+# Shared LLM gateway (pooled connections, rate limiting, retries, fallback, JSON mode)
+gateway = get_gateway()
 
-# Initialize Groq Client
-clientg = Groq(api_key=GROQ_API_KEY)
-clientgg = instructor.from_groq(Groq(), mode=instructor.Mode.JSON)
+# Best-practices answers and retrieved documents, shared by the workers on the host
+cache = get_cache()
+retrieval_cache = cache.namespace("retrieval", CACHE_TTL_RETRIEVAL)
+llm_cache = cache.namespace("llm", CACHE_TTL_LLM)
+
+# Worker pool for pipeline stages that can run side by side
+pipeline_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SCHEMA_PIPELINE_WORKERS", "8")))
 
 class OLAPSchemaExplanationResponse(BaseModel):
     explanation: str = Field(description="Reasoning and explanation behind the OLAP schema choice.")
 def generate_explanation_ans(inputquery, user_query):
     """Generate structured OLAP schema explanation response."""
-    query = f"""
-        Given input {inputquery}, extract and return only the explanation, reasoning, and non-code parts.
-        Do not include SQL code.
-    """
     try:
-        response = clientgg.chat.completions.create(
-            response_model=OLAPSchemaExplanationResponse,
+        response = gateway.chat_json(
+            EXTRACT_EXPLANATION.messages(draft=inputquery),
+            OLAPSchemaExplanationResponse,
             model="qwen-2.5-coder-32b",
-            messages=[
-                {"role": "system", "content": "Provide OLAP schema explanation in JSON format."},
-                {"role": "user", "content": query},
-            ],
+            stage="llm.extract_explanation",
             temperature=0.7,
             max_tokens=5000,
         )
-        return response.dict()
+        return response.model_dump()
     except Exception as e:
         return {"error": f"Unable to generate explanation: {str(e)}"}
 # Pydantic Schema Model
@@ -80,44 +128,33 @@ class OLAPSchemaResponse(BaseModel):
 
 
 def get_olap_best_practices(user_query):
-    """Retrieve OLAP best practices."""
-    chat_completion = clientg.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": f"The user has asked: '{user_query}'. Provide best OLAP practices and recommend either Star or Snowflake schema."
-            }
-        ],
+    """Retrieve OLAP best practices; repeated questions reuse the answer, which also keeps their retrieval cached."""
+    def ask():
+        result = gateway.chat(
+            OLAP_BEST_PRACTICES.messages(question=user_query),
+            model="llama-3.1-8b-instant",
+            stage="llm.best_practices",
+            max_tokens=5000,
+        )
+        return result.content.strip()
+
+    return llm_cache.get_or_compute(("llama-3.1-8b-instant", OLAP_BEST_PRACTICES.prefix_hash, user_query), ask)
+
+
+def stream_database_schema(user_query, olap_context, llm_res):
+    """Stream the database schema draft as it is generated."""
+    yield from gateway.chat_stream(
+        SCHEMA_DRAFT.messages(context=olap_context, best_practices=llm_res, question=user_query),
         model="llama-3.1-8b-instant",
+        stage="llm.schema_draft",
+        temperature=0.7,
         max_tokens=5000,
     )
-    response_text = chat_completion.choices[0].message.content
-    return response_text.strip()
 
 
 def generate_database_schema(user_query, olap_context, llm_res):
     """Generate database schema based on OLAP context."""
-    chat_completion = clientg.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": f"""
-                The user has asked: '{user_query}'.
-                Given the OLAP context: {olap_context}, and response: {llm_res}, generate a relational database schema including:
-                - SQL query to create schema in MySQL
-                - Tables and their relationships
-                - Columns with appropriate data types
-                - Primary and foreign keys
-                - Schema type (Star/Snowflake or any other) and its reasoning.
-                """
-            }
-        ],
-        model="llama-3.1-8b-instant",
-        temperature=0.7,
-        max_tokens=5000,
-    )
-    response_text = chat_completion.choices[0].message.content
-    return response_text.strip()
+    return "".join(stream_database_schema(user_query, olap_context, llm_res)).strip()
 
 
 def clean_text(text):
@@ -125,37 +162,120 @@ def clean_text(text):
     return re.sub(r'[\*\#\\]', '', text).strip()
 
 
+def retrieve_olap_context(user_query, best_practices):
+    """Retrieve OLAP documentation for the query and best-practices answer."""
+    retrieval_query = clean_text(best_practices) + user_query
+
+    def search_and_rerank():
+        # Same steps as ContextualCompressionRetriever.invoke with the Cohere reranker, timed separately
+        with span("retrieval.hybrid_search") as search_span:
+            docs = get_ensemble_retriever().invoke(retrieval_query)
+            search_span.set_attribute("documents", len(docs))
+        with span("retrieval.rerank") as rerank_span:
+            docs = list(get_compressor().compress_documents(docs, retrieval_query))
+            rerank_span.set_attribute("documents", len(docs))
+        return docs
+
+    retrieved_docs = retrieval_cache.get_or_compute(("ensemble", ENSEMBLE_STORE_PATH, retrieval_query), search_and_rerank)
+    with span("context_assembly"):
+        return assemble_documents(retrieved_docs)
+
+
 def process_query(user_query):
     """Retrieve documents and OLAP best practices."""
     response = get_olap_best_practices(user_query)
-    cleaned_response = clean_text(response)
-    retrieved_docs = compression_retriever.invoke(cleaned_response + user_query)
-    retrieved_text = "\n\n".join(doc.page_content for doc in retrieved_docs)
+    retrieved_text = retrieve_olap_context(user_query, response)
     return response, retrieved_text
 
 
 def generate_final_ans(inputquery, user_query):
     """Generate structured OLAP schema response."""
-    query = f"""
-        given input {inputquery} , it has reason of using this kind of schema along with sql code , extract and return only code part and nothing else
-    """
     try:
-        response = clientgg.chat.completions.create(
-            response_model=OLAPSchemaResponse,
+        response = gateway.chat_json(
+            EXTRACT_SQL.messages(draft=inputquery),
+            OLAPSchemaResponse,
             model="qwen-2.5-coder-32b",
-            messages=[
-                {"role": "system", "content": "Provide OLAP schema data in JSON format."},
-                {"role": "user", "content": query},
-            ],
+            stage="llm.extract_sql",
             temperature=0.7,
             max_tokens=5000,
         )
-        return response.dict()
+        return response.model_dump()
     except Exception as e:
         return {"error": f"Unable to generate schema: {str(e)}"}
 
 
 
+def extract_schema_parts(ans, user_query):
+    """Split the schema draft into SQL code and explanation.
+
+    Parses the DDL locally and only falls back to the two LLM extraction calls
+    (run concurrently) when local parsing fails.
+    """
+    with span("sql.parse_ddl"):
+        extracted = try_extract_ddl(ans)
+    if extracted is not None:
+        sql_statements, explanation = extracted
+        if explanation:
+            return {"sql_statements": sql_statements}, {"explanation": explanation}, "local"
+        return {"sql_statements": sql_statements}, generate_explanation_ans(ans, user_query), "local+llm"
+
+    sql_future = pipeline_executor.submit(bind_context(generate_final_ans), ans, user_query)
+    explanation_future = pipeline_executor.submit(bind_context(generate_explanation_ans), ans, user_query)
+    return sql_future.result(), explanation_future.result(), "llm"
+
+
+@contextmanager
+def stage_timer(timings, stage):
+    """Record the wall-clock latency of a pipeline stage in milliseconds."""
+    start = time.perf_counter()
+    try:
+        with span(f"pipeline.{stage}"):
+            yield
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def run_schema_pipeline(user_query):
+    """Run the schema pipeline, yielding progress events and finally the result.
+
+    Retrieval depends on the best-practices answer and the draft depends on
+    both, so those stages run in order; the draft is streamed as it arrives
+    and the code/explanation extractions, which only need the draft, run
+    concurrently.
+    """
+    timings = {}
+    pipeline_start = time.perf_counter()
+
+    with stage_timer(timings, "best_practices"):
+        llmres = get_olap_best_practices(user_query)
+    yield {"event": "stage", "stage": "best_practices", "latency_ms": timings["best_practices"]}
+
+    with stage_timer(timings, "retrieval"):
+        olap_context = retrieve_olap_context(user_query, llmres)
+    yield {"event": "stage", "stage": "retrieval", "latency_ms": timings["retrieval"]}
+
+    parts = []
+    with stage_timer(timings, "schema_draft"):
+        for delta in stream_database_schema(user_query, olap_context, llmres):
+            parts.append(delta)
+            yield {"event": "draft", "delta": delta}
+    ans = "".join(parts).strip()
+    yield {"event": "stage", "stage": "schema_draft", "latency_ms": timings["schema_draft"]}
+
+    with stage_timer(timings, "extraction"):
+        fans, explanation, extraction_method = extract_schema_parts(ans, user_query)
+    yield {"event": "stage", "stage": "extraction", "latency_ms": timings["extraction"], "method": extraction_method}
+
+    timings["total"] = round((time.perf_counter() - pipeline_start) * 1000, 1)
+    yield {
+        "event": "result",
+        "sql_code": fans,
+        "explanation": explanation,
+        "extraction_method": extraction_method,
+        "timings": timings
+    }
+
+
 @app.route("/generate_schema", methods=["POST"])
 def generate_schema():
     """API endpoint to generate OLAP schema with explanation."""
@@ -167,21 +287,47 @@ def generate_schema():
         if not user_query:
             return jsonify({"error": "User query is required"}), 400
 
-        # Process the query
-        llmres, olap_context = process_query(user_query)
-
-        # Generate the schema
-        ans = generate_database_schema(user_query, olap_context, llmres)
-        print(ans)
-        fans = generate_final_ans(ans, user_query)
-        explanation = generate_explanation_ans(ans, user_query)
+        # Run the pipeline to completion and keep only the final result
+        for event in run_schema_pipeline(user_query):
+            if event["event"] == "result":
+                return jsonify({
+                    "sql_code": event["sql_code"],
+                    "explanation": event["explanation"],
+                    "timings": event["timings"]
+                })
 
-        return jsonify({"sql_code": fans, "explanation": explanation})
+        return jsonify({"error": "Schema pipeline produced no result"}), 500
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/generate_schema/stream", methods=["POST"])
+def generate_schema_stream():
+    """API endpoint streaming pipeline progress and the schema draft as NDJSON."""
+    data = request.get_json()
+    user_query = data.get("user_query", "")
+
+    if not user_query:
+        return jsonify({"error": "User query is required"}), 400
+
+    def generate():
+        try:
+            for event in run_schema_pipeline(user_query):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "error": str(e)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+
+def _warm_retriever():
+    # Maps the store's arrays and loads the embedding model
+    get_ensemble_retriever().invoke("fact table dimensions")
+
+add_warmup_endpoint(app, {"retriever": _warm_retriever, "reranker": get_compressor})
+add_cache_endpoints(app, cache)
 
 # Run the Flask app
 if __name__ == "__main__":
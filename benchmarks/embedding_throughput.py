@@ -0,0 +1,182 @@
+"""Embedding throughput and latency: PyTorch (HuggingFaceEmbeddings) against the ONNX embedding service
+
+For each backend this measures
+    queries     N client threads each embedding one question at a time, as the
+                services do per request; embeddings/sec and latency percentiles
+                per concurrency level (ONNX backends go through the micro-batcher)
+    documents   embed_documents over corpus chunks, as ingest.py does
+    agreement   cosine similarity of each backend's question vectors to the
+                huggingface ones (int8 quantization moves vectors slightly)
+Results go to benchmarks/results/embeddings-<timestamp>.json.
+
+    python backend/common/embedding_service.py export        # once, writes the fp32 and int8 models
+    python benchmarks/embedding_throughput.py
+    python benchmarks/embedding_throughput.py --backends onnx-int8 --concurrency 1,8,32,64 --window-ms 2
+    python benchmarks/embedding_throughput.py --backends huggingface,service --url http://localhost:5010
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+os.environ.setdefault("TELEMETRY_EXPORTER", "none")
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.append(os.path.join(REPO_ROOT, "backend", "common"))
+from embedding_service import EmbeddingService, ServiceEmbeddings, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH
+from run_benchmark import summarize
+
+BACKENDS = ("huggingface", "onnx", "onnx-int8", "service")
+
+
+def load_backend(name, args):
+    """(embed_query, embed_documents) callables for a backend."""
+    if name == "huggingface":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=args.model)
+        return embeddings.embed_query, embeddings.embed_documents
+    if name == "service":
+        embeddings = ServiceEmbeddings(url=args.url)
+        return embeddings.embed_query, embeddings.embed_documents
+    service = EmbeddingService(
+        args.model, quantized=name == "onnx-int8", threads=args.threads, window_ms=args.window_ms, max_batch=args.max_batch
+    )
+    if name == "onnx-int8" and service.backend != "onnx-int8":
+        raise RuntimeError("The export has no int8 model; re-export without --no-quantize")
+    return (lambda text: service.embed_queries([text])[0].tolist()), (lambda texts: service.embed_documents(texts).tolist())
+
+
+def run_queries(embed_query, texts, concurrency, requests_total):
+    """Embeddings/sec and latency (ms) with concurrency threads sharing requests_total single-text calls."""
+    latencies = []
+    lock = threading.Lock()
+    per_thread = max(1, requests_total // concurrency)
+
+    def client(offset):
+        mine = []
+        for i in range(per_thread):
+            # Distinct texts per call, so nothing downstream can serve a repeat
+            text = f"{texts[(offset + i) % len(texts)]} ({offset}-{i})"
+            started = time.perf_counter()
+            embed_query(text)
+            mine.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(offset,)) for offset in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'concurrency': concurrency,
+        'embeddings_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': summarize(latencies),
+    }
+
+
+def corpus_chunks(path, size, count):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    return [text[start:start + size] for start in range(0, len(text), size)][:count]
+
+
+def cosine_agreement(vectors, reference):
+    import numpy as np
+
+    a = np.asarray(vectors, dtype=np.float32)
+    b = np.asarray(reference, dtype=np.float32)
+    cosines = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {'mean': round(float(cosines.mean()), 5), 'min': round(float(cosines.min()), 5)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="huggingface,onnx,onnx-int8")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--concurrency", default="1,4,16,32")
+    parser.add_argument("--requests", type=int, default=512, help="Single-text calls per concurrency level")
+    parser.add_argument("--documents", type=int, default=256, help="Corpus chunks for the embed_documents run (0 to skip)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Characters per chunk, as in ingest.py")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("EMBEDDING_THREADS", min(4, os.cpu_count() or 1))))
+    parser.add_argument("--window-ms", type=float, default=EMBEDDING_BATCH_WINDOW_MS)
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_MAX_BATCH)
+    parser.add_argument("--url", default=os.getenv("EMBEDDING_SERVICE_URL", "http://localhost:5010"))
+    parser.add_argument("--questions", default=os.path.join(BENCHMARK_DIR, "questions.json"))
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/embeddings-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    backends = [name for name in args.backends.split(",") if name]
+    unknown = [name for name in backends if name not in BACKENDS]
+    if unknown:
+        parser.error(f"Unknown backends: {', '.join(unknown)} (choose from {', '.join(BACKENDS)})")
+    with open(args.questions, encoding="utf-8") as f:
+        question_set = json.load(f)
+    texts = [item['question'] for item in question_set['questions']]
+    chunks = corpus_chunks(os.path.join(REPO_ROOT, question_set['corpus']), args.chunk_size, args.documents)
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+
+    started_at = datetime.now()
+    results = {}
+    reference = None
+    for name in backends:
+        print(f"{name}:")
+        load_started = time.perf_counter()
+        embed_query, embed_documents = load_backend(name, args)
+        # First call loads the model and initializes its kernels
+        embed_query("warm up")
+        result = {'load_ms': round((time.perf_counter() - load_started) * 1000, 1), 'queries': []}
+
+        for concurrency in levels:
+            run = run_queries(embed_query, texts, concurrency, args.requests)
+            result['queries'].append(run)
+            print(f"  queries  x{concurrency:<3} {run['embeddings_per_second']:>9.1f} emb/s"
+                  f"  p50 {run['latency_ms']['p50']:>8.2f} ms  p99 {run['latency_ms']['p99']:>8.2f} ms")
+
+        if chunks:
+            doc_started = time.perf_counter()
+            embed_documents(chunks)
+            elapsed = time.perf_counter() - doc_started
+            result['documents'] = {'chunks': len(chunks), 'seconds': round(elapsed, 3),
+                                   'embeddings_per_second': round(len(chunks) / elapsed, 1)}
+            print(f"  documents     {result['documents']['embeddings_per_second']:>9.1f} emb/s ({len(chunks)} chunks)")
+
+        vectors = [embed_query(text) for text in texts]
+        if name == "huggingface":
+            reference = vectors
+        elif reference is not None:
+            result['agreement_with_huggingface'] = cosine_agreement(vectors, reference)
+            print(f"  cosine to huggingface  mean {result['agreement_with_huggingface']['mean']}"
+                  f"  min {result['agreement_with_huggingface']['min']}")
+        results[name] = result
+
+    output = {
+        'meta': {
+            'started_at': started_at.isoformat(timespec="seconds"),
+            'model': args.model,
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'threads': args.threads,
+            'window_ms': args.window_ms,
+            'max_batch': args.max_batch,
+            'requests_per_level': args.requests,
+        },
+        'backends': results,
+    }
+    path = args.output or os.path.join(BENCHMARK_DIR, "results", f"embeddings-{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
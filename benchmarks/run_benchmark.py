@@ -0,0 +1,538 @@
+"""Reproducible benchmark for the retrieval + generation + execution pipeline
+
+Runs the fixed question set in questions.json through the stages the Trino
+query generator uses (embedding, vector or hybrid search, rerank, context
+assembly, generation) and the reference queries through the SQL execution
+server, then writes per-stage latency percentiles, recall@k against the
+labeled documentation pages, tokens per request and per-engine execution
+times to benchmarks/results/<timestamp>.json.
+
+    python benchmarks/run_benchmark.py --retriever faiss --reranker local --llm mock
+    python benchmarks/run_benchmark.py --retriever hybrid --reranker cohere --llm groq --engines mysql,trino
+    python benchmarks/run_benchmark.py --llm groq --generation tiered
+    python benchmarks/run_benchmark.py --compare benchmarks/results/<previous>.json
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Spans are only needed for their timings here, not as a trace file
+os.environ.setdefault("TELEMETRY_EXPORTER", "none")
+# Tiered generation validates against the question set's schema; no Trino dry run unless asked for
+os.environ.setdefault("SQL_VALIDATE_EXPLAIN", "0")
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.append(os.path.join(REPO_ROOT, "backend", "common"))
+from context_budget import assemble_documents
+from telemetry import add_span_listener, remove_span_listener, span, set_service_name
+from prompts import TRINO_SQL
+from query_history import format_examples
+
+# Same embedding model and chunking as QdrantHybrid/sqlQuery/ingest.py
+EMBEDDING_MODEL = os.getenv("BENCHMARK_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+CHUNK_SIZE = int(os.getenv("BENCHMARK_CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("BENCHMARK_CHUNK_OVERLAP", "200"))
+LOCAL_RERANK_MODEL = os.getenv("BENCHMARK_LOCAL_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+TRINO_MODEL = "llama-3.3-70b-versatile"
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(values):
+    """Count, mean, min, max and p50/p90/p95/p99 of a series of measurements."""
+    values = [value for value in values if value is not None]
+    if not values:
+        return {'count': 0}
+    summary = {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 3),
+        'min': round(min(values), 3),
+        'max': round(max(values), 3),
+    }
+    for pct in PERCENTILES:
+        summary[f"p{pct}"] = round(percentile(values, pct), 3)
+    return summary
+
+
+class Corpus:
+    """The documentation file split into chunks, with the doc page(s) each chunk came from."""
+
+    def __init__(self, path):
+        from langchain_core.documents import Document
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        with open(path, encoding="utf-8") as f:
+            self.text = f.read()
+        self.page_starts, self.pages = [], []
+        for match in re.finditer(r"^Source: https://trino\.io/docs/current/(\S+)", self.text, re.MULTILINE):
+            self.page_starts.append(match.start())
+            self.pages.append(match.group(1))
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=["\n\n"], add_start_index=True
+        )
+        self.documents = []
+        for doc in splitter.split_documents([Document(page_content=self.text)]):
+            start = doc.metadata['start_index']
+            doc.metadata['pages'] = self.pages_between(start, start + len(doc.page_content))
+            self.documents.append(doc)
+
+    def pages_between(self, start, end):
+        first = max(0, bisect.bisect_right(self.page_starts, start) - 1)
+        last = bisect.bisect_left(self.page_starts, end)
+        return self.pages[first:max(first + 1, last)]
+
+    def pages_of(self, doc):
+        """Pages of a retrieved chunk, located in the corpus when it carries no labels (e.g. a prebuilt index)."""
+        if 'pages' in doc.metadata:
+            return doc.metadata['pages']
+        start = self.text.find(doc.page_content)
+        return self.pages_between(start, start + len(doc.page_content)) if start >= 0 else []
+
+
+def recall_at_k(docs, relevant, corpus):
+    """Share of the labeled pages that appear among the retrieved chunks."""
+    found = set()
+    for doc in docs:
+        found.update(corpus.pages_of(doc))
+    return len(found & set(relevant)) / len(relevant) if relevant else None
+
+
+def build_retriever(kind, corpus, fetch_k, embeddings, faiss_index_path=None):
+    """Return retrieve(question) -> documents for the chosen backend, recording its stages as spans."""
+    from langchain_community.vectorstores import FAISS
+
+    if faiss_index_path:
+        faiss_index = FAISS.load_local(faiss_index_path, embeddings, allow_dangerous_deserialization=True)
+    else:
+        faiss_index = FAISS.from_documents(corpus.documents, embeddings)
+
+    if kind == "faiss":
+        def retrieve(question):
+            with span("retrieval.embedding"):
+                vector = embeddings.embed_query(question)
+            with span("retrieval.vector_search"):
+                return faiss_index.similarity_search_by_vector(vector, k=fetch_k)
+        return retrieve
+
+    if kind == "hybrid":
+        # BM25 + dense fusion, the same shape as the schema generator's ensemble retriever
+        from langchain.retrievers import EnsembleRetriever
+        from langchain_community.retrievers import BM25Retriever
+
+        bm25 = BM25Retriever.from_documents(corpus.documents, k=fetch_k)
+        ensemble = EnsembleRetriever(
+            retrievers=[bm25, faiss_index.as_retriever(search_kwargs={"k": fetch_k})], weights=[0.5, 0.5]
+        )
+
+        def retrieve(question):
+            with span("retrieval.hybrid_search"):
+                return ensemble.invoke(question)[:fetch_k]
+        return retrieve
+
+    raise ValueError(f"Unknown retriever {kind}")
+
+
+def build_reranker(kind, k):
+    """Return rerank(docs, question) -> top k documents for the chosen backend."""
+    if kind == "none":
+        return lambda docs, question: docs[:k]
+
+    if kind == "cohere":
+        from langchain.retrievers.document_compressors import CohereRerank
+
+        compressor = CohereRerank(cohere_api_key=os.getenv("COHERE_API_KEY"), top_n=k)
+        return lambda docs, question: list(compressor.compress_documents(docs, question))
+
+    if kind == "local":
+        from sentence_transformers import CrossEncoder
+
+        model = CrossEncoder(LOCAL_RERANK_MODEL)
+
+        def rerank(docs, question):
+            if not docs:
+                return []
+            scores = model.predict([(question, doc.page_content) for doc in docs])
+            ranked = sorted(zip(scores, range(len(docs))), reverse=True)
+            return [docs[i] for _, i in ranked[:k]]
+        return rerank
+
+    raise ValueError(f"Unknown reranker {kind}")
+
+
+def start_mock_llm():
+    """Serve backend/common/mock_llm_server.py on a free local port and point the gateway at it."""
+    import logging
+    from werkzeug.serving import make_server
+    from mock_llm_server import app as mock_app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, mock_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/openai/v1"
+    os.environ.setdefault("LLM_API_KEY", "mock")
+    # Groq free-tier pacing would dominate the timings; the mock has no quota
+    os.environ.setdefault("LLM_DEFAULT_RPM", "100000")
+    os.environ.setdefault("LLM_DEFAULT_TPM", "100000000")
+    return server
+
+
+def extract_sql(content):
+    match = re.search(r"QUERY:\s*(.*?)(?:\n\s*EXPLANATION:|$)", content, re.DOTALL)
+    sql = match.group(1) if match else content
+    return re.sub(r"```(?:sql)?", "", sql).strip()
+
+
+def sql_parses(sql):
+    import sqlglot
+
+    try:
+        return bool(sql) and bool(sqlglot.parse(sql, read="trino"))
+    except sqlglot.errors.SqlglotError:
+        return False
+
+
+def schema_tables(schema):
+    """Table -> [(column, type)] from the question set's "Table: name / - column: type" schema text."""
+    tables, current = {}, None
+    for line in schema.splitlines():
+        table = re.match(r"\s*Table:\s*(\w+)", line)
+        column = re.match(r"\s*-\s*(\w+):\s*(.+)", line)
+        if table:
+            current = tables.setdefault(table.group(1), [])
+        elif column and current is not None:
+            current.append((column.group(1), column.group(2).strip().upper()))
+    return tables
+
+
+def trace_stages(spans, trace_id):
+    """Milliseconds per span name within one trace, summed over repeats (retries, repairs).
+
+    A span directly inside a same-named one (the gateway's call span inside the
+    benchmark's generation span) is not counted twice.
+    """
+    names = {finished.span_id: finished.name for finished in spans}
+    stages = {}
+    for finished in spans:
+        if finished.trace_id != trace_id or names.get(finished.parent_id) == finished.name:
+            continue
+        stages[finished.name] = round(stages.get(finished.name, 0.0) + finished.duration_ms, 3)
+    return stages
+
+
+def run_question(item, schema, corpus, retrieve, rerank, gateway, k, generator=None):
+    """Run one question through the pipeline and return its measurements."""
+    record = {'id': item['id']}
+    # Every span of this trace, including the inner ones retrieve(), rerank() and the LLM call open
+    finished = []
+    add_span_listener(finished.append)
+    try:
+        with span("pipeline") as pipeline_span:
+            with span("retrieval"):
+                docs = retrieve(item['question'])
+            record['candidates'] = len(docs)
+            with span("retrieval.rerank"):
+                docs = rerank(docs, item['question'])
+            with span("context_assembly"):
+                context = assemble_documents(docs)
+            record['recall_at_k'] = recall_at_k(docs[:k], item.get('relevant_pages', []), corpus)
+
+            if generator is not None:
+                with span("llm.generate_trino_query"):
+                    served = generator.generate(item['question'], schema, context, tables=schema_tables(schema))
+                record['tokens'] = {
+                    'prompt': served.usage.get('prompt_tokens', 0),
+                    'completion': served.usage.get('completion_tokens', 0),
+                }
+                record['tier'] = served.tier
+                record['tier_reason'] = served.reason
+                record['cost_usd'] = served.cost_usd
+                record['sql_parses'] = sql_parses(served.sql)
+            elif gateway is not None:
+                with span("llm.generate_trino_query"):
+                    result = gateway.chat(
+                        # No few-shot history, so runs stay comparable with each other
+                        TRINO_SQL.messages(schema=schema, context=context, examples=format_examples([]), question=item['question']),
+                        model=TRINO_MODEL,
+                        stage="llm.generate_trino_query",
+                        max_tokens=2000,
+                        temperature=0.3,
+                    )
+                usage = result.usage or {}
+                record['tokens'] = {
+                    'prompt': usage.get('prompt_tokens') or 0,
+                    'completion': usage.get('completion_tokens') or 0,
+                }
+                record['model'] = result.model
+                record['attempts'] = result.attempts
+                record['fallback_used'] = result.fallback_used
+                record['sql_parses'] = sql_parses(extract_sql(result.content))
+    finally:
+        remove_span_listener(finished.append)
+    record['stages'] = trace_stages(finished, pipeline_span.trace_id)
+    return record
+
+
+def run_execution(base_url, engines, queries, repeat, timeout):
+    """Time every reference query on every engine through the SQL execution server."""
+    import requests
+
+    runs = []
+    for _ in range(repeat):
+        for engine in engines:
+            for item in queries:
+                started = time.perf_counter()
+                run = {'id': item['id'], 'engine': engine}
+                try:
+                    response = requests.post(f"{base_url}/execute/{engine}", json={'query': item['sql']}, timeout=timeout)
+                    body = response.json()
+                    run['status'] = response.status_code
+                    if response.ok:
+                        run['rows'] = len(body.get('results') or [])
+                    else:
+                        run['error'] = body.get('error')
+                except Exception as e:
+                    run['status'] = None
+                    run['error'] = str(e)
+                run['latency_ms'] = round((time.perf_counter() - started) * 1000, 3)
+                runs.append(run)
+    return runs
+
+
+def summarize_execution(runs):
+    summary = {}
+    for engine in sorted({run['engine'] for run in runs}):
+        engine_runs = [run for run in runs if run['engine'] == engine]
+        ok = [run for run in engine_runs if run.get('status') == 200]
+        per_query = {}
+        for query_id in sorted({run['id'] for run in engine_runs}):
+            per_query[query_id] = summarize([run['latency_ms'] for run in ok if run['id'] == query_id])
+        summary[engine] = {
+            'latency_ms': summarize([run['latency_ms'] for run in ok]),
+            'errors': len(engine_runs) - len(ok),
+            'queries': per_query,
+        }
+    return summary
+
+
+def summarize_run(records, runs, k, generator=None):
+    stage_names = sorted({name for record in records for name in record['stages']})
+    summary = {
+        'stages_ms': {name: summarize([record['stages'].get(name) for record in records]) for name in stage_names},
+        'retrieval': {
+            'k': k,
+            f"recall_at_{k}": summarize([record['recall_at_k'] for record in records]),
+        },
+    }
+    generated = [record for record in records if 'tokens' in record]
+    if generated:
+        summary['tokens_per_request'] = {
+            'prompt': summarize([record['tokens']['prompt'] for record in generated]),
+            'completion': summarize([record['tokens']['completion'] for record in generated]),
+            'total': summarize([record['tokens']['prompt'] + record['tokens']['completion'] for record in generated]),
+        }
+        summary['generation'] = {
+            'requests': len(generated),
+            'sql_parse_rate': round(sum(record['sql_parses'] for record in generated) / len(generated), 3),
+            'fallbacks': sum(record.get('fallback_used', False) for record in generated),
+            'retries': sum(record.get('attempts', 1) - 1 for record in generated),
+        }
+    if generator is not None:
+        stats = generator.stats()
+        summary['tiers'] = {
+            'escalation_rate': stats['escalation_rate'],
+            'reasons': stats['reasons'],
+            'latency_ms': {
+                tier: summarize([record['stages']['llm.generate_trino_query'] for record in generated if record['tier'] == tier])
+                for tier in stats['tiers']
+            },
+            'cost_usd': {tier: values['cost_usd'] for tier, values in stats['tiers'].items()},
+            'estimated_savings': stats['estimated_savings'],
+        }
+    if runs:
+        summary['execution'] = summarize_execution(runs)
+    return summary
+
+
+def _metrics(summary, prefix=""):
+    """Flatten the comparable numbers of a summary: lower is better except recall, parse rate and savings."""
+    flat = {}
+    for key, value in summary.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            if 'p50' in value:
+                flat[f"{name}.p50"] = value['p50']
+                flat[f"{name}.p95"] = value['p95']
+            else:
+                flat.update(_metrics(value, f"{name}."))
+        elif isinstance(value, (int, float)) and key not in ('k', 'requests', 'count'):
+            flat[name] = value
+    return flat
+
+
+def compare(current, previous, threshold):
+    """Relative change of each metric against a previous result file, flagging regressions."""
+    current_metrics, previous_metrics = _metrics(current), _metrics(previous)
+    changes = []
+    for name in sorted(current_metrics.keys() & previous_metrics.keys()):
+        before, after = previous_metrics[name], current_metrics[name]
+        if before in (None, 0) or after is None:
+            continue
+        change = (after - before) / abs(before)
+        higher_is_better = "recall" in name or "parse_rate" in name or "savings" in name
+        regressed = change < -threshold if higher_is_better else change > threshold
+        # Error counts are worse whenever they grow
+        if name.endswith(".errors"):
+            regressed = after > before
+        changes.append({
+            'metric': name, 'previous': before, 'current': after,
+            'change': round(change, 4), 'regression': regressed,
+        })
+    return changes
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default=os.path.join(BENCHMARK_DIR, "questions.json"))
+    parser.add_argument("--retriever", choices=("faiss", "hybrid"), default="faiss")
+    parser.add_argument("--faiss-index", help="Prebuilt FAISS index directory (default: build from the corpus)")
+    parser.add_argument("--reranker", choices=("cohere", "local", "none"), default="local")
+    parser.add_argument("--llm", choices=("mock", "groq", "none"), default="mock",
+                        help="mock serves backend/common/mock_llm_server.py in-process; groq uses LLM_BASE_URL / GROQ_API_KEY")
+    parser.add_argument("--generation", choices=("direct", "tiered"), default="direct",
+                        help="tiered drafts with the small model and escalates failed or doubtful drafts (backend/common/tiered_generation.py)")
+    parser.add_argument("--k", type=int, default=3, help="Documents kept after reranking (recall@k)")
+    parser.add_argument("--fetch-k", type=int, default=10, help="Candidates retrieved before reranking")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the question set")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed questions run first to load models")
+    parser.add_argument("--execute-url", default="http://localhost:5000")
+    parser.add_argument("--engines", default="", help="Comma separated engines to time, e.g. mysql,trino,spark")
+    parser.add_argument("--execute-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Previous result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    set_service_name("benchmark")
+    with open(args.questions, encoding="utf-8") as f:
+        question_set = json.load(f)
+    question_set_hash = hashlib.sha256(json.dumps(question_set, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+    print(f"Loading corpus {question_set['corpus']}...")
+    corpus = Corpus(os.path.join(REPO_ROOT, question_set['corpus']))
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    print(f"Building {args.retriever} retriever over {len(corpus.documents)} chunks...")
+    retrieve = build_retriever(args.retriever, corpus, args.fetch_k, embeddings, args.faiss_index)
+    rerank = build_reranker(args.reranker, args.k)
+
+    gateway = None
+    if args.llm != "none":
+        if args.llm == "mock":
+            start_mock_llm()
+        from llm_gateway import get_gateway
+        gateway = get_gateway()
+    generator = None
+    if gateway is not None and args.generation == "tiered":
+        from tiered_generation import TieredSQLGenerator
+        generator = TieredSQLGenerator(gateway, escalation_model=TRINO_MODEL)
+
+    questions = question_set['questions']
+    for item in questions[:args.warmup]:
+        run_question(item, question_set['schema'], corpus, retrieve, rerank, gateway, args.k, generator)
+    if generator is not None:
+        # Warm-up questions stay out of the tier report
+        generator = TieredSQLGenerator(gateway, escalation_model=TRINO_MODEL)
+
+    records = []
+    started_at = datetime.now()
+    for repetition in range(args.repeat):
+        for item in questions:
+            record = run_question(item, question_set['schema'], corpus, retrieve, rerank, gateway, args.k, generator)
+            record['repetition'] = repetition
+            records.append(record)
+            print(f"[{repetition + 1}/{args.repeat}] {item['id']}: {record['stages']['pipeline']:.1f} ms, "
+                  f"recall@{args.k}={record['recall_at_k']}")
+
+    engines = [engine for engine in args.engines.split(",") if engine]
+    runs = run_execution(args.execute_url, engines, question_set.get('execution', []), args.repeat, args.execute_timeout)
+
+    summary = summarize_run(records, runs, args.k, generator)
+    result = {
+        'meta': {
+            'started_at': started_at.isoformat(timespec="seconds"),
+            'duration_s': round((datetime.now() - started_at).total_seconds(), 3),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'question_set': {'path': os.path.relpath(args.questions, REPO_ROOT), 'version': question_set.get('version'), 'sha256': question_set_hash},
+            'config': {
+                'retriever': args.retriever, 'faiss_index': args.faiss_index, 'reranker': args.reranker,
+                'llm': args.llm, 'generation': args.generation, 'embedding_model': EMBEDDING_MODEL, 'chunk_size': CHUNK_SIZE,
+                'chunk_overlap': CHUNK_OVERLAP, 'k': args.k, 'fetch_k': args.fetch_k, 'repeat': args.repeat,
+                'warmup': args.warmup, 'engines': engines, 'seed': args.seed,
+            },
+        },
+        'summary': summary,
+        'questions': records,
+        'execution_runs': runs,
+    }
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous['meta']['question_set']['sha256'] != question_set_hash:
+            print("Warning: the previous run used a different question set")
+        changes = compare(summary, previous['summary'], args.threshold)
+        result['comparison'] = {'against': args.compare, 'threshold': args.threshold, 'changes': changes}
+        regressions = [change for change in changes if change['regression']]
+        for change in regressions:
+            print(f"REGRESSION {change['metric']}: {change['previous']} -> {change['current']} ({change['change']:+.1%})")
+
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", f"{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, default=str)
+    print(json.dumps(summary, indent=2))
+    print(f"Results written to {output}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
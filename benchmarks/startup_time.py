@@ -0,0 +1,162 @@
+"""Cold-start measurements for the Flask services
+
+For each service this runs two fresh interpreters:
+    import   python -X importtime loads the module (without its __main__ block);
+             reports wall time and the slowest imports by cumulative time
+    ready    loadtest/stack.py serve starts it; reports time until GET /metrics answers
+and optionally times POST /warmup afterwards. Results go to
+benchmarks/results/startup-<timestamp>.json.
+
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --services sql_execution --repeat 5 --warmup --stack-env
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.append(os.path.join(REPO_ROOT, "loadtest"))
+from stack import SERVICES, service_env
+
+STACK_SCRIPT = os.path.join(REPO_ROOT, "loadtest", "stack.py")
+IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+# Loads the service like stack.py serve does, minus the server
+PROBE = """
+import os, runpy, sys
+path = sys.argv[1]
+sys.path.insert(0, os.path.dirname(path))
+runpy.run_path(path, run_name="startup_probe")
+"""
+
+
+def parse_importtime(stderr, top):
+    """Slowest top-level imports (by cumulative microseconds) from -X importtime output."""
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        # Nesting is shown by two spaces per level after the separator; keep direct imports only
+        if match and len(match.group(3)) <= 1:
+            imports.append({'module': match.group(4), 'self_ms': int(match.group(1)) / 1000, 'cumulative_ms': int(match.group(2)) / 1000})
+    imports.sort(key=lambda item: item['cumulative_ms'], reverse=True)
+    return {
+        'total_import_ms': round(sum(item['cumulative_ms'] for item in imports), 1),
+        'slowest': imports[:top],
+    }
+
+
+def measure_import(path, env, top):
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE, path],
+        cwd=os.path.dirname(path), env=env, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    result = {'wall_ms': round(wall_ms, 1), 'exit_code': process.returncode}
+    result.update(parse_importtime(process.stderr, top))
+    if process.returncode:
+        result['error'] = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed"
+    return result
+
+
+def measure_ready(path, port, env, timeout, warmup):
+    """Seconds from spawning the service to its first /metrics response, then optionally POST /warmup."""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, STACK_SCRIPT, "serve", path, str(port)],
+        cwd=os.path.dirname(path), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    result = {}
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                result['error'] = (process.stderr.read().strip().splitlines() or ["exited"])[-1]
+                return result
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1).ok:
+                    result['ready_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.02)
+        else:
+            result['error'] = f"not ready within {timeout:.0f}s"
+            return result
+        if warmup:
+            warm_started = time.perf_counter()
+            response = requests.post(f"http://127.0.0.1:{port}/warmup", json={}, timeout=timeout)
+            result['warmup_ms'] = round((time.perf_counter() - warm_started) * 1000, 1)
+            result['warmup'] = response.json().get('warmup')
+        return result
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _median(values):
+    values = sorted(value for value in values if value is not None)
+    return values[len(values) // 2] if values else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default=",".join(SERVICES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to keep per service")
+    parser.add_argument("--port", type=int, default=5090, help="Port used for the readiness probe")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--warmup", action="store_true", help="Also time POST /warmup once the service is ready")
+    parser.add_argument("--stack-env", action="store_true",
+                        help="Point the services at the loadtest stand-ins (run loadtest/stack.py prepare and up first)")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/startup-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    env = dict(service_env() if args.stack_env else os.environ, TELEMETRY_EXPORTER="none", WARMUP_ON_START="0")
+    started_at = datetime.now()
+    services = {}
+    for name in [name for name in args.services.split(",") if name]:
+        path, _ = SERVICES[name]
+        imports = [measure_import(path, env, args.top) for _ in range(args.repeat)]
+        ready = [measure_ready(path, args.port, env, args.timeout, args.warmup) for _ in range(args.repeat)]
+        services[name] = {
+            'module': os.path.relpath(path, REPO_ROOT),
+            'import_wall_ms': _median([run['wall_ms'] for run in imports if not run.get('error')]),
+            'ready_ms': _median([run.get('ready_ms') for run in ready]),
+            'warmup_ms': _median([run.get('warmup_ms') for run in ready]) if args.warmup else None,
+            'slowest_imports': imports[-1]['slowest'],
+            'runs': {'import': [{key: value for key, value in run.items() if key != 'slowest'} for run in imports], 'ready': ready},
+        }
+        summary = services[name]
+        errors = [run['error'] for run in imports + ready if run.get('error')]
+        print(f"{name:>22}  import {summary['import_wall_ms'] or 0:>8.1f} ms  ready {summary['ready_ms'] or 0:>8.1f} ms"
+              + (f"  warm-up {summary['warmup_ms'] or 0:>8.1f} ms" if args.warmup else "")
+              + (f"  errors: {errors[0]}" if errors else ""))
+        for item in summary['slowest_imports'][:5]:
+            print(f"{'':>24}{item['cumulative_ms']:>8.1f} ms  {item['module']}")
+
+    result = {
+        'meta': {'started_at': started_at.isoformat(timespec="seconds"), 'python': sys.version.split()[0], 'repeat': args.repeat},
+        'services': services,
+    }
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", f"startup-{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""Open- and closed-loop HTTP load generator for the Flask services
+
+Closed loop: --concurrency workers each send the next request as soon as the
+previous one finishes, which measures peak throughput. Open loop: requests are
+issued at --rps (constant or Poisson arrivals) regardless of how fast the
+service answers, with at most --concurrency in flight; latency is measured
+from the scheduled send time, so queueing delay is not hidden (no coordinated
+omission). Several comma-separated --rps values run as successive steps to
+find where tail latency bends.
+
+    python loadtest/loadgen.py execute_mysql --mode closed --concurrency 16 --duration 60
+    python loadtest/loadgen.py trino_query --mode open --rps 1,2,4,8 --duration 60 --concurrency 64
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+TARGETS = {
+    'sql_execution': os.getenv("LOADTEST_SQL_EXECUTION_URL", "http://127.0.0.1:5000"),
+    'trino_query_generator': os.getenv("LOADTEST_TRINO_QUERY_GENERATOR_URL", "http://127.0.0.1:5001"),
+    'schema_generator': os.getenv("LOADTEST_SCHEMA_GENERATOR_URL", "http://127.0.0.1:5002"),
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = max(1, int(-(-pct * len(values) // 100)))
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return {'count': 0}
+    summary = {'count': len(values), 'mean': round(sum(values) / len(values), 2), 'max': round(values[-1], 2)}
+    for pct in PERCENTILES:
+        summary[f"p{pct:g}"] = round(percentile(values, pct), 2)
+    return summary
+
+
+class Workload:
+    """Weighted request mix for one scenario of workloads.json."""
+
+    def __init__(self, scenario, targets, seed):
+        self.requests = []
+        for item in scenario['requests']:
+            url = item['url'].format(**targets)
+            self.requests.append(dict(item, url=url))
+        self.weights = [item.get('weight', 1) for item in self.requests]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            return self._random.choices(self.requests, self.weights)[0]
+
+
+_sessions = threading.local()
+
+
+def _session():
+    # Keep-alive connection per worker thread
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _sessions.session = session
+    return session
+
+
+def send(item, scheduled, timeout):
+    """Issue one request and return its timings (seconds relative to the perf_counter clock)."""
+    started = time.perf_counter()
+    record = {'name': item.get('name', item['url']), 'scheduled': scheduled, 'started': started}
+    try:
+        response = _session().request(
+            item.get('method', 'POST'), item['url'], json=item.get('json'), timeout=timeout, stream=item.get('stream', False)
+        )
+        if item.get('stream'):
+            size = 0
+            for chunk in response.iter_content(chunk_size=None):
+                if 'first_byte' not in record:
+                    record['first_byte'] = time.perf_counter()
+                size += len(chunk)
+            record.setdefault('first_byte', time.perf_counter())
+        else:
+            record['first_byte'] = time.perf_counter()
+            size = len(response.content)
+        record['status'] = response.status_code
+        record['bytes'] = size
+    except requests.RequestException as e:
+        record['status'] = None
+        record['error'] = type(e).__name__
+    record['finished'] = time.perf_counter()
+    return record
+
+
+def run_closed(workload, concurrency, duration, timeout, think_time):
+    records, lock = [], threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            now = time.perf_counter()
+            record = send(workload.next(), now, timeout)
+            with lock:
+                records.append(record)
+            if think_time:
+                time.sleep(think_time)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+
+def run_open(workload, rps, concurrency, duration, timeout, arrivals, seed):
+    rng = random.Random(seed)
+    futures = []
+    backlog = {'max': 0, 'current': 0}
+    backlog_lock = threading.Lock()
+
+    def task(item, scheduled):
+        with backlog_lock:
+            backlog['current'] -= 1
+        return send(item, scheduled, timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        next_at = start
+        while next_at < start + duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with backlog_lock:
+                backlog['current'] += 1
+                backlog['max'] = max(backlog['max'], backlog['current'])
+            futures.append(pool.submit(task, workload.next(), next_at))
+            next_at += rng.expovariate(rps) if arrivals == "poisson" else 1 / rps
+        records = [future.result() for future in futures]
+    return records, backlog['max']
+
+
+def summarize_step(records, window_start, window_end):
+    """Stats over requests scheduled inside the measurement window (after warm-up)."""
+    measured = [record for record in records if window_start <= record['scheduled'] < window_end]
+    ok = [record for record in measured if record.get('status') and 200 <= record['status'] < 400]
+    statuses = {}
+    for record in measured:
+        key = str(record.get('status') or record.get('error'))
+        statuses[key] = statuses.get(key, 0) + 1
+    elapsed = max((record['finished'] for record in measured), default=window_end) - window_start
+    timeline = {}
+    for record in ok:
+        second = int(record['finished'] - window_start)
+        timeline[second] = timeline.get(second, 0) + 1
+    by_name = {}
+    for record in ok:
+        by_name.setdefault(record['name'], []).append((record['finished'] - record['scheduled']) * 1000)
+    return {
+        'requests': len(measured),
+        'succeeded': len(ok),
+        'error_rate': round(1 - len(ok) / len(measured), 4) if measured else None,
+        'throughput_rps': round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+        'statuses': statuses,
+        # From scheduled send time: includes time queued behind busy workers
+        'latency_ms': summarize([(record['finished'] - record['scheduled']) * 1000 for record in ok]),
+        'service_time_ms': summarize([(record['finished'] - record['started']) * 1000 for record in ok]),
+        'time_to_first_byte_ms': summarize([(record['first_byte'] - record['scheduled']) * 1000 for record in ok]),
+        'by_request': {name: summarize(values) for name, values in sorted(by_name.items())},
+        'completed_per_second': [timeline.get(second, 0) for second in range(int(elapsed) + 1)],
+    }
+
+
+def print_step(label, summary):
+    latency = summary['latency_ms']
+    print(
+        f"{label:>14}  ok {summary['succeeded']:>6}/{summary['requests']:<6} "
+        f"tput {summary['throughput_rps'] or 0:>8.2f}/s  "
+        f"p50 {latency.get('p50', 0):>9.1f}  p95 {latency.get('p95', 0):>9.1f}  "
+        f"p99 {latency.get('p99', 0):>9.1f}  max {latency.get('max', 0):>9.1f} ms  errors {summary['statuses']}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", help="Scenario name from the workloads file")
+    parser.add_argument("--workloads", default=os.path.join(LOADTEST_DIR, "workloads.json"))
+    parser.add_argument("--mode", choices=("open", "closed"), default="closed")
+    parser.add_argument("--concurrency", type=int, default=8, help="Workers (closed) or max in-flight requests (open)")
+    parser.add_argument("--rps", default="1", help="Open loop arrival rate; comma separated values run as steps")
+    parser.add_argument("--arrivals", choices=("constant", "poisson"), default="poisson")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds per step, including warm-up")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds at the start of each step left out of the stats")
+    parser.add_argument("--think-time", type=float, default=0, help="Closed loop pause between requests")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result file (default: loadtest/results/<scenario>-<timestamp>.json)")
+    for name, url in TARGETS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}-url", dest=name, default=url)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.workloads, encoding="utf-8") as f:
+        scenarios = json.load(f)['scenarios']
+    if args.scenario not in scenarios:
+        print(f"Unknown scenario {args.scenario}; available: {', '.join(sorted(scenarios))}")
+        return 1
+    targets = {name: getattr(args, name) for name in TARGETS}
+    workload = Workload(scenarios[args.scenario], targets, args.seed)
+
+    started_at = datetime.now()
+    steps = []
+    rates = [float(rate) for rate in args.rps.split(",")] if args.mode == "open" else [None]
+    for step, rate in enumerate(rates):
+        step_start = time.perf_counter()
+        if args.mode == "closed":
+            records = run_closed(workload, args.concurrency, args.duration, args.timeout, args.think_time)
+            label, backlog = f"closed x{args.concurrency}", None
+        else:
+            records, backlog = run_open(workload, rate, args.concurrency, args.duration, args.timeout, args.arrivals, args.seed + step)
+            label = f"open {rate:g}/s"
+        summary = summarize_step(records, step_start + args.warmup, step_start + args.duration)
+        summary.update(mode=args.mode, concurrency=args.concurrency, target_rps=rate, max_queued=backlog)
+        print_step(label, summary)
+        steps.append(summary)
+
+    result = {
+        'meta': {
+            'scenario': args.scenario,
+            'started_at': started_at.isoformat(timespec="seconds"),
+            'mode': args.mode,
+            'arrivals': args.arrivals if args.mode == "open" else None,
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'targets': targets,
+            'requests': scenarios[args.scenario]['requests'],
+        },
+        'steps': steps,
+    }
+    output = args.output or os.path.join(
+        LOADTEST_DIR, "results", f"{args.scenario}-{started_at.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
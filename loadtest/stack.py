@@ -0,0 +1,232 @@
+"""Run the Flask services against local stand-ins so they can be load-tested on one machine
+
+    python loadtest/stack.py prepare     # seed the SQLite sales DB, build the FAISS index and retriever store
+    python loadtest/stack.py up          # start the mocks and the three services, Ctrl-C to stop
+
+Mocks (in this process):
+    Groq chat completions  backend/common/mock_llm_server.py      :8001
+    Cohere rerank          backend/common/mock_cohere_server.py   :8002
+    Weaviate               backend/common/mock_weaviate_server.py :8003
+
+Services (one threaded WSGI process each, no debug reloader):
+    sql_execution          SQL_Execution/server.py                 :5000
+    trino_query_generator  backend/QdrantHybrid/sqlQuery/main.py   :5001
+    schema_generator       backend/sql_schema_generation_module/temp.py  :5002
+"""
+
+import argparse
+import os
+import runpy
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(LOADTEST_DIR)
+COMMON_DIR = os.path.join(REPO_ROOT, "backend", "common")
+DATA_DIR = os.getenv("LOADTEST_DATA_DIR", os.path.join(LOADTEST_DIR, "data"))
+
+SALES_DB_PATH = os.path.join(DATA_DIR, "sales_standin.db")
+FAISS_INDEX_PATH = os.path.join(DATA_DIR, "faiss_index")
+ENSEMBLE_STORE_PATH = os.path.join(DATA_DIR, "ensemble_retriever_store")
+TRINO_CORPUS = os.path.join(REPO_ROOT, "backend", "sql_query_generator", "trino_data.md")
+OLAP_CORPUS = os.path.join(REPO_ROOT, "backend", "sql_schema_generation_module", "data.pdf")
+
+SERVICES = {
+    'sql_execution': (os.path.join(REPO_ROOT, "SQL_Execution", "server.py"), 5000),
+    'trino_query_generator': (os.path.join(REPO_ROOT, "backend", "QdrantHybrid", "sqlQuery", "main.py"), 5001),
+    'schema_generator': (os.path.join(REPO_ROOT, "backend", "sql_schema_generation_module", "temp.py"), 5002),
+}
+MOCKS = {'llm': 8001, 'cohere': 8002, 'weaviate': 8003}
+
+# Seconds to wait for a service to answer /metrics, and for its POST /warmup
+STARTUP_TIMEOUT = float(os.getenv("LOADTEST_STARTUP_TIMEOUT", "300"))
+
+
+def prepare(args):
+    """Create every data file the services need, from files already in the repo."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    sys.path.append(os.path.join(REPO_ROOT, "SQL_Execution"))
+    from sales_standin import create_sales_db
+
+    print(f"Seeding {SALES_DB_PATH}...")
+    print(create_sales_db(SALES_DB_PATH, args.customers, args.products, args.orders, args.seed))
+
+    print(f"Building FAISS index {FAISS_INDEX_PATH} from {TRINO_CORPUS}...")
+    subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "backend", "QdrantHybrid", "sqlQuery", "ingest.py")],
+        env=dict(os.environ, KNOWLEDGE_BASE_PATH=TRINO_CORPUS, FAISS_INDEX_PATH=FAISS_INDEX_PATH),
+        check=True,
+    )
+
+    print(f"Building ensemble retriever store {ENSEMBLE_STORE_PATH} from {OLAP_CORPUS}...")
+    build_ensemble_store(OLAP_CORPUS, ENSEMBLE_STORE_PATH)
+
+
+def build_ensemble_store(corpus_path, store_path):
+    """BM25 + FAISS ensemble over the OLAP corpus, exported in the format temp.py memory-maps."""
+    from langchain.retrievers import EnsembleRetriever
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_community.retrievers import BM25Retriever
+    from langchain_community.vectorstores import FAISS
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    sys.path.append(os.path.join(REPO_ROOT, "backend", "sql_schema_generation_module"))
+    from retriever_store import export_ensemble
+
+    documents = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=500).split_documents(
+        PyPDFLoader(corpus_path).load()
+    )
+    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    ensemble = EnsembleRetriever(
+        retrievers=[
+            BM25Retriever.from_documents(documents, k=3),
+            FAISS.from_documents(documents, embeddings).as_retriever(search_kwargs={"k": 3}),
+        ],
+        weights=[0.5, 0.5],
+    )
+    manifest = export_ensemble(ensemble, store_path)
+    print(f"Exported {manifest['num_docs']} documents")
+
+
+def service_env():
+    """Environment pointing every external dependency at the local stand-ins."""
+    return dict(
+        os.environ,
+        LLM_BASE_URL=f"http://127.0.0.1:{MOCKS['llm']}/openai/v1",
+        LLM_API_KEY="mock",
+        GROQ_API_KEY="mock",
+        # The mock has no quota, so client-side pacing would only hide server capacity
+        LLM_DEFAULT_RPM=os.getenv("LLM_DEFAULT_RPM", "100000"),
+        LLM_DEFAULT_TPM=os.getenv("LLM_DEFAULT_TPM", "100000000"),
+        CO_API_URL=f"http://127.0.0.1:{MOCKS['cohere']}",
+        COHERE_API_KEY="mock",
+        WEAVIATE_URL=f"http://127.0.0.1:{MOCKS['weaviate']}",
+        WEAVIATE_API_KEY="mock",
+        SALES_DB_STANDIN=SALES_DB_PATH,
+        CATALOG_SOURCE="sqlite",
+        FAISS_INDEX_PATH=FAISS_INDEX_PATH,
+        ENSEMBLE_STORE_PATH=ENSEMBLE_STORE_PATH,
+        # Keep load-test traffic out of the real query history
+        QUERY_HISTORY_DB=os.path.join(DATA_DIR, "query_history.db"),
+        # Separate shared cache tier; set CACHE_SHARED_URL=redis://... to use mock_redis_server.py, CACHE_ENABLED=0 to measure cold paths
+        CACHE_SHARED_URL=os.getenv("CACHE_SHARED_URL", "sqlite:///" + os.path.join(DATA_DIR, "shared_cache.db")),
+        TELEMETRY_EXPORTER=os.getenv("TELEMETRY_EXPORTER", "none"),
+    )
+
+
+def start_mocks():
+    from werkzeug.serving import make_server
+    import logging
+
+    sys.path.append(COMMON_DIR)
+    import mock_llm_server
+    import mock_cohere_server
+    import mock_weaviate_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    apps = {'llm': mock_llm_server.app, 'cohere': mock_cohere_server.app, 'weaviate': mock_weaviate_server.app}
+    servers = []
+    for name, app in apps.items():
+        server = make_server("127.0.0.1", MOCKS[name], app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        print(f"Mock {name} on http://127.0.0.1:{MOCKS[name]}")
+    return servers
+
+
+def wait_ready(name, port, process):
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {process.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/metrics", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"{name} did not become ready within {STARTUP_TIMEOUT:.0f}s")
+
+
+def up(args):
+    missing = [path for path in (SALES_DB_PATH, FAISS_INDEX_PATH, ENSEMBLE_STORE_PATH) if not os.path.exists(path)]
+    if missing:
+        print(f"Missing {', '.join(missing)}; run: python loadtest/stack.py prepare")
+        return 1
+    start_mocks()
+    env = service_env()
+    names = [name for name in args.services.split(",") if name]
+    processes = {}
+    try:
+        for name in names:
+            path, port = SERVICES[name]
+            processes[name] = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "serve", path, str(port)],
+                cwd=os.path.dirname(path), env=env,
+            )
+        for name in names:
+            wait_ready(name, SERVICES[name][1], processes[name])
+            print(f"{name} ready on http://127.0.0.1:{SERVICES[name][1]}")
+        for name in names:
+            # Models and drivers load lazily; load them now so the first measured requests do not pay for it
+            report = requests.post(f"http://127.0.0.1:{SERVICES[name][1]}/warmup", json={}, timeout=STARTUP_TIMEOUT).json()
+            print(f"{name} warmed up: {report.get('warmup')}")
+        print("Stack is up; run loadtest/loadgen.py in another shell. Ctrl-C to stop.")
+        while all(process.poll() is None for process in processes.values()):
+            time.sleep(1)
+        print("A service exited, shutting down")
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def serve(args):
+    """Import a service module (without its __main__ block) and serve its Flask app with threads."""
+    from werkzeug.serving import make_server
+
+    module = os.path.abspath(args.module)
+    os.chdir(os.path.dirname(module))
+    sys.path.insert(0, os.path.dirname(module))
+    namespace = runpy.run_path(module, run_name="loadtest_service")
+    server = make_server("0.0.0.0", args.port, namespace['app'], threaded=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    prepare_parser = commands.add_parser("prepare", help="Create the stand-in data files")
+    prepare_parser.add_argument("--customers", type=int, default=20000)
+    prepare_parser.add_argument("--products", type=int, default=500)
+    prepare_parser.add_argument("--orders", type=int, default=200000)
+    prepare_parser.add_argument("--seed", type=int, default=0)
+    up_parser = commands.add_parser("up", help="Start the mocks and services")
+    up_parser.add_argument("--services", default=",".join(SERVICES))
+    serve_parser = commands.add_parser("serve", help=argparse.SUPPRESS)
+    serve_parser.add_argument("module")
+    serve_parser.add_argument("port", type=int)
+    args = parser.parse_args(argv)
+    return {'prepare': prepare, 'up': up, 'serve': serve}[args.command](args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The services import their shared modules by path, not as packages
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(REPO_ROOT, "backend", "common"), os.path.join(REPO_ROOT, "SQL_Execution")]
+
+os.environ.setdefault("TELEMETRY_EXPORTER", "none")
+os.environ.setdefault("SQL_VALIDATE_EXPLAIN", "0")
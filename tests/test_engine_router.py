@@ -0,0 +1,43 @@
+import pytest
+
+from engine_router import RoutingError, analyze_query, choose_engine
+
+KEYS = {'orders': ['order_id']}
+ROWS = {'orders': 50_000_000, 'customers': 2_000_000}
+
+
+@pytest.mark.parametrize("where", [
+    "order_id = 42",
+    "order_id IN (1, 2, 3)",
+    "status = 'open' AND order_id = 42",
+    "(order_id = 42) AND (total_amount > 10 OR status = 'open')",
+])
+def test_key_pinned_by_every_row_is_a_point_lookup(where):
+    assert analyze_query(f"SELECT * FROM orders WHERE {where}", key_columns=KEYS)['point_lookup']
+
+
+@pytest.mark.parametrize("where", [
+    "order_id = 1 OR total_amount > 0",
+    "NOT order_id = 1",
+    "NOT (order_id = 1 AND status = 'open')",
+    "status = 'open' AND (order_id = 1 OR order_id > 100)",
+    "customer_id = 7",
+])
+def test_key_predicate_that_does_not_bound_the_scan_is_not_a_point_lookup(where):
+    assert not analyze_query(f"SELECT * FROM orders WHERE {where}", key_columns=KEYS)['point_lookup']
+
+
+def test_disjunction_with_a_key_is_routed_as_a_scan():
+    engine, decision = choose_engine("SELECT * FROM orders WHERE order_id = 1 OR total_amount > 0", ROWS, key_columns=KEYS)
+    assert decision['query_class'] == 'large_scan'
+    assert engine == 'trino'
+
+
+def test_key_lookup_is_routed_to_mysql():
+    engine, decision = choose_engine("SELECT * FROM orders WHERE order_id = 1", ROWS, key_columns=KEYS)
+    assert (engine, decision['query_class']) == ('mysql', 'point_lookup')
+
+
+def test_unparseable_query_raises_routing_error():
+    with pytest.raises(RoutingError):
+        choose_engine("SELECT 'unterminated FROM orders", ROWS)
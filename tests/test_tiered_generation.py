@@ -0,0 +1,54 @@
+from llm_gateway import ChatResult, LLMError
+from tiered_generation import TieredSQLGenerator
+
+TABLES = {'orders': [('order_id', 'BIGINT'), ('customer_id', 'BIGINT'), ('total_amount', 'DOUBLE')]}
+ESCALATED = "QUERY:\nSELECT count(*) FROM orders\n\nEXPLANATION:\nCounts orders."
+
+
+class FakeGateway:
+    """Answers each model with a canned response and records how it was called."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def chat(self, messages, model, stage, fallback=True, **params):
+        self.calls.append({'model': model, 'stage': stage, 'fallback': fallback})
+        response = self.responses[model]
+        if isinstance(response, Exception):
+            raise response
+        return ChatResult(response, model, {'prompt_tokens': 100, 'completion_tokens': 20}, 1.0, 1, False, {})
+
+
+def generate(draft, escalation=ESCALATED):
+    gateway = FakeGateway({'draft': draft, 'big': escalation})
+    generator = TieredSQLGenerator(gateway, draft_model='draft', escalation_model='big')
+    return generator.generate("How many orders are there?", "", "", tables=TABLES, explain=None), gateway
+
+
+def test_valid_draft_is_served():
+    served, gateway = generate("QUERY:\nSELECT count(*) FROM orders\nCONFIDENCE: 0.9")
+    assert (served.tier, served.reason) == ("draft", "accepted")
+    assert [call['model'] for call in gateway.calls] == ['draft']
+
+
+def test_prose_draft_without_confidence_escalates():
+    served, _ = generate("Here is the query you asked for")
+    assert (served.tier, served.reason) == ("escalation", "invalid_parse")
+    assert served.sql == "SELECT count(*) FROM orders"
+
+
+def test_misspelled_keyword_draft_escalates():
+    served, _ = generate("QUERY:\nSELEC order_id")
+    assert served.reason == "invalid_parse"
+
+
+def test_escalation_does_not_fall_back_to_the_draft_model():
+    _, gateway = generate("not sql at all")
+    escalations = [call for call in gateway.calls if call['model'] == 'big']
+    assert escalations and all(call['fallback'] is False for call in escalations)
+
+
+def test_doubtful_valid_draft_is_served_when_escalation_fails():
+    served, _ = generate("QUERY:\nSELECT count(*) FROM orders\nCONFIDENCE: 0.2", escalation=LLMError("overloaded", 503))
+    assert (served.tier, served.reason) == ("draft", "escalation_unavailable")
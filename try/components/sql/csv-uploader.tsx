@@ -42,39 +42,27 @@ export function CsvUploader({ onUploadComplete }: CsvUploaderProps) {
     setIsUploading(true)
 
     try {
-      // In production, replace with actual API call
-      // const formData = new FormData();
-      // formData.append('file', file);
-      // const response = await fetch('/api/upload-csv', {
-      //   method: 'POST',
-      //   body: formData,
-      // });
-      // const data = await response.json();
-      // if (data.success) {
-      //   setUploadStatus("success");
-      //   if (onUploadComplete) onUploadComplete();
-      // } else {
-      //   setUploadStatus("error");
-      // }
-
-      // Simulate file upload
-      await new Promise((resolve) => setTimeout(resolve, 2000))
-
-      // 90% chance of success
-      const isSuccess = Math.random() < 0.9
+      const formData = new FormData()
+      formData.append("file", file)
+      const response = await fetch("http://localhost:5000/api/upload-csv", {
+        method: "POST",
+        body: formData,
+      })
+      const data = await response.json()
+      const isSuccess = Boolean(data.success)
 
       if (isSuccess) {
         setUploadStatus("success")
         toast({
           title: "File uploaded successfully",
-          description: "Your CSV file has been processed",
+          description: `Loaded ${data.rows} rows into ${data.table}`,
         })
         if (onUploadComplete) onUploadComplete()
       } else {
         setUploadStatus("error")
         toast({
           title: "Upload failed",
-          description: "There was an error processing your file",
+          description: data.error || "There was an error processing your file",
           variant: "destructive",
         })
       }